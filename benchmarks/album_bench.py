@@ -0,0 +1,99 @@
+# benchmarks/album_bench.py - time to forward one message carrying an album of files
+#
+# Forwards a message with --files attachments of --size bytes through each bridge path against the local stubs
+# (benchmarks/stubs.py), whose --latency per request stands in for a transfer's round trip:
+#   discord_to_slack  : discum_ai_http.forward_files_to_slack() -> one Slack message with every file
+#   slack_to_discord  : discum_ai_http.forward_slack_message_to_discord() -> one Discord DM with every file
+#   slack_to_whatsapp : main_whatsapp.process_slack_to_whatsapp() -> the caption with the first file, then the rest
+# with RELAY_FILE_CONCURRENCY=1 (one file after another) and the given levels, and checks every file arrived.
+#
+# Usage: python benchmarks/album_bench.py [--files 10] [--size 1048576] [--latency 0.1] [--concurrency 4 10]
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("DISCORD_TOKEN", "bench")
+os.environ.setdefault("BRIDGE_DATA_DIR", tempfile.mkdtemp(prefix="bitlink-bench-"))
+os.environ.setdefault("MEDIA_CACHE_MAX_BYTES", "0")  # every level transfers the same files
+
+import discum_ai_http as discord_bridge
+import main_whatsapp as whatsapp_bridge
+import media_relay
+import rate_limiter
+from rate_limiter import RateLimitedAsyncWebClient
+from stubs import FakeDiscordAPI, FakeSlackAPI, FakeWhatsAppGateway, discord_attachment, slack_file
+
+
+def set_concurrency(n):
+    media_relay.RELAY_FILE_CONCURRENCY = discord_bridge.RELAY_FILE_CONCURRENCY = whatsapp_bridge.RELAY_FILE_CONCURRENCY = n
+
+
+async def discord_to_slack(args, slack, discord, gateway):
+    client_info = {"client_name": "Client", "slack_channel_id": "C1"}
+    message = {"content": "album", "attachments": [discord_attachment(discord.url, str(i), args.size, f"{i}.jpg") for i in range(args.files)]}
+    posts_before, bytes_before = len(slack.posts), slack.uploaded_bytes
+    ok = await discord_bridge.forward_files_to_slack(message, client_info)
+    return ok and len(slack.posts) - posts_before == 1 and slack.uploaded_bytes - bytes_before == args.files * args.size
+
+
+async def slack_to_discord(args, slack, discord, gateway):
+    client_info = {"client_name": "Client", "slack_channel_id": "C1", "discord_user_id": "100"}
+    message = {"user": "UTEAM", "text": "album", "ts": f"{time.time():.6f}", "files": [slack_file(slack.url, f"F{i}", args.size, f"{i}.jpg") for i in range(args.files)]}
+    posts_before, bytes_before = len(discord.messages), discord.uploaded_bytes
+    ok = await discord_bridge.forward_slack_message_to_discord(message, client_info)
+    batches = -(-args.files // discord_bridge.DISCORD_MAX_FILES_PER_MESSAGE)
+    return ok and len(discord.messages) - posts_before == batches and discord.uploaded_bytes - bytes_before == args.files * args.size
+
+
+async def slack_to_whatsapp(args, slack, discord, gateway):
+    event = {"channel": "C1", "user": "UTEAM", "text": "album", "ts": f"{time.time():.6f}", "files": [slack_file(slack.url, f"F{i}", args.size, f"{i}.jpg") for i in range(args.files)]}
+    sent_before, bytes_before = len(gateway.sent), gateway.media_bytes
+    ok = await asyncio.get_running_loop().run_in_executor(None, whatsapp_bridge.process_slack_to_whatsapp, event, "xoxb-bench")
+    return ok and len(gateway.sent) - sent_before == args.files and gateway.media_bytes - bytes_before == args.files * args.size
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Album forwarding benchmark")
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--size", type=int, default=1024 * 1024, help="bytes per file")
+    parser.add_argument("--latency", type=float, default=0.1, help="stub latency per request in seconds")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[4, 10])
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+    rate_limiter.SLACK_RATE_LIMIT_SCALE = 1000
+    rate_limiter.DISCORD_ROUTE_LIMIT = rate_limiter.Limit(50, 1, 50)
+
+    slack, discord, gateway = FakeSlackAPI(args.latency), FakeDiscordAPI(args.latency), FakeWhatsAppGateway(args.latency)
+    discord_bridge.slack_client = RateLimitedAsyncWebClient(token="xoxb-bench", base_url=slack.api_url)
+    discord_bridge.DISCORD_API_URL = discord.url
+    whatsapp_bridge.NODE_API_URL = gateway.url
+    whatsapp_bridge.slack_to_whatsapp_map["C1"] = {"whatsapp_chat_id": "923000000000@c.us", "client_name": "Client", "slack_channel_id": "C1"}
+
+    print(f"{args.files} files x {args.size // 1024} KB, {args.latency * 1000:.0f} ms per request")
+    print(f"{'path':<19}" + "".join(f"{f'x{n}':>12}" for n in [1] + args.concurrency))
+    async with aiohttp.ClientSession() as session:
+        discord_bridge.aiohttp_session = session
+        for path in (discord_to_slack, slack_to_discord, slack_to_whatsapp):
+            row = f"{path.__name__:<19}"
+            for concurrency in [1] + args.concurrency:
+                set_concurrency(concurrency)
+                started = time.perf_counter()
+                ok = await path(args, slack, discord, gateway)
+                row += f"{time.perf_counter() - started:>10.2f}s" + (" " if ok else "!")
+            print(row)
+    print("(! = not every file arrived)")
+    for stub in (slack, discord, gateway):
+        stub.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
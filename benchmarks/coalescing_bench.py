@@ -0,0 +1,105 @@
+# benchmarks/coalescing_bench.py - Slack posts and delivery latency for bursty clients, with and without coalescing
+#
+# --clients WhatsApp clients each send --burst short messages --gap seconds apart, all at once, through
+# main_whatsapp.forward_whatsapp_batch() (fed in 100 ms poll batches like the long poll) to the Slack stub
+# (benchmarks/stubs.py), paced by the bridge's rate limiter at Slack's real chat.postMessage limit of about one
+# post per second per channel. Reports Slack posts and each message's latency until it shows in Slack, with
+# coalescing off and with a --window second window, then edits and deletes a merged message and checks that
+# only its line of the post changed.
+#
+# Usage: python benchmarks/coalescing_bench.py [--clients 20] [--burst 8] [--gap 0.3] [--window 1.5]
+
+import argparse
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BRIDGE_DATA_DIR", tempfile.mkdtemp(prefix="bitlink-bench-"))
+
+import main_whatsapp as bridge
+from rate_limiter import RateLimitedWebClient
+from stubs import FakeSlackAPI
+
+TAG = re.compile(r"\bcb-(\d+)-(\d+)\b")
+
+
+def run(args, slack, web_client, window):
+    clients = {f"92300{i:07d}@c.us": {"client_name": f"Client {i}", "whatsapp_chat_id": f"92300{i:07d}@c.us", "slack_channel_id": f"C{window}-{i}",
+                                     "coalesce_window": window} for i in range(args.clients)}
+    bridge.whatsapp_to_slack_map.clear()
+    bridge.whatsapp_to_slack_map.update(clients)
+    bridge.stop_event.clear()
+    flusher = threading.Thread(target=bridge.run_burst_flusher, args=(web_client,), daemon=True)
+    flusher.start()
+    posts_before = len(slack.posts)
+    started = time.perf_counter()
+    schedule = sorted((client * 0.01 + n * args.gap, client, n) for client in range(args.clients) for n in range(args.burst))
+    sent_at = {}
+    while schedule:
+        now = time.perf_counter() - started
+        batch = []
+        while schedule and schedule[0][0] <= now:
+            _, client, n = schedule.pop(0)
+            chat_id = f"92300{client:07d}@c.us"
+            batch.append({"chatId": chat_id, "timestamp": time.time(), "messageId": f"wa-{window}-{client}-{n}", "body": f"cb-{client}-{n} ok thanks"})
+            sent_at[(client, n)] = time.perf_counter()
+        if batch:
+            bridge.forward_whatsapp_batch(web_client, batch, clients)
+        time.sleep(0.1)
+    expected = args.clients * args.burst
+    seen = {}
+    while len(seen) < expected and time.perf_counter() - started < 120:
+        for received_at, _, text in slack.posts[posts_before:]:
+            for client, n in TAG.findall(text or ""):
+                seen.setdefault((int(client), int(n)), received_at)
+        time.sleep(0.05)
+    bridge.stop_event.set()
+    flusher.join()
+    latencies = sorted(seen[key] - sent_at[key] for key in seen)
+    return len(slack.posts) - posts_before, len(seen), latencies, time.perf_counter() - started
+
+
+def check_changes(slack, web_client):
+    """Edits the 2nd and deletes the 3rd message of client 0's first merged post; returns the post's new text."""
+    clients = dict(bridge.whatsapp_to_slack_map)
+    chat_id = "923000000000@c.us"
+    window = clients[chat_id]["coalesce_window"]
+    bridge.forward_whatsapp_batch(web_client, [
+        {"chatId": chat_id, "timestamp": time.time(), "kind": "edit", "messageId": f"wa-{window}-0-1", "body": "cb-0-1 edited"},
+        {"chatId": chat_id, "timestamp": time.time() + 1, "kind": "delete", "messageId": f"wa-{window}-0-2"},
+    ], clients)
+    bridge.whatsapp_to_slack_dispatcher.join()
+    return slack.updates[-1][2] if slack.updates else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Burst coalescing benchmark")
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--burst", type=int, default=8, help="messages per client")
+    parser.add_argument("--gap", type=float, default=0.3, help="seconds between a client's messages")
+    parser.add_argument("--window", type=float, default=1.5, help="coalescing window in seconds")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    bridge.outbox = None
+
+    slack = FakeSlackAPI()
+    web_client = RateLimitedWebClient(token="xoxb-bench", base_url=slack.api_url)
+    print(f"{args.clients} clients x {args.burst} messages {args.gap}s apart, chat.postMessage at 1/s per channel")
+    print(f"{'coalescing':<12}{'posts':>7}{'delivered':>11}{'p50 s':>8}{'p99 s':>8}{'max s':>8}{'total s':>9}")
+    for window in (0, args.window):
+        posts, delivered, latencies, total = run(args, slack, web_client, window)
+        p = lambda q: latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+        print(f"{(f'{window}s' if window else 'off'):<12}{posts:>7}{delivered:>11}{p(0.5):>8.2f}{p(0.99):>8.2f}{latencies[-1]:>8.2f}{total:>9.1f}")
+    text = check_changes(slack, web_client)
+    print(f"after editing message 1 and deleting message 2 of a merged post:\n{text}")
+    slack.close()
+
+
+if __name__ == "__main__":
+    main()
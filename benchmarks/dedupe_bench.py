@@ -0,0 +1,79 @@
+# benchmarks/dedupe_bench.py - "already forwarded?" lookups: deque scan vs DedupeStore
+#
+# Fills both structures with --entries (chat_id, ts) keys, then times --lookups membership checks, half hits
+# and half misses. The deque is unbounded here so it holds the same history; the old maxlen=500 deque was
+# fast only because it forgot everything older than 500 events. Also reports DedupeStore save/load time.
+#
+# Usage: python benchmarks/dedupe_bench.py [--entries 100000] [--lookups 2000]
+
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dedupe_store import DedupeStore
+
+
+def keys(n):
+    return [(f"92300{i % 5000:07d}@c.us", 1700000000 + i) for i in range(n)]
+
+
+def time_lookups(container, probes):
+    started = time.perf_counter()
+    hits = sum(1 for key in probes if key in container)
+    return (time.perf_counter() - started) / len(probes), hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dedupe lookup benchmark")
+    parser.add_argument("--entries", type=int, default=100_000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    entries = keys(args.entries)
+    probes = random.sample(entries, args.lookups // 2) + [(k[0], -k[1]) for k in random.sample(entries, args.lookups // 2)]
+
+    history = deque(entries)
+    deque_per_lookup, deque_hits = time_lookups(history, probes)
+
+    tracemalloc.start()
+    store = DedupeStore()
+    started = time.perf_counter()
+    for key in entries:
+        store.add(key)
+    add_per_key = (time.perf_counter() - started) / len(entries)
+    store_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    store_per_lookup, store_hits = time_lookups(store, probes)
+
+    print(f"{args.entries} entries, {args.lookups} lookups (50% hits)")
+    print(f"deque        {deque_per_lookup * 1e6:10.1f} us/lookup  hits={deque_hits}")
+    print(f"DedupeStore  {store_per_lookup * 1e6:10.1f} us/lookup  hits={store_hits}  add={add_per_key * 1e6:.1f} us  "
+          f"~{store_bytes / 1024 / 1024:.1f} MiB")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "seen.json")
+        persisted = DedupeStore(path=path, save_interval=3600)
+        for key in entries:
+            persisted.add(key)
+        started = time.perf_counter()
+        persisted.close()
+        saved = time.perf_counter() - started
+        started = time.perf_counter()
+        reloaded = DedupeStore(path=path, save_interval=3600)
+        loaded = time.perf_counter() - started
+        print(f"persistence  save {saved * 1000:.0f} ms, load {loaded * 1000:.0f} ms, {len(reloaded)} keys restored, "
+              f"{os.path.getsize(path) / 1024 / 1024:.1f} MiB on disk")
+        reloaded.close()
+
+
+if __name__ == "__main__":
+    main()
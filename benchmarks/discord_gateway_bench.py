@@ -0,0 +1,154 @@
+# benchmarks/discord_gateway_bench.py - cost of the Discord gateway callback for an account in many busy guilds
+#
+# Feeds --events synthetic gateway events to discum_ai_http.on_discord_message() from one "discum" thread, as fast
+# as it takes them. The traffic is that of a user account in --guilds active guilds: guild MESSAGE_CREATEs with
+# members, mentions and embeds, TYPING_STARTs and guild edits, with --dm-ratio of the events being DMs, half of
+# them from mapped clients. Deliveries are counted, not sent; the outbox is a real one in a temp directory.
+# Compares the previous callback (parse every message, write the outbox and wake the loop once per DM, all on
+# the discum thread) with the current one (raw pre-filter, batched hand-off to the loop) and reports events/s
+# on the gateway thread, total CPU and loop wakeups.
+#
+# Usage: python benchmarks/discord_gateway_bench.py [--events 200000] [--guilds 50] [--dm-ratio 0.01] [--clients 200]
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+from discum.gateway.response import Resp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DISCORD_TOKEN", "bench")
+os.environ.setdefault("BRIDGE_DATA_DIR", tempfile.mkdtemp(prefix="bitlink-bench-"))
+
+import discum_ai_http as bridge
+from outbox import Outbox
+
+
+def legacy_on_discord_message(resp):
+    """on_discord_message() before the pre-filter, for comparison."""
+    if resp.event.ready:
+        return
+    if resp.event.message:
+        message_dict = resp.parsed.auto()
+        author_id = message_dict['author']['id']
+        if 'guild_id' not in message_dict and str(author_id) in bridge.discord_id_to_slack_map and author_id != bridge.MY_USER_ID:
+            client_info = bridge.discord_id_to_slack_map[str(author_id)]
+            msg_id = bridge.outbox.enqueue("discord_to_slack", {"message": message_dict, "client_info": client_info}, lane=str(author_id))
+            coro = bridge.deliver_discord_to_slack(msg_id, message_dict, client_info)
+            bridge.main_loop.call_soon_threadsafe(bridge.submit_in_lane, ("discord_to_slack", str(author_id)), coro)
+    elif resp.event.message_updated or resp.event.message_deleted:
+        data = resp.raw.get('d', {})
+        if 'guild_id' not in data and (resp.event.message_deleted or 'content' in data):
+            linked = bridge.message_index.slack_for("discord", data.get('id'))
+            bridge.main_loop.call_soon_threadsafe(bridge.queue_discord_change, data, bool(resp.event.message_deleted), linked)
+
+
+def guild_message(rng, n, guild, author):
+    return {"id": str(10**18 + n), "type": 0, "guild_id": str(guild), "channel_id": str(guild * 100 + rng.randrange(20)), "content": "x" * rng.randrange(10, 300),
+            "author": {"id": str(author), "username": f"user{author}", "discriminator": "0001", "avatar": "a" * 32},
+            "member": {"roles": [str(guild + i) for i in range(3)], "nick": None, "joined_at": "2024-01-01T00:00:00+00:00", "deaf": False, "mute": False},
+            "mentions": [{"id": str(author + 1), "username": "someone"}] if rng.random() < 0.2 else [],
+            "embeds": [{"type": "rich", "title": "link", "url": "https://example.com"}] if rng.random() < 0.1 else [],
+            "attachments": [], "timestamp": "2026-01-01T00:00:00+00:00", "edited_timestamp": None, "tts": False, "mention_everyone": False, "pinned": False}
+
+
+def make_events(args, clients):
+    rng = random.Random(1)
+    events = []
+    for n in range(args.events):
+        roll = rng.random()
+        guild = 10**6 + rng.randrange(args.guilds)
+        if roll < args.dm_ratio:
+            author = rng.choice(clients) if rng.random() < 0.5 else str(10**15 + rng.randrange(10**6))
+            d = {"id": str(10**18 + n), "type": 0, "channel_id": str(10**16 + int(author) % 10**6), "content": "hello", "author": {"id": author, "username": "client"},
+                 "attachments": [], "embeds": [], "mentions": [], "timestamp": "2026-01-01T00:00:00+00:00"}
+            events.append({"op": 0, "t": "MESSAGE_CREATE", "d": d})
+        elif roll < 0.7:
+            events.append({"op": 0, "t": "MESSAGE_CREATE", "d": guild_message(rng, n, guild, 10**12 + rng.randrange(5000))})
+        elif roll < 0.95:
+            events.append({"op": 0, "t": "TYPING_START", "d": {"guild_id": str(guild), "channel_id": str(guild * 100), "user_id": "5", "timestamp": 0}})
+        else:
+            events.append({"op": 0, "t": "MESSAGE_UPDATE", "d": {"id": str(10**18 + n), "guild_id": str(guild), "channel_id": str(guild * 100), "content": "edited"}})
+    return [Resp(event) for event in events]
+
+
+async def run(handler, resps, expected):
+    delivered = 0
+    done = asyncio.Event()
+
+    async def deliver(msg_id, message_dict, client_info):
+        nonlocal delivered
+        delivered += 1
+        if delivered == expected:
+            done.set()
+
+    bridge.deliver_discord_to_slack = deliver
+    bridge.main_loop = loop = asyncio.get_running_loop()
+    bridge.discord_inbox_ready = asyncio.Event()
+    ingest = asyncio.create_task(bridge.run_discord_ingest())
+    wakeups = 0
+    call_soon_threadsafe = loop.call_soon_threadsafe
+
+    def counting_call_soon_threadsafe(*a):
+        nonlocal wakeups
+        wakeups += 1
+        return call_soon_threadsafe(*a)
+
+    loop.call_soon_threadsafe = counting_call_soon_threadsafe
+    gateway_seconds = 0.0
+
+    def gateway():
+        nonlocal gateway_seconds
+        started = time.thread_time()
+        for resp in resps:
+            handler(resp)
+        gateway_seconds = time.thread_time() - started
+
+    cpu_before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+    thread = threading.Thread(target=gateway)
+    thread.start()
+    await loop.run_in_executor(None, thread.join)
+    await asyncio.wait_for(done.wait(), 60)
+    wall = time.perf_counter() - started
+    cpu_after = resource.getrusage(resource.RUSAGE_SELF)
+    loop.call_soon_threadsafe = call_soon_threadsafe
+    ingest.cancel()
+    cpu = cpu_after.ru_utime + cpu_after.ru_stime - cpu_before.ru_utime - cpu_before.ru_stime
+    return len(resps) / gateway_seconds, wall, cpu, wakeups, delivered
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Discord gateway callback benchmark")
+    parser.add_argument("--events", type=int, default=200000)
+    parser.add_argument("--guilds", type=int, default=50)
+    parser.add_argument("--dm-ratio", type=float, default=0.01, help="fraction of events that are DMs")
+    parser.add_argument("--clients", type=int, default=200, help="mapped Discord clients")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    clients = [str(10**15 + i) for i in range(args.clients)]
+    bridge.discord_id_to_slack_map = {c: {"client_name": f"Client {c}", "discord_user_id": c, "slack_channel_id": f"C{c}"} for c in clients}
+    bridge.MY_USER_ID = "1"
+    resps = make_events(args, clients)
+    expected = sum(1 for r in resps if r.raw["t"] == "MESSAGE_CREATE" and "guild_id" not in r.raw["d"] and r.raw["d"]["author"]["id"] in bridge.discord_id_to_slack_map)
+
+    print(f"{args.events} events from {args.guilds} guilds, {args.dm_ratio:.1%} DMs, {expected} from mapped clients")
+    print(f"{'callback':<10}{'events/s':>12}{'wall s':>9}{'CPU s':>8}{'wakeups':>9}{'delivered':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, handler in (("previous", legacy_on_discord_message), ("current", bridge.on_discord_message)):
+            bridge.outbox = Outbox(os.path.join(tmp, f"{name}.db"))
+            rate, wall, cpu, wakeups, delivered = await run(handler, resps, expected)
+            bridge.outbox.close()
+            print(f"{name:<10}{rate:>12,.0f}{wall:>9.2f}{cpu:>8.2f}{wakeups:>9}{delivered:>11}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,341 @@
+# benchmarks/load_harness.py - end-to-end load test of both bridges against local stand-ins
+#
+# Runs main_whatsapp.py and discum_ai_http.py in this process, wired to the stubs from benchmarks/stubs.py
+# (Slack Web API, Discord REST + CDN, the Node WhatsApp service), which run in a child process so they don't
+# count towards the bridges' CPU. Client mappings come from the fake Google Sheet through the real
+# get_client_mappings(). For --duration seconds the load generator sends --rate messages/s in each direction:
+#   whatsapp_to_slack : messages queued on the WhatsApp service, picked up by the long-poll worker
+#   slack_to_whatsapp : Socket Mode events handed to handle_slack_message() from a listener thread pool
+#   discord_to_slack  : MESSAGE_CREATE events fed to on_discord_message() from a single "gateway" thread
+#   slack_to_discord  : Socket Mode events handed to handle_slack_socket_event()
+# spread over --clients clients per platform, with --size bytes of text and, for an --attachment-ratio
+# fraction of messages, --attachments files of --attachment-size bytes (WhatsApp messages carry at most one).
+# Reports per direction the messages delivered, throughput, p50/p99 latency (sent -> stub received) and the
+# bytes uploaded, plus the bridges' CPU time and RSS. Each run is saved as JSON under --results-dir and
+# compared with the previous run there (or --compare FILE).
+# Slack's tiers are scaled by --rate-limit-scale (default x1000) so the run measures the bridges, not Slack's quota.
+#
+# Usage: python benchmarks/load_harness.py [--duration 20] [--rate 20] [--clients 50] [--attachment-ratio 0.1]
+#        [--directions whatsapp_to_slack slack_to_discord ...] [--results-dir benchmarks/results]
+
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import random
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import aiohttp
+from discum.gateway.response import Resp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+os.environ.setdefault("DISCORD_TOKEN", "bench")
+os.environ.setdefault("SLACK_BOT_TOKEN", "xoxb-bench")
+os.environ.setdefault("BRIDGE_DATA_DIR", tempfile.mkdtemp(prefix="bitlink-load-"))
+os.environ.setdefault("MEDIA_CACHE_DIR", tempfile.mkdtemp(prefix="bitlink-media-cache-"))
+
+import discum_ai_http as discord_bridge
+import main_whatsapp as whatsapp_bridge
+import rate_limiter
+from outbox import Outbox
+from rate_limiter import RateLimitedAsyncWebClient, RateLimitedWebClient
+from stubs import FakeSheet, discord_attachment, install_fake_sheets, slack_file
+
+DIRECTIONS = ("whatsapp_to_slack", "slack_to_whatsapp", "discord_to_slack", "slack_to_discord")
+# Where each direction's messages end up
+DESTINATION = {"whatsapp_to_slack": "slack", "discord_to_slack": "slack", "slack_to_whatsapp": "whatsapp", "slack_to_discord": "discord"}
+TAG = re.compile(r"\blt-(\w+?)-(\d+)\b")
+
+
+class Stubs:
+    """The stub process: URLs, WhatsApp message pushes and the final received log."""
+
+    def __init__(self, latency):
+        self.process = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "stubs.py"), "--latency", str(latency)],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        self.urls = json.loads(self.process.stdout.readline())
+        self._lock = threading.Lock()
+
+    def push(self, messages):
+        with self._lock:
+            self.process.stdin.write(json.dumps({"push": messages}) + "\n")
+            self.process.stdin.flush()
+
+    def received(self):
+        with self._lock:
+            self.process.stdin.write(json.dumps({"results": True}) + "\n")
+            self.process.stdin.flush()
+            return json.loads(self.process.stdout.readline())
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+class FakeSocketClient:
+    def send_socket_mode_response(self, response):
+        pass
+
+
+class FakeAsyncSocketClient:
+    async def send_socket_mode_response(self, response):
+        pass
+
+
+def mapping_rows(n_clients):
+    rows = []
+    for i in range(n_clients):
+        rows.append({"client_name": f"WA client {i}", "platform": "WhatsApp", "external_id": f"92300{i:07d}@c.us", "slack_channel_id": f"CWA{i:07d}"})
+        rows.append({"client_name": f"Discord client {i}", "platform": "Discord", "external_id": str(10**17 + i), "slack_channel_id": f"CDC{i:07d}"})
+    return rows
+
+
+class LoadGenerator:
+    def __init__(self, args, stubs):
+        self.args, self.stubs = args, stubs
+        self.sent = {}  # tag -> sent at (wall clock)
+        self.counters = dict.fromkeys(DIRECTIONS, 0)
+        self.socket_listeners = ThreadPoolExecutor(max_workers=10, thread_name_prefix="socket-listener")  # as slack_sdk's SocketModeClient
+        self.discum_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="discum")
+
+    def next_message(self, direction):
+        self.counters[direction] += 1
+        tag = f"lt-{direction}-{self.counters[direction]}"
+        text = f"{tag} " + "x" * max(self.args.size - len(tag) - 1, 0)
+        n_files = self.args.attachments if random.random() < self.args.attachment_ratio else 0
+        self.sent[tag] = time.time()
+        return tag, text, n_files
+
+    def send(self, direction, loop):
+        tag, text, n_files = self.next_message(direction)
+        client = random.randrange(self.args.clients)
+        now = time.time()
+        if direction == "whatsapp_to_slack":
+            msg = {"chatId": f"92300{client:07d}@c.us", "timestamp": now, "body": text, "messageId": f"wa_{tag}", "media": None}
+            if n_files:
+                msg["media"] = {"mimetype": "image/jpeg", "filename": "photo.jpg", "size": self.args.attachment_size}
+            self.stubs.push([msg])
+        elif direction == "slack_to_whatsapp":
+            event = self.slack_event(f"CWA{client:07d}", text, now, n_files, tag)
+            req = SimpleNamespace(type="events_api", envelope_id=tag, payload={"event": event})
+            self.socket_listeners.submit(whatsapp_bridge.handle_slack_message, FakeSocketClient(), req, whatsapp_bridge_web_client)
+        elif direction == "discord_to_slack":
+            message = {"id": f"{tag}", "type": 0, "channel_id": f"9{10**17 + client}", "author": {"id": str(10**17 + client)}, "content": text,
+                       "timestamp": datetime.fromtimestamp(now, timezone.utc).isoformat(),
+                       "attachments": [discord_attachment(self.stubs.urls["discord"], f"{tag}-{i}", self.args.attachment_size) for i in range(n_files)]}
+            self.discum_thread.submit(discord_bridge.on_discord_message, Resp({"op": 0, "t": "MESSAGE_CREATE", "d": message}))
+        else:
+            event = self.slack_event(f"CDC{client:07d}", text, now, n_files, tag)
+            req = SimpleNamespace(type="events_api", envelope_id=tag, payload={"event": event})
+            asyncio.ensure_future(discord_bridge.handle_slack_socket_event(FakeAsyncSocketClient(), req), loop=loop)
+
+    def slack_event(self, channel, text, now, n_files, tag):
+        event = {"type": "message", "channel": channel, "user": "UTEAM", "text": text, "ts": f"{now:.6f}"}
+        if n_files:
+            event["subtype"] = "file_share"
+            event["files"] = [slack_file(self.stubs.urls["slack"], f"F{tag}-{i}", self.args.attachment_size) for i in range(n_files)]
+        return event
+
+    async def run(self, directions):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        next_at = dict.fromkeys(directions, started)
+        while time.perf_counter() - started < self.args.duration:
+            direction = min(next_at, key=next_at.get)
+            await asyncio.sleep(max(next_at[direction] - time.perf_counter(), 0))
+            self.send(direction, loop)
+            next_at[direction] += random.expovariate(self.args.rate)
+
+
+whatsapp_bridge_web_client = None
+
+
+def start_whatsapp_bridge(urls, data_dir):
+    global whatsapp_bridge_web_client
+    whatsapp_bridge.NODE_API_URL = urls["whatsapp"]
+    whatsapp_bridge.WHATSAPP_LONG_POLL_TIMEOUT = 1
+    whatsapp_bridge.outbox = Outbox(os.path.join(data_dir, "load_whatsapp_outbox.db"))
+    whatsapp_bridge_web_client = RateLimitedWebClient(token="xoxb-bench", base_url=f"{urls['slack']}/api/")
+    whatsapp_bridge.reload_config()
+    threading.Thread(target=whatsapp_bridge.poll_whatsapp_and_forward, args=(whatsapp_bridge_web_client,), daemon=True).start()
+    threading.Thread(target=whatsapp_bridge.run_outbox_relay, args=(whatsapp_bridge_web_client,), daemon=True).start()
+
+
+async def start_discord_bridge(urls, data_dir, session):
+    discord_bridge.main_loop = asyncio.get_running_loop()
+    discord_bridge.discord_inbox_ready = asyncio.Event()
+    discord_bridge.slack_inbox_ready = asyncio.Event()
+    discord_bridge.aiohttp_session = session
+    discord_bridge.slack_client = RateLimitedAsyncWebClient(token="xoxb-bench", base_url=f"{urls['slack']}/api/")
+    discord_bridge.DISCORD_API_URL = urls["discord"]
+    discord_bridge.slack_bot_user_id = "UBOT"
+    discord_bridge.MY_USER_ID = "1"
+    discord_bridge.outbox = Outbox(os.path.join(data_dir, "load_discord_outbox.db"))
+    await discord_bridge.reload_config()
+    asyncio.create_task(discord_bridge.run_discord_ingest())
+    asyncio.create_task(discord_bridge.run_slack_ingest())
+    return asyncio.create_task(discord_bridge.run_outbox_relay())
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def summarize(generator, received, directions, started_at):
+    report = {}
+    for direction in directions:
+        latencies, last_at, seen = [], started_at, set()
+        for at, _, text in received[DESTINATION[direction]]:
+            match = TAG.search(text or "")
+            if not match or match.group(1) != direction or match.group(0) in seen:
+                continue
+            seen.add(match.group(0))
+            latencies.append(at - generator.sent[match.group(0)])
+            last_at = max(last_at, at)
+        latencies.sort()
+        report[direction] = {
+            "sent": generator.counters[direction],
+            "delivered": len(latencies),
+            "msg_per_s": len(latencies) / (last_at - started_at) if latencies else 0.0,
+            "p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+            "p99_ms": latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000 if latencies else None,
+        }
+    return report
+
+
+def previous_result(results_dir, current_path):
+    runs = sorted(path for path in glob.glob(os.path.join(results_dir, "load_*.json")) if path != current_path)
+    return runs[-1] if runs else None
+
+
+def print_report(result, baseline=None):
+    def delta(direction, key):
+        before = baseline and baseline["directions"].get(direction, {}).get(key)
+        now = result["directions"][direction][key]
+        return f"{(now - before) / before:+.0%}" if before and now is not None else "-"
+    print(f"{'direction':<19}{'sent':>7}{'delivered':>11}{'msg/s':>9}{'p50 ms':>9}{'p99 ms':>9}" + ("   vs previous: msg/s, p99" if baseline else ""))
+    for direction, r in result["directions"].items():
+        p50 = f"{r['p50_ms']:.0f}" if r["p50_ms"] is not None else "-"
+        p99 = f"{r['p99_ms']:.0f}" if r["p99_ms"] is not None else "-"
+        compared = f"   {delta(direction, 'msg_per_s'):>6} {delta(direction, 'p99_ms'):>6}" if baseline else ""
+        print(f"{direction:<19}{r['sent']:>7}{r['delivered']:>11}{r['msg_per_s']:>9.1f}{p50:>9}{p99:>9}{compared}")
+    usage = result["usage"]
+    print(f"CPU {usage['cpu_seconds']:.1f}s ({usage['cpu_percent']:.0f}% of one core), RSS {usage['rss_mb']:.0f} MB "
+          f"(peak {usage['peak_rss_mb']:.0f} MB), uploaded {usage['uploaded_mb']:.1f} MB")
+    if baseline:
+        before = baseline["usage"]
+        print(f"vs {baseline['saved_as']}: CPU {before['cpu_seconds']:.1f}s, RSS {before['rss_mb']:.0f} MB, peak {before['peak_rss_mb']:.0f} MB")
+
+
+async def run(args, stubs, data_dir):
+    async with aiohttp.ClientSession() as session:
+        relay_task = await start_discord_bridge(stubs.urls, data_dir, session)
+        await asyncio.get_running_loop().run_in_executor(None, start_whatsapp_bridge, stubs.urls, data_dir)
+        generator = LoadGenerator(args, stubs)
+        cpu_before, started_at = cpu_seconds(), time.time()
+        await generator.run(args.directions)
+        # Wait until everything arrived or nothing has moved for --drain seconds
+        delivered, idle_since = -1, time.perf_counter()
+        while time.perf_counter() - idle_since < args.drain:
+            received = stubs.received()
+            # A message can arrive as several posts (e.g. one WhatsApp message per file), so count distinct tags
+            count = len({match.group(0) for destination in ("slack", "discord", "whatsapp")
+                         for _, _, text in received[destination] for match in [TAG.search(text or "")] if match})
+            if count >= len(generator.sent):
+                break
+            if count != delivered:
+                delivered, idle_since = count, time.perf_counter()
+            await asyncio.sleep(0.2)
+        elapsed = time.time() - started_at
+        cpu = cpu_seconds() - cpu_before
+        received = stubs.received()
+        relay_task.cancel()
+    return {
+        "directions": summarize(generator, received, args.directions, started_at),
+        "usage": {
+            "cpu_seconds": cpu,
+            "cpu_percent": cpu / elapsed * 100,
+            "rss_mb": rss_mb(),
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,  # KiB on Linux
+            "uploaded_mb": (received["slack_uploaded_bytes"] + received["discord_uploaded_bytes"] + received["whatsapp_media_bytes"]) / 2**20,
+            "stub_requests": received["requests"],
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test of both bridges against local stubs")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of traffic")
+    parser.add_argument("--rate", type=float, default=20, help="messages per second in each direction")
+    parser.add_argument("--directions", nargs="+", choices=DIRECTIONS, default=list(DIRECTIONS))
+    parser.add_argument("--clients", type=int, default=50, help="clients per platform")
+    parser.add_argument("--size", type=int, default=200, help="bytes of text per message")
+    parser.add_argument("--attachment-ratio", type=float, default=0.1, help="fraction of messages with attachments")
+    parser.add_argument("--attachments", type=int, default=1, help="files per message with attachments")
+    parser.add_argument("--attachment-size", type=int, default=256 * 1024, help="bytes per file")
+    parser.add_argument("--latency", type=float, default=0.01, help="stub latency per request in seconds")
+    parser.add_argument("--drain", type=float, default=10, help="seconds without progress before giving up on stragglers")
+    parser.add_argument("--rate-limit-scale", type=float, default=1000, help="SLACK_RATE_LIMIT_SCALE (1 = Slack's real tiers)")
+    parser.add_argument("--results-dir", default=os.path.join(BENCH_DIR, "results"))
+    parser.add_argument("--compare", help="earlier result file to compare with (default: the previous run in --results-dir)")
+    parser.add_argument("--label", default="", help="note stored with the results")
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+    rate_limiter.SLACK_RATE_LIMIT_SCALE = args.rate_limit_scale
+    rate_limiter.DISCORD_ROUTE_LIMIT = rate_limiter.Limit(1000, 1, 1000)
+
+    data_dir = os.environ["BRIDGE_DATA_DIR"]
+    install_fake_sheets(FakeSheet(mapping_rows(args.clients)))
+    stubs = Stubs(args.latency)
+    try:
+        print(f"{args.rate}/s per direction for {args.duration:.0f}s, {args.clients} clients per platform, {args.size} B text, "
+              f"{args.attachment_ratio:.0%} with {args.attachments} x {args.attachment_size // 1024} KB, {args.latency * 1000:.0f} ms stub latency")
+        result = asyncio.run(run(args, stubs, data_dir))
+    finally:
+        stubs.close()
+
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=BENCH_DIR).stdout.strip()
+    except OSError:
+        revision = ""
+    os.makedirs(args.results_dir, exist_ok=True)
+    path = os.path.join(args.results_dir, f"load_{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    result.update(saved_as=os.path.basename(path), revision=revision, label=args.label, args=vars(args))
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    baseline_path = args.compare or previous_result(args.results_dir, path)
+    baseline = None
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    print(f"saved to {path}")
+    # The bridges' worker threads don't exit on their own
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# benchmarks/mappings_startup_bench.py - client mapping load times: cold vs warm startup, unchanged reloads
+#
+# Replaces gspread.service_account with the in-process fake from stubs.py, whose calls sleep like the real APIs
+# (--auth-latency for the service-account token + open, --rows-latency for get_all_records), then times:
+#   cold start        : no snapshot, mappings come from the sheet
+#   warm start        : a fresh process with the snapshot file from the previous run
+#   unchanged reload  : /refresh when the sheet's revision didn't move
+#   old reload        : the previous get_client_mappings (re-authenticate + download everything)
+#
+# Usage: python benchmarks/mappings_startup_bench.py [--clients 2000] [--auth-latency 0.4] [--rows-latency 0.8]
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import g_sheets_client
+from stubs import FakeSheet, install_fake_sheets
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return (time.perf_counter() - started) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Client mappings startup benchmark")
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--auth-latency", type=float, default=0.4)
+    parser.add_argument("--rows-latency", type=float, default=0.8)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    rows = [{"client_name": f"Client {i}", "platform": "WhatsApp" if i % 2 else "Discord", "external_id": 92300000000 + i,
+             "slack_channel_id": f"C{i:08d}"} for i in range(args.clients)]
+    sheet = FakeSheet(rows, args.rows_latency)
+    install_fake_sheets(sheet, args.auth_latency)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = os.path.join(tmp, "client_mappings.json")
+        g_sheets_client.mappings_store = g_sheets_client.ClientMappingsStore(snapshot)
+        cold, clients = timed(g_sheets_client.get_client_mappings, "WhatsApp", refresh=False)
+        print(f"{args.clients} mappings, {args.auth_latency * 1000:.0f} ms auth, {args.rows_latency * 1000:.0f} ms download")
+        print(f"cold start (no snapshot)   {cold:8.1f} ms  ({len(clients)} WhatsApp clients)")
+
+        def warm_start():
+            g_sheets_client.mappings_store = g_sheets_client.ClientMappingsStore(snapshot)
+            return g_sheets_client.get_client_mappings("WhatsApp", refresh=False)
+        warm, clients = timed(warm_start)
+        print(f"warm start (snapshot)      {warm:8.1f} ms  ({len(clients)} WhatsApp clients)")
+
+        g_sheets_client.get_client_mappings("WhatsApp")  # first refresh authenticates and fetches the revision
+        unchanged, _ = timed(g_sheets_client.get_client_mappings, "WhatsApp")
+        print(f"reload, sheet unchanged    {unchanged:8.1f} ms")
+
+        sheet.version += 1
+        sheet.rows[0]["client_name"] = "Renamed"
+        changed, _ = timed(g_sheets_client.get_client_mappings, "WhatsApp")
+        print(f"reload, one row changed    {changed:8.1f} ms")
+
+    def old_get_client_mappings(platform):
+        gc = g_sheets_client.gspread.service_account(filename=g_sheets_client.CREDENTIALS_FILE)
+        all_clients = gc.open(g_sheets_client.SPREADSHEET_NAME).sheet1.get_all_records()
+        return [c for c in all_clients if c.get('platform', '').lower() == platform.lower()]
+    old, _ = timed(old_get_client_mappings, "WhatsApp")
+    print(f"old reload (every time)    {old:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# benchmarks/media_cache_bench.py - bytes fetched from the source when a delivery with a large file is retried
+#
+# Sends one --size file through each bridge path --attempts times, as a delivery the destination keeps failing
+# would be retried, and once to both Discord and WhatsApp (a Slack file going to two bridges), against the local
+# stubs (benchmarks/stubs.py) with --latency per request. Reports the bytes downloaded from the source and the
+# time taken with the media cache disabled (MEDIA_CACHE_MAX_BYTES=0) and enabled.
+#
+# Usage: python benchmarks/media_cache_bench.py [--size 52428800] [--attempts 3] [--latency 0.05]
+
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("DISCORD_TOKEN", "bench")
+os.environ.setdefault("BRIDGE_DATA_DIR", tempfile.mkdtemp(prefix="bitlink-bench-"))
+os.environ.setdefault("MEDIA_CACHE_DIR", tempfile.mkdtemp(prefix="bitlink-media-cache-"))
+
+import discum_ai_http as discord_bridge
+import main_whatsapp as whatsapp_bridge
+import rate_limiter
+from media_cache import media_cache
+from rate_limiter import RateLimitedAsyncWebClient
+from stubs import FakeDiscordAPI, FakeSlackAPI, FakeWhatsAppGateway, discord_attachment, slack_file
+
+ids = itertools.count()
+
+
+async def discord_to_slack(args, slack, discord):
+    message = {"content": "report", "attachments": [discord_attachment(discord.url, str(next(ids)), args.size, "report.pdf")]}
+    for _ in range(args.attempts):
+        await discord_bridge.forward_files_to_slack(message, {"client_name": "Client", "slack_channel_id": "C1"})
+
+
+async def slack_to_discord(args, slack, discord):
+    message = {"user": "UTEAM", "text": "report", "ts": f"{time.time():.6f}", "files": [slack_file(slack.url, f"F{next(ids)}", args.size, "report.pdf")]}
+    for _ in range(args.attempts):
+        await discord_bridge.forward_slack_message_to_discord(message, {"client_name": "Client", "slack_channel_id": "C1", "discord_user_id": "100"})
+
+
+async def slack_to_whatsapp(args, slack, discord):
+    file_info = slack_file(slack.url, f"F{next(ids)}", args.size, "report.pdf")
+    for _ in range(args.attempts):
+        await asyncio.get_running_loop().run_in_executor(None, whatsapp_bridge.download_slack_file, file_info, "xoxb-bench")
+
+
+async def slack_to_both(args, slack, discord):
+    file_info = slack_file(slack.url, f"F{next(ids)}", args.size, "report.pdf")
+    message = {"user": "UTEAM", "text": "report", "ts": f"{time.time():.6f}", "files": [file_info]}
+    await discord_bridge.forward_slack_message_to_discord(message, {"client_name": "Client", "slack_channel_id": "C1", "discord_user_id": "100"})
+    await asyncio.get_running_loop().run_in_executor(None, whatsapp_bridge.download_slack_file, file_info, "xoxb-bench")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Media cache benchmark")
+    parser.add_argument("--size", type=int, default=50 * 1024 * 1024, help="bytes per file")
+    parser.add_argument("--attempts", type=int, default=3, help="deliveries of the same message")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub latency per request in seconds")
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+    rate_limiter.SLACK_RATE_LIMIT_SCALE = 1000
+
+    slack, discord, gateway = FakeSlackAPI(args.latency), FakeDiscordAPI(args.latency), FakeWhatsAppGateway(args.latency)
+    discord_bridge.slack_client = RateLimitedAsyncWebClient(token="xoxb-bench", base_url=slack.api_url)
+    discord_bridge.DISCORD_API_URL = discord.url
+    whatsapp_bridge.NODE_API_URL = gateway.url
+    max_bytes = media_cache.max_bytes
+
+    print(f"{args.size // (1024 * 1024)} MB file, {args.attempts} attempts, {args.latency * 1000:.0f} ms per request")
+    print(f"{'path':<19}{'cache':>7}{'fetched MB':>12}{'time s':>9}")
+    async with aiohttp.ClientSession() as session:
+        discord_bridge.aiohttp_session = session
+        for path in (discord_to_slack, slack_to_discord, slack_to_whatsapp, slack_to_both):
+            for cache_bytes in (0, max_bytes):
+                media_cache.max_bytes = cache_bytes
+                fetched_before = slack.downloaded_bytes + discord.downloaded_bytes
+                started = time.perf_counter()
+                await path(args, slack, discord)
+                elapsed = time.perf_counter() - started
+                fetched = slack.downloaded_bytes + discord.downloaded_bytes - fetched_before
+                print(f"{path.__name__:<19}{'on' if cache_bytes else 'off':>7}{fetched / (1024 * 1024):>12.0f}{elapsed:>9.2f}")
+    print(f"cache: {media_cache.stats()}")
+    for stub in (slack, discord, gateway):
+        stub.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+# benchmarks/media_relay_bench.py - peak RSS of relaying large files in parallel
+#
+# Starts a local source server (streams N bytes per GET) and sink server (discards uploads), then relays
+# --parallel files of --size-mb each in a fresh child process per mode and reports the child's peak RSS:
+#   buffered - the old path: await response.read(), then POST the bytes
+#   spooled  - media_relay.spooled_download(): chunks go to a SpooledTemporaryFile and are streamed out
+#
+# Usage: python benchmarks/media_relay_bench.py [--parallel 8] [--size-mb 100]
+
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CHUNK = b"\0" * (64 * 1024)
+
+
+async def serve_file(request):
+    n_bytes = int(request.match_info["n_bytes"])
+    response = web.StreamResponse(headers={"Content-Length": str(n_bytes)})
+    await response.prepare(request)
+    sent = 0
+    while sent < n_bytes:
+        chunk = CHUNK[: n_bytes - sent]
+        await response.write(chunk)
+        sent += len(chunk)
+    return response
+
+
+async def sink_upload(request):
+    received = 0
+    async for chunk in request.content.iter_chunked(64 * 1024):
+        received += len(chunk)
+    return web.json_response({"received": received})
+
+
+def start_servers(port):
+    loop = asyncio.new_event_loop()
+    app = web.Application(client_max_size=0)
+    app.add_routes([web.get("/file/{n_bytes}", serve_file), web.post("/upload", sink_upload)])
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+
+async def relay_buffered(session, src, dst):
+    async with session.get(src) as response:
+        data = await response.read()
+    async with session.post(dst, data=data) as response:
+        return (await response.json())["received"]
+
+
+async def relay_spooled(session, src, dst):
+    from media_relay import spooled_download
+    async with spooled_download(session, src) as (spool, size):
+        async with session.post(dst, data=spool) as response:
+            return (await response.json())["received"]
+
+
+async def run_child(mode, port, parallel, n_bytes):
+    relay = relay_buffered if mode == "buffered" else relay_spooled
+    src, dst = f"http://127.0.0.1:{port}/file/{n_bytes}", f"http://127.0.0.1:{port}/upload"
+    async with aiohttp.ClientSession() as session:
+        received = await asyncio.gather(*(relay(session, src, dst) for _ in range(parallel)))
+    assert all(r == n_bytes for r in received), received
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Media relay peak-memory benchmark")
+    parser.add_argument("--parallel", type=int, default=8)
+    parser.add_argument("--size-mb", type=int, default=100)
+    parser.add_argument("--port", type=int, default=8931)
+    parser.add_argument("--child", choices=["buffered", "spooled"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    n_bytes = args.size_mb * 1024 * 1024
+
+    if args.child:
+        started = time.perf_counter()
+        asyncio.run(run_child(args.child, args.port, args.parallel, n_bytes))
+        # ru_maxrss is in KiB on Linux
+        print(f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} {time.perf_counter() - started:.2f}")
+        return
+
+    start_servers(args.port)
+    print(f"Relaying {args.parallel} x {args.size_mb} MB in parallel")
+    print(f"{'mode':<10}{'peak RSS MB':>14}{'seconds':>10}")
+    for mode in ("buffered", "spooled"):
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", mode, "--port", str(args.port),
+             "--parallel", str(args.parallel), "--size-mb", str(args.size_mb)],
+            capture_output=True, text=True, check=True,
+        ).stdout.split()
+        print(f"{mode:<10}{out[0]:>14}{out[1]:>10}")
+
+
+if __name__ == "__main__":
+    main()
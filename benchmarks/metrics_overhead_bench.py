@@ -0,0 +1,50 @@
+# benchmarks/metrics_overhead_bench.py - cost of the metrics calls on the forwarding hot path
+#
+# Times record_delivery() (counter + bytes + latency histogram), a Histogram timer around a no-op, and a
+# full registry render with every direction/endpoint populated, against an empty loop for reference.
+#
+# Usage: python benchmarks/metrics_overhead_bench.py [--iterations 200000]
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import API_CALL_DURATION, record_delivery, registry
+
+
+def per_call(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Metrics overhead benchmark")
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+
+    sent_at = time.time()
+    timer = API_CALL_DURATION.labels("slack", "chat.postMessage")
+
+    def timed_noop():
+        with timer.time():
+            pass
+
+    baseline = per_call(lambda: None, args.iterations)
+    print(f"empty call          {baseline:6.2f} us")
+    print(f"record_delivery()   {per_call(lambda: record_delivery('whatsapp_to_slack', sent_at, 512), args.iterations) - baseline:6.2f} us")
+    print(f"histogram timer     {per_call(timed_noop, args.iterations) - baseline:6.2f} us")
+
+    for direction in ("whatsapp_to_slack", "slack_to_whatsapp", "discord_to_slack", "slack_to_discord"):
+        record_delivery(direction, sent_at, 512)
+    for endpoint in range(20):
+        API_CALL_DURATION.labels("slack", f"method.{endpoint}").observe(0.1)
+    print(f"registry.render()   {per_call(registry.render, 1000):6.0f} us ({len(registry.render())} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# benchmarks/rate_limiter_bench.py - shared rate limiter: priority under contention and 429 handling
+#
+#   priority : one 20 calls/s bucket, --background BACKGROUND callers queued up front (a sweep) while
+#              --interactive INTERACTIVE callers arrive over time; reports each class's wait, with the
+#              interactive calls at INTERACTIVE priority vs at the same priority (plain FIFO)
+#   429      : --calls conversations.history calls from 16 threads against the Slack stub limited to
+#              --stub-limit calls/s, with a plain WebClient (429 = failed call) vs RateLimitedWebClient
+#
+# Usage: python benchmarks/rate_limiter_bench.py [--background 200] [--interactive 20] [--calls 300] [--stub-limit 50]
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import rate_limiter
+from rate_limiter import BACKGROUND, INTERACTIVE, Limit, RateLimitedWebClient, RateLimiter
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+from stubs import FakeSlackAPI
+
+
+def bench_priority(args, interactive_priority):
+    limiter = RateLimiter()
+    limit = Limit(20, 1, 1)
+    waits = {"background": [], "interactive": []}
+
+    def call(kind, priority):
+        started = time.perf_counter()
+        limiter.acquire("bucket", limit, priority)
+        waits[kind].append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=call, args=("background", BACKGROUND)) for _ in range(args.background)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+    for _ in range(args.interactive):
+        thread = threading.Thread(target=call, args=("interactive", interactive_priority))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.25)
+    for thread in threads:
+        thread.join()
+    return statistics.mean(waits["interactive"]), max(waits["interactive"]), statistics.mean(waits["background"])
+
+
+def bench_429(args, client):
+    ok = failed = 0
+    lock = threading.Lock()
+
+    def call(i):
+        nonlocal ok, failed
+        try:
+            client.conversations_history(channel=f"C{i % 20}", limit=1)
+            result = True
+        except SlackApiError:
+            result = False
+        with lock:
+            ok, failed = ok + result, failed + (not result)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(call, range(args.calls)))
+    return ok, failed, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rate limiter benchmark")
+    parser.add_argument("--background", type=int, default=200)
+    parser.add_argument("--interactive", type=int, default=20)
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--stub-limit", type=int, default=50)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    print(f"priority: {args.background} background calls queued, {args.interactive} interactive arriving, 20 calls/s bucket")
+    for label, priority in (("FIFO (same priority)", BACKGROUND), ("interactive first", INTERACTIVE)):
+        mean_wait, max_wait, background_wait = bench_priority(args, priority)
+        print(f"  {label:<22} interactive wait mean {mean_wait * 1000:7.0f} ms, max {max_wait * 1000:7.0f} ms; "
+              f"background mean {background_wait * 1000:6.0f} ms")
+
+    print(f"429: {args.calls} conversations.history calls, 16 threads, stub allows {args.stub_limit}/s")
+    slack = FakeSlackAPI(rate_limit=args.stub_limit)
+    ok, failed, elapsed = bench_429(args, WebClient(token="xoxb-bench", base_url=slack.api_url))
+    print(f"  plain WebClient          {ok:4d} ok, {failed:4d} failed ({slack.rate_limited} x 429) in {elapsed:5.2f}s")
+    slack.close()
+
+    slack = FakeSlackAPI(rate_limit=args.stub_limit)
+    # Pace at 80% of the stub's limit, as the Tier 3 default would be for the real API
+    rate_limiter.SLACK_RATE_LIMIT_SCALE = args.stub_limit * 0.8 * 60 / 50
+    ok, failed, elapsed = bench_429(args, RateLimitedWebClient(token="xoxb-bench", base_url=slack.api_url))
+    print(f"  RateLimitedWebClient     {ok:4d} ok, {failed:4d} failed ({slack.rate_limited} x 429) in {elapsed:5.2f}s")
+    print(f"  limiter counters: {rate_limiter.rate_limiter.stats()}")
+    slack.close()
+
+
+if __name__ == "__main__":
+    main()
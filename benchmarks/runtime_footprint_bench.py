@@ -0,0 +1,129 @@
+# benchmarks/runtime_footprint_bench.py - resources of the two bridge processes vs. bridge_runtime.py
+#
+# Starts the bridges as they run in production - main_whatsapp.py and discum_ai_http.py as two processes, then
+# bridge_runtime.py as one - each in a child process wired to the stubs from benchmarks/stubs.py and the fake
+# Google Sheet, with --clients clients per platform. After --settle seconds each child reports its RSS, threads,
+# open sockets (HTTP pools, long poll, endpoints) and Google Sheets logins. The Discord gateway and the Slack Socket
+# Mode connections can't run against the stubs, so they're left out of the socket counts: both setups hold one
+# Discord gateway session, and the two processes open a Socket Mode connection each where bridge_runtime.py opens one.
+#
+# Usage: python benchmarks/runtime_footprint_bench.py [--clients 200] [--settle 5]
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from stubs import FakeDiscordAPI, FakeSheet, FakeSlackAPI, FakeWhatsAppGateway, install_fake_sheets
+
+
+def mapping_rows(n_clients):
+    rows = []
+    for i in range(n_clients):
+        rows.append({"client_name": f"WA client {i}", "platform": "WhatsApp", "external_id": f"92300{i:07d}@c.us", "slack_channel_id": f"CWA{i:07d}"})
+        rows.append({"client_name": f"Discord client {i}", "platform": "Discord", "external_id": str(10**17 + i), "slack_channel_id": f"CDC{i:07d}"})
+    return rows
+
+
+def usage():
+    with open("/proc/self/status") as f:
+        rss_mb = next(int(line.split()[1]) / 1024 for line in f if line.startswith("VmRSS:"))
+    sockets = 0
+    for fd in os.listdir("/proc/self/fd"):
+        try:
+            sockets += os.readlink(f"/proc/self/fd/{fd}").startswith("socket:")
+        except OSError:
+            pass
+    return {"rss_mb": rss_mb, "threads": threading.active_count(), "sockets": sockets}
+
+
+def child(mode, urls, args):
+    """Runs `mode` (whatsapp, discord or runtime) against the stubs and prints its usage as JSON."""
+    os.environ["NODE_API_URL"] = urls["whatsapp"]
+    logging.disable(logging.CRITICAL)
+    logins = []
+    install_fake_sheets(FakeSheet(mapping_rows(args.clients)))
+    import g_sheets_client
+    service_account = g_sheets_client.gspread.service_account
+    g_sheets_client.gspread.service_account = lambda filename: logins.append(filename) or service_account(filename)
+
+    import aiohttp
+    from rate_limiter import RateLimitedAsyncWebClient, RateLimitedWebClient
+    slack_api_url = f"{urls['slack']}/api/"
+
+    if mode == "whatsapp":
+        import main_whatsapp as whatsapp_bridge
+        whatsapp_bridge.start(RateLimitedWebClient(token="xoxb-bench", base_url=slack_api_url))
+        threading.Thread(target=whatsapp_bridge.run_refresh_server, daemon=True).start()
+        time.sleep(args.settle)
+    else:
+        import discum_ai_http as discord_bridge
+        discord_bridge.DISCORD_API_URL = urls["discord"]
+        gateway_stop = threading.Event()
+        discord_bridge.discum_wrapper = gateway_stop.wait  # no Discord gateway to connect to
+
+        async def run():
+            async with aiohttp.ClientSession() as session:
+                if mode == "runtime":
+                    import bridge_runtime
+                    tasks = await bridge_runtime.start(session, slack_api_url)
+                    tasks.append(asyncio.create_task(bridge_runtime.run_server()))
+                else:
+                    discord_bridge.slack_client = RateLimitedAsyncWebClient(token="xoxb-bench", base_url=slack_api_url)
+                    tasks = await discord_bridge.start(session)
+                    tasks.append(asyncio.create_task(discord_bridge.run_refresh_server()))
+                await asyncio.sleep(args.settle)
+                gateway_stop.set()
+        asyncio.run(run())
+    print(json.dumps(dict(usage(), sheets_logins=len(logins))), flush=True)
+    os._exit(0)  # the bridges' worker threads don't exit on their own
+
+
+def measure(mode, urls, args, env):
+    result = subprocess.run([sys.executable, __file__, "--child", mode, "--urls", json.dumps(urls), "--clients", str(args.clients),
+                             "--settle", str(args.settle)], capture_output=True, text=True, env=env, timeout=args.settle + 120)
+    if result.returncode:
+        sys.exit(f"{mode} child failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Two bridge processes vs. one bridge runtime")
+    parser.add_argument("--clients", type=int, default=200, help="clients per platform")
+    parser.add_argument("--settle", type=float, default=5, help="seconds to run before measuring")
+    parser.add_argument("--child", choices=("whatsapp", "discord", "runtime"), help=argparse.SUPPRESS)
+    parser.add_argument("--urls", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, json.loads(args.urls), args)
+
+    slack, discord, gateway = FakeSlackAPI(), FakeDiscordAPI(), FakeWhatsAppGateway()
+    urls = {"slack": slack.url, "discord": discord.url, "whatsapp": gateway.url}
+    env = dict(os.environ, DISCORD_TOKEN="bench", SLACK_BOT_TOKEN="xoxb-bench", WHATSAPP_LONG_POLL_TIMEOUT="1",
+               MEDIA_CACHE_DIR=tempfile.mkdtemp(prefix="bitlink-media-cache-"), WHATSAPP_REFRESH_PORT="18001", DISCORD_REFRESH_PORT="18002")
+    results = {}
+    for mode in ("whatsapp", "discord", "runtime"):
+        results[mode] = measure(mode, urls, args, dict(env, BRIDGE_DATA_DIR=tempfile.mkdtemp(prefix=f"bitlink-{mode}-")))
+    separate = {key: results["whatsapp"][key] + results["discord"][key] for key in results["runtime"]}
+
+    print(f"{args.clients} clients per platform, measured after {args.settle:.0f}s")
+    print(f"{'':<22}{'processes':>10}{'RSS MB':>9}{'threads':>9}{'sockets':>9}{'Sheets logins':>15}{'Socket Mode':>13}")
+    for label, row, processes, socket_mode in (("main_whatsapp.py", results["whatsapp"], 1, 1), ("discum_ai_http.py", results["discord"], 1, 1),
+                                               ("both, separately", separate, 2, 2), ("bridge_runtime.py", results["runtime"], 1, 1)):
+        print(f"{label:<22}{processes:>10}{row['rss_mb']:>9.1f}{row['threads']:>9}{row['sockets']:>9}{row['sheets_logins']:>15}{socket_mode:>13}")
+    for stub in (slack, discord, gateway):
+        stub.close()
+
+
+if __name__ == "__main__":
+    main()
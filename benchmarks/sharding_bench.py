@@ -0,0 +1,55 @@
+# benchmarks/sharding_bench.py - how evenly the hash ring spreads clients, and how many move when a shard is added
+#
+# Hashes --clients synthetic mapping rows onto 1..--max-shards workers with sharding.ShardMap and reports, per
+# shard count, the largest and smallest share against the ideal 1/N, the fraction of clients that change owner
+# going from N-1 to N shards (ideal: 1/N), and the cost of a full assign() and of an owner_of() lookup.
+#
+# Usage: python benchmarks/sharding_bench.py [--clients 10000] [--max-shards 8] [--vnodes 160]
+
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sharding import ShardMap
+
+
+def owners(rows, shards, vnodes):
+    shard_map = ShardMap(0, shards, [f"http://localhost:{8100 + i}" for i in range(shards)], vnodes)
+    started = time.perf_counter()
+    shard_map.assign(rows, "whatsapp")
+    assign_ms = (time.perf_counter() - started) * 1000
+    return {row["external_id"]: shard_map.shard_of(row["external_id"]) for row in rows}, assign_ms, shard_map
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consistent-hash sharding benchmark")
+    parser.add_argument("--clients", type=int, default=10000)
+    parser.add_argument("--max-shards", type=int, default=8)
+    parser.add_argument("--vnodes", type=int, default=160)
+    args = parser.parse_args()
+    rows = [{"client_name": f"Client {i}", "external_id": f"92300{i:07d}@c.us", "slack_channel_id": f"C{i:09d}"} for i in range(args.clients)]
+
+    print(f"{args.clients} clients, {args.vnodes} points per shard")
+    print(f"{'shards':>6}{'max/ideal':>11}{'min/ideal':>11}{'moved':>9}{'ideal':>8}{'assign':>10}{'lookup':>10}")
+    previous = None
+    for shards in range(1, args.max_shards + 1):
+        assignment, assign_ms, shard_map = owners(rows, shards, args.vnodes)
+        counts = Counter(assignment.values())
+        ideal = args.clients / shards
+        moved = sum(assignment[key] != previous[key] for key in assignment) / args.clients if previous else 0.0
+        keys = [row["slack_channel_id"] for row in rows]
+        started = time.perf_counter()
+        for key in keys:
+            shard_map.owner_of(key)
+        lookup_us = (time.perf_counter() - started) / len(keys) * 1e6
+        print(f"{shards:>6}{max(counts.values()) / ideal:>11.2f}{min(counts.values()) / ideal:>11.2f}{moved:>9.1%}"
+              f"{(1 / shards if previous else 0):>8.1%}{assign_ms:>8.1f}ms{lookup_us:>8.2f}us")
+        previous = assignment
+
+
+if __name__ == "__main__":
+    main()
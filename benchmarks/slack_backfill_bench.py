@@ -0,0 +1,178 @@
+# benchmarks/slack_backfill_bench.py - catching up on Slack messages posted while the bridges were down
+#
+# Saves a cursor for each of --channels channels, posts --missed teammate messages to each of them in the Slack
+# stub (benchmarks/stubs.py) as if the bridges were down, then "restarts" them: the Discord bridge loads its
+# cursors and runs backfill_slack_channels() while teammates keep posting --rate live messages/s as Socket Mode
+# events; the WhatsApp bridge loads its cursors and runs run_slack_reconciler(). Reports missed messages
+# recovered, duplicates, conversations.history calls, the time until the backlog was fetched and until it was
+# delivered, and the live messages' latency (posted -> Discord stub) during the catch-up next to a run without a
+# backlog. Before saved cursors, a restart reset every cursor to the channel's newest message, so none of the
+# missed messages were forwarded.
+# Slack's real Tier 3 pacing applies (conversations.history 50/min) unless --rate-limit-scale raises it.
+#
+# Usage: python benchmarks/slack_backfill_bench.py [--channels 40] [--missed 30] [--rate 5] [--rate-limit-scale 1]
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("DISCORD_TOKEN", "bench")
+os.environ.setdefault("BRIDGE_DATA_DIR", tempfile.mkdtemp(prefix="bitlink-bench-"))
+
+import discum_ai_http as discord_bridge
+import main_whatsapp as whatsapp_bridge
+import rate_limiter
+from dedupe_store import DedupeStore
+from rate_limiter import RateLimitedAsyncWebClient, RateLimitedWebClient
+from slack_cursors import BackfillProgress, SlackCursors
+from stubs import FakeDiscordAPI, FakeSlackAPI, FakeWhatsAppGateway
+
+
+class FakeSocketClient:
+    async def send_socket_mode_response(self, response):
+        pass
+
+
+def save_cursors(path, channels):
+    cursors = SlackCursors(path)
+    for channel in channels:
+        cursors.advance(channel, f"{time.time():.6f}")
+    cursors.close()
+
+
+def post_missed(slack, channels, missed):
+    texts = set()
+    for n in range(missed):
+        for channel in channels:
+            texts.add(slack.post_user_message(channel, f"missed-{channel}-{n}")["text"])
+    return texts
+
+
+def percentiles(latencies):
+    latencies.sort()
+    if not latencies:
+        return float("nan"), float("nan")
+    return statistics.median(latencies) * 1000, latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000
+
+
+async def discord_run(args, missed):
+    slack, discord = FakeSlackAPI(latency=args.latency), FakeDiscordAPI(latency=args.latency)
+    channels = [f"C{i:08d}" for i in range(args.channels)]
+    rate_limiter.rate_limiter = rate_limiter.RateLimiter()
+    discord_bridge.slack_client = RateLimitedAsyncWebClient(token="xoxb-bench", base_url=slack.api_url)
+    discord_bridge.DISCORD_API_URL = discord.url
+    discord_bridge.slack_bot_user_id = "UBOT"
+    discord_bridge.outbox = None
+    discord_bridge.processed_slack_messages = DedupeStore()
+    discord_bridge.slack_to_discord_map = {c: {"slack_channel_id": c, "discord_user_id": str(10**17 + i), "client_name": c, "coalesce_window": 0}
+                                           for i, c in enumerate(channels)}
+    path = os.path.join(tempfile.mkdtemp(prefix="bitlink-cursors-"), "cursors.json")
+    save_cursors(path, channels)
+    missed_texts = post_missed(slack, channels, missed)
+    discord_bridge.slack_channel_state = SlackCursors(path)
+    discord_bridge.slack_backfill = BackfillProgress()
+
+    live = {}
+    async with aiohttp.ClientSession() as session:
+        discord_bridge.aiohttp_session = session
+        discord_bridge.main_loop, discord_bridge.slack_inbox_ready = asyncio.get_running_loop(), asyncio.Event()
+        ingest = asyncio.create_task(discord_bridge.run_slack_ingest())
+        started = time.perf_counter()
+        backfill = asyncio.create_task(discord_bridge.backfill_slack_channels(channels))
+        n = 0
+        # Live traffic for as long as the catch-up takes, and at least --duration seconds
+        while not backfill.done() or time.perf_counter() - started < args.duration:
+            event = slack.post_user_message(random.choice(channels), f"live-{n}")
+            live[event["text"]] = time.perf_counter()
+            req = SimpleNamespace(type="events_api", envelope_id=str(n), payload={"event": event})
+            asyncio.ensure_future(discord_bridge.handle_slack_socket_event(FakeSocketClient(), req))
+            n += 1
+            await asyncio.sleep(random.expovariate(args.rate))
+        caught_up = time.perf_counter() - started
+        deadline = time.perf_counter() + args.drain
+        while time.perf_counter() < deadline and len({text for _, _, text in discord.messages}) < len(missed_texts) + len(live):
+            await asyncio.sleep(0.1)
+        ingest.cancel()
+    slack.close()
+    discord.close()
+
+    received = [text for _, _, text in discord.messages]
+    delivered = max((at for at, _, text in discord.messages if text in missed_texts), default=float("nan")) - started
+    p50, p99 = percentiles([at - live[text] for at, _, text in discord.messages if text in live])
+    return {"recovered": len(missed_texts & set(received)), "missed": len(missed_texts), "duplicates": len(received) - len(set(received)),
+            "history_calls": slack.history_calls, "caught_up_s": caught_up if missed else float("nan"), "delivered_s": delivered, "live": len(live), "p50_ms": p50, "p99_ms": p99}
+
+
+def whatsapp_run(args):
+    slack, gateway = FakeSlackAPI(latency=args.latency), FakeWhatsAppGateway(latency=args.latency)
+    channels = [f"C{i:08d}" for i in range(args.channels)]
+    rate_limiter.rate_limiter = rate_limiter.RateLimiter()
+    web_client = RateLimitedWebClient(token="xoxb-bench", base_url=slack.api_url)
+    whatsapp_bridge.NODE_API_URL = gateway.url
+    whatsapp_bridge.SLACK_RECONCILE_INTERVAL = 3600
+    whatsapp_bridge.outbox = None
+    whatsapp_bridge.slack_web_client = web_client
+    whatsapp_bridge.processed_slack_events = DedupeStore()
+    whatsapp_bridge.slack_to_whatsapp_map.update({c: {"client_name": c, "whatsapp_chat_id": f"92300{i:07d}@c.us", "slack_channel_id": c}
+                                                  for i, c in enumerate(channels)})
+    path = os.path.join(tempfile.mkdtemp(prefix="bitlink-cursors-"), "cursors.json")
+    save_cursors(path, channels)
+    missed_texts = post_missed(slack, channels, args.missed)
+    whatsapp_bridge.slack_cursors = SlackCursors(path)
+    whatsapp_bridge.slack_backfill = BackfillProgress()
+
+    started = time.perf_counter()
+    threading.Thread(target=whatsapp_bridge.run_slack_reconciler, args=(web_client,), daemon=True).start()
+    while not (whatsapp_bridge.slack_backfill.stats() or {}).get("finished"):
+        time.sleep(0.05)
+    caught_up = time.perf_counter() - started
+    deadline = time.perf_counter() + args.drain
+    while time.perf_counter() < deadline and len(gateway.sent) < len(missed_texts):
+        time.sleep(0.1)
+    whatsapp_bridge.stop_event.set()
+    received = [text for _, _, text in gateway.sent]
+    delivered = max((at for at, _, text in gateway.sent if text in missed_texts), default=float("nan")) - started
+    slack.close()
+    gateway.close()
+    return {"recovered": len(missed_texts & set(received)), "missed": len(missed_texts), "duplicates": len(received) - len(set(received)),
+            "history_calls": slack.history_calls, "caught_up_s": caught_up, "delivered_s": delivered}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Slack catch-up after downtime")
+    parser.add_argument("--channels", type=int, default=40)
+    parser.add_argument("--missed", type=int, default=30, help="messages posted to each channel while down")
+    parser.add_argument("--rate", type=float, default=5, help="live Slack messages per second during the catch-up")
+    parser.add_argument("--duration", type=float, default=5, help="minimum seconds of live traffic")
+    parser.add_argument("--latency", type=float, default=0.01, help="stub latency per API call in seconds")
+    parser.add_argument("--drain", type=float, default=20, help="extra seconds to wait for stragglers")
+    parser.add_argument("--rate-limit-scale", type=float, default=1, help="SLACK_RATE_LIMIT_SCALE (1 = Slack's real tiers)")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    rate_limiter.SLACK_RATE_LIMIT_SCALE = args.rate_limit_scale
+    rate_limiter.DISCORD_ROUTE_LIMIT = rate_limiter.Limit(50, 1, 50)
+
+    print(f"{args.channels} channels x {args.missed} missed messages, {args.rate}/s live, Slack tiers x{args.rate_limit_scale:g}")
+    print(f"{'':<22}{'recovered':>12}{'dups':>6}{'history calls':>15}{'fetched s':>11}{'delivered s':>13}{'live':>6}{'live p50 ms':>13}{'live p99 ms':>13}")
+    for label, missed in (("discord, no backlog", 0), ("discord, catching up", args.missed)):
+        r = asyncio.run(discord_run(args, missed))
+        print(f"{label:<22}{r['recovered']:>6}/{r['missed']:<5}{r['duplicates']:>6}{r['history_calls']:>15}{r['caught_up_s']:>11.1f}{r['delivered_s']:>13.1f}{r['live']:>6}{r['p50_ms']:>13.0f}{r['p99_ms']:>13.0f}")
+    r = whatsapp_run(args)
+    print(f"{'whatsapp, catching up':<22}{r['recovered']:>6}/{r['missed']:<5}{r['duplicates']:>6}{r['history_calls']:>15}{r['caught_up_s']:>11.1f}{r['delivered_s']:>13.1f}")
+    os._exit(0)  # the WhatsApp bridge's worker threads don't exit on their own
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# benchmarks/slack_ingest_bench.py - Slack -> Discord ingestion in discum_ai_http.py: polling vs Socket Mode
+#
+# Drives the bridge's own sweep_slack_channels() and handle_slack_socket_event() against the local Slack and
+# Discord stubs (benchmarks/stubs.py) while teammates post --rate messages/s across --channels channels:
+#   poll   - a sweep every --poll-interval seconds
+#   socket - every message is also pushed as a Socket Mode event (each listener call is its own task, as in
+#            slack_sdk), except a --drop fraction that only the sweep every --reconcile-interval recovers
+# Reports Slack history calls per minute, forward latency (posted -> Discord stub) and, from what reached the
+# Discord stub, lost and duplicated messages, dropped events the sweep recovered, and order violations among the
+# pushed messages of a channel (a recovered message necessarily lands after newer pushed ones).
+# Slack's real Tier 3 pacing applies (conversations.history 50/min) unless --rate-limit-scale raises it.
+#
+# With the defaults (5/s for 20 s, 5% of events dropped):
+#   mode     channels  history/min  posted  lost  dupes  recovered  reorder   p50 ms   p99 ms
+#   poll           10          152      94     0      0          0        0     1496    11370
+#   socket         10           56     108     0      0          3        0       11      489
+#   poll          100          140     117    92      0          0        0    10408    27263
+#   socket        100          112      86     5      0          2        0       22     3662
+#   poll         1000          140      97    96      0          0        0    14363    14363
+#   socket       1000          111     112     6      0          0        0       22       24
+# Polling can't keep up past a few dozen channels at 50 history calls a minute. With Socket Mode the live path
+# doesn't depend on the channel count; only the dropped events wait for the reconcile sweep, which takes
+# channels / 50 minutes to go round, so at 100 and 1000 channels most of them outlast a 20 s run.
+#
+# Usage: python benchmarks/slack_ingest_bench.py [--channels 10 100 1000] [--duration 20] [--rate 5] [--drop 0.05]
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("DISCORD_TOKEN", "bench")
+os.environ.setdefault("BRIDGE_DATA_DIR", tempfile.mkdtemp(prefix="bitlink-bench-"))
+
+import discum_ai_http as bridge
+import rate_limiter
+from dedupe_store import DedupeStore
+from rate_limiter import RateLimitedAsyncWebClient
+from slack_cursors import SlackCursors
+from stubs import FakeDiscordAPI, FakeSlackAPI
+
+
+class FakeSocketClient:
+    """Acks take a random few milliseconds, so a later event's listener can get ahead of an earlier one's."""
+
+    async def send_socket_mode_response(self, response):
+        await asyncio.sleep(random.uniform(0, 0.01))
+
+
+async def sweep_forever(interval):
+    while True:
+        await asyncio.sleep(interval)
+        await bridge.sweep_slack_channels()
+
+
+async def run(mode, n_channels, args):
+    slack, discord = FakeSlackAPI(latency=args.latency), FakeDiscordAPI(latency=args.latency)
+    channels = [f"C{i:08d}" for i in range(n_channels)]
+    rate_limiter.rate_limiter = rate_limiter.RateLimiter()  # fresh quotas for every run
+    bridge.slack_client = RateLimitedAsyncWebClient(token="xoxb-bench", base_url=slack.api_url)
+    bridge.DISCORD_API_URL = discord.url
+    bridge.slack_bot_user_id = "UBOT"
+    bridge.outbox = None
+    bridge.processed_slack_messages = DedupeStore()
+    bridge.slack_to_discord_map = {c: {"slack_channel_id": c, "discord_user_id": str(10**17 + i), "client_name": c} for i, c in enumerate(channels)}
+    bridge.slack_channel_state = SlackCursors()
+    for c in channels:
+        bridge.slack_channel_state.advance(c, f"{time.time():.6f}")
+    bridge.slack_channels_warming.clear()
+    posted = {}  # text -> (posted_at, channel, sequence within channel)
+    dropped = set()
+    socket_client = FakeSocketClient()
+
+    async with aiohttp.ClientSession() as session:
+        bridge.aiohttp_session = session
+        bridge.main_loop, bridge.slack_inbox_ready = asyncio.get_running_loop(), asyncio.Event()
+        ingest = asyncio.create_task(bridge.run_slack_ingest())
+        interval = args.poll_interval if mode == "poll" else args.reconcile_interval
+        sweeper = asyncio.create_task(sweep_forever(interval))
+        started = time.perf_counter()
+        sequence = dict.fromkeys(channels, 0)
+        while time.perf_counter() - started < args.duration:
+            channel = random.choice(channels)
+            sequence[channel] += 1
+            text = f"{channel}-{sequence[channel]}"
+            event = slack.post_user_message(channel, text)
+            posted[text] = (time.perf_counter(), channel, sequence[channel])
+            if mode == "socket" and random.random() < args.drop:
+                dropped.add(text)
+            elif mode == "socket":
+                req = SimpleNamespace(type="events_api", envelope_id=text, payload={"event": event})
+                asyncio.ensure_future(bridge.handle_slack_socket_event(socket_client, req))
+            await asyncio.sleep(random.expovariate(args.rate))
+        # Let one more sweep run so dropped events get their chance
+        deadline = time.perf_counter() + interval + args.drain
+        while time.perf_counter() < deadline and len(discord.messages) < len(posted):
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - started
+        sweeper.cancel()
+        while bridge.slack_inbox:
+            await asyncio.sleep(0.05)
+        ingest.cancel()
+        await asyncio.gather(sweeper, ingest, return_exceptions=True)
+        while bridge.delivery_lanes:
+            await asyncio.sleep(0.05)
+    slack.close()
+    discord.close()
+
+    latencies, seen, last_seq, out_of_order = [], set(), {}, 0
+    for received_at, _, text in discord.messages:
+        posted_at, channel, seq = posted[text]
+        latencies.append(received_at - posted_at)
+        seen.add(text)
+        if text in dropped:
+            continue
+        if seq < last_seq.get(channel, 0):
+            out_of_order += 1
+        last_seq[channel] = max(seq, last_seq.get(channel, 0))
+    latencies.sort()
+    return {
+        "calls_per_min": slack.history_calls * 60 / elapsed,
+        "posted": len(posted),
+        "lost": len(posted) - len(seen),
+        "duplicates": len(discord.messages) - len(seen),
+        "out_of_order": out_of_order,
+        "recovered": len(dropped & seen),
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else float("nan"),
+        "p99_ms": latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000 if latencies else float("nan"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Slack ingestion benchmark: polling vs Socket Mode")
+    parser.add_argument("--channels", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--duration", type=float, default=20, help="seconds of traffic per run")
+    parser.add_argument("--rate", type=float, default=5, help="Slack messages per second across all channels")
+    parser.add_argument("--latency", type=float, default=0.01, help="stub latency per API call in seconds")
+    parser.add_argument("--poll-interval", type=float, default=2)
+    parser.add_argument("--reconcile-interval", type=float, default=10)
+    parser.add_argument("--drop", type=float, default=0.05, help="fraction of Socket Mode events never delivered")
+    parser.add_argument("--drain", type=float, default=10, help="extra seconds to wait for stragglers")
+    parser.add_argument("--rate-limit-scale", type=float, default=1, help="SLACK_RATE_LIMIT_SCALE (1 = Slack's real tiers)")
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+    rate_limiter.SLACK_RATE_LIMIT_SCALE = args.rate_limit_scale
+    # Discord allows about 5 messages per 5 s per DM channel; the bench posts faster than that to a few channels
+    rate_limiter.DISCORD_ROUTE_LIMIT = rate_limiter.Limit(50, 1, 50)
+
+    print(f"{args.rate}/s for {args.duration:.0f}s, Slack tiers x{args.rate_limit_scale}, {args.drop:.0%} of Socket Mode events dropped")
+    print(f"{'mode':<8}{'channels':>9}{'history/min':>13}{'posted':>8}{'lost':>6}{'dupes':>7}{'recovered':>11}{'reorder':>9}{'p50 ms':>9}{'p99 ms':>9}")
+    for n_channels in args.channels:
+        for mode in ("poll", "socket"):
+            r = asyncio.run(run(mode, n_channels, args))
+            print(f"{mode:<8}{n_channels:>9}{r['calls_per_min']:>13.0f}{r['posted']:>8}{r['lost']:>6}{r['duplicates']:>7}{r['recovered']:>11}"
+                  f"{r['out_of_order']:>9}{r['p50_ms']:>9.0f}{r['p99_ms']:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# benchmarks/slack_markup_bench.py - API calls and render time for Slack mentions in forwarded text
+#
+# Renders --messages Slack messages, each mentioning up to three of --users teammates plus a channel link and a
+# URL, against the Slack stub (benchmarks/stubs.py) with --latency per request. "users.info" looks every mention up
+# as it's forwarded; "cached" warms slack_markup.SlackNames from users.list first and resolves through it, with
+# --new-users teammates joining after the warm-up (so they're looked up once). Reports API calls and per-message
+# render time. Slack's tiers are scaled x1000: at the real Tier 4 limit (100+ users.info calls a minute),
+# looking up every mention would also queue the messages behind the rate limiter.
+#
+# Usage: python benchmarks/slack_markup_bench.py [--messages 2000] [--users 500] [--new-users 5] [--latency 0.02]
+
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import rate_limiter
+from rate_limiter import RateLimitedWebClient
+from slack_markup import MARKUP, SlackNames
+from stubs import FakeSlackAPI
+
+
+def naive_render(web_client, text):
+    def replace(match):
+        target = match.group(1).split("|")[0]
+        if target.startswith("@"):
+            return "@" + web_client.users_info(user=target[1:])["user"]["profile"]["display_name"]
+        return match.group(0)
+    return MARKUP.sub(replace, text)
+
+
+def messages(args, user_ids):
+    rng = random.Random(1)
+    for n in range(args.messages):
+        mentions = " ".join(f"<@{user_id}>" for user_id in rng.sample(user_ids, rng.randint(1, 3)))
+        yield f"{mentions} see <#C0456|general> and <https://example.com/spec/{n}|the spec> &amp; reply"
+
+
+def run(label, render, slack, texts):
+    lookups_before = slack.lookups
+    times = []
+    started = time.perf_counter()
+    for text in texts:
+        t = time.perf_counter()
+        render(text)
+        times.append(time.perf_counter() - t)
+    total = time.perf_counter() - started
+    times.sort()
+    print(f"{label:<12}{slack.lookups - lookups_before:>14}{times[len(times) // 2] * 1000:>10.2f}{times[int(len(times) * 0.99)] * 1000:>10.2f}{total:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Slack mention rendering benchmark")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=500, help="teammates in the workspace")
+    parser.add_argument("--new-users", type=int, default=5, help="teammates who join after the warm-up")
+    parser.add_argument("--latency", type=float, default=0.02, help="stub latency per request in seconds")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    rate_limiter.SLACK_RATE_LIMIT_SCALE = 1000
+
+    slack = FakeSlackAPI(args.latency)
+    slack.users = {f"U{i:07d}": f"Teammate {i}" for i in range(args.users)}
+    web_client = RateLimitedWebClient(token="xoxb-bench", base_url=slack.api_url)
+    new_users = {f"UNEW{i:04d}": f"New teammate {i}" for i in range(args.new_users)}
+    texts = list(messages(args, list(slack.users) + list(new_users)))
+
+    print(f"{args.messages} messages, {args.users} teammates (+{args.new_users} new), {args.latency * 1000:.0f} ms per request")
+    print(f"{'':<12}{'lookup calls':>14}{'p50 ms':>10}{'p99 ms':>10}{'total s':>9}")
+    slack.users.update(new_users)
+    run("users.info", lambda text: naive_render(web_client, text), slack, texts)
+
+    for user_id in new_users:
+        del slack.users[user_id]
+    names = SlackNames()
+    started = time.perf_counter()
+    names.warm(web_client)
+    pages = -(-args.users // 200)
+    print(f"warm-up: {pages} users.list page(s) in {time.perf_counter() - started:.2f}s")
+    slack.users.update(new_users)
+    run("cached", lambda text: names.resolve(web_client, text), slack, texts)
+    print(f"cache: {names.stats()}")
+    print(f"sample: {names.render(texts[0])}")
+    slack.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# benchmarks/slack_warmup_bench.py - Slack channel cursor warm-up time in discum_ai_http.py
+#
+# startup     : reload_config(refresh=False) with --real-channels mapped channels under Slack's real Tier 3
+#               pacing (conversations.history 50/min, burst 50): how long startup waits (the warm-up runs in
+#               the background) and how long until every channel has its cursor
+# concurrency : warm_up_slack_state() over --channels channels with SLACK_WARMUP_CONCURRENCY=1 (the old
+#               one-channel-at-a-time loop) and the given levels. The client-side pacing is scaled out of the way
+#               here, so these runs measure round-trip overlap only; with the real quota the warm-up is bounded
+#               by 50 calls/min whatever the concurrency, as the startup run shows.
+# Runs against the local Slack stub (benchmarks/stubs.py). A few channels fail on their first call to show
+# they end up initialized by the background retry, and --rate-limit makes the stub answer with 429 +
+# Retry-After above that many calls per second.
+#
+# Usage: python benchmarks/slack_warmup_bench.py [--real-channels 150] [--channels 500] [--concurrency 8 32] [--latency 0.05]
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("DISCORD_TOKEN", "bench")
+os.environ.setdefault("BRIDGE_DATA_DIR", tempfile.mkdtemp(prefix="bitlink-bench-"))
+
+import discum_ai_http as bridge
+import rate_limiter
+from rate_limiter import RateLimitedAsyncWebClient
+from slack_cursors import SlackCursors
+from stubs import FakeSlackAPI
+
+
+async def run(args, concurrency):
+    channels = [f"C{i:08d}" for i in range(args.channels)]
+    failing = channels[::100]
+    slack = FakeSlackAPI(latency=args.latency, rate_limit=args.rate_limit, failing_channels=failing)
+    bridge.slack_client = RateLimitedAsyncWebClient(token="xoxb-bench", base_url=slack.api_url)
+    bridge.SLACK_WARMUP_CONCURRENCY = concurrency
+    bridge.SLACK_WARMUP_RETRY_INTERVAL = 0.5
+    bridge.slack_to_discord_map = {channel: {"slack_channel_id": channel} for channel in channels}
+    bridge.slack_channel_state = SlackCursors()
+    bridge.slack_channels_warming.clear()
+
+    started = time.perf_counter()
+    failed = await bridge.warm_up_slack_state(channels)
+    elapsed = time.perf_counter() - started
+    while bridge.slack_channels_warming:
+        await asyncio.sleep(0.1)
+    settled = time.perf_counter() - started
+    slack.close()
+    return elapsed, len(failed), settled, len(bridge.slack_channel_state), slack.rate_limited
+
+
+async def run_startup(args):
+    channels = [f"C{i:08d}" for i in range(args.real_channels)]
+    slack = FakeSlackAPI(latency=args.latency)
+    rate_limiter.SLACK_RATE_LIMIT_SCALE = 1
+    rate_limiter.rate_limiter = rate_limiter.RateLimiter()
+    bridge.slack_client = RateLimitedAsyncWebClient(token="xoxb-bench", base_url=slack.api_url)
+    bridge.get_client_mappings = lambda platform, refresh=True: [
+        {"client_name": c, "external_id": str(10**17 + i), "slack_channel_id": c} for i, c in enumerate(channels)]
+    bridge.slack_to_discord_map, bridge.discord_id_to_slack_map = {}, {}
+    bridge.slack_channel_state = SlackCursors()
+    bridge.slack_channels_warming.clear()
+
+    started = time.perf_counter()
+    await bridge.reload_config(refresh=False)
+    ready = time.perf_counter() - started
+    while bridge.slack_channels_warming:
+        await asyncio.sleep(0.2)
+    warmed = time.perf_counter() - started
+    slack.close()
+    return ready, warmed, len(bridge.slack_channel_state)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Slack channel warm-up benchmark")
+    parser.add_argument("--real-channels", type=int, default=150, help="channels for the real-quota startup run (0 = skip)")
+    parser.add_argument("--channels", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8, 32])
+    parser.add_argument("--latency", type=float, default=0.05, help="stub latency per call in seconds")
+    parser.add_argument("--rate-limit", type=int, default=0, help="stub calls/second before 429s (0 = unlimited)")
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+
+    if args.real_channels:
+        print(f"startup: {args.real_channels} channels, Slack's real Tier 3 pacing")
+        ready, warmed, initialized = await run_startup(args)
+        print(f"  reload_config() returned after {ready * 1000:8.1f} ms; all {initialized} cursors fetched after {warmed:6.1f}s in the background")
+
+    rate_limiter.SLACK_RATE_LIMIT_SCALE = 1000
+    rate_limiter.rate_limiter = rate_limiter.RateLimiter()
+    print(f"concurrency (pacing scaled x1000): {args.channels} channels, {args.latency * 1000:.0f} ms per call, rate limit {args.rate_limit or 'off'}")
+    for concurrency in [1] + args.concurrency:
+        elapsed, failed, settled, initialized, rate_limited = await run(args, concurrency)
+        print(f"concurrency {concurrency:3d}: warm-up {elapsed:6.2f}s, {failed} failed -> all {initialized} initialized "
+              f"after {settled:6.2f}s (background retry), {rate_limited} x 429")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,519 @@
+# benchmarks/stubs.py - in-process stand-ins for the Slack Web API, the Discord REST API, the Node WhatsApp service
+# and the Google Sheets client mappings
+#
+# Each HTTP stub is a keep-alive HTTP/1.1 server on a free localhost port running in a daemon thread, with an
+# optional fixed latency per request, so the bridges can be driven without touching the real services.
+
+import argparse
+import itertools
+import json
+import re
+import socket
+import sys
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # the default listen backlog of 5 resets bursts of new connections
+
+
+def _read_chunked(rfile):
+    body = bytearray()
+    while True:
+        size = int(rfile.readline().split(b";")[0], 16)
+        if size == 0:
+            rfile.readline()
+            return bytes(body)
+        body += rfile.read(size)
+        rfile.readline()
+
+
+def _parse_multipart(content_type, raw):
+    """Form fields of a multipart body: text fields as str, files as bytes."""
+    message = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + raw)
+    fields = {}
+    for part in message.iter_parts():
+        data = part.get_payload(decode=True)
+        fields[part.get_param("name", header="content-disposition")] = data if part.get_filename() else data.decode()
+    return fields
+
+
+class StubServer:
+    """Routes "METHOD /path" to handler(query, body) -> (status, json_payload[, extra_headers]). A str payload is
+    sent as text, bytes as a file. Paths with {name} segments match any value, passed to the handler as extra
+    keyword arguments. JSON, form (under /api/) and multipart bodies are parsed into dicts."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self.routes = {}
+        self.patterns = []  # (method, compiled path, handler)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                # Headers and body go out in separate writes; without this, Nagle + delayed ACK stall keep-alive clients.
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def _dispatch(self, method):
+                url = urlparse(self.path)
+                if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                    raw = _read_chunked(self.rfile)
+                else:
+                    length = int(self.headers.get("Content-Length") or 0)
+                    raw = self.rfile.read(length) if length else b""
+                body = raw
+                content_type = self.headers.get("Content-Type", "")
+                if "json" in content_type and raw:
+                    body = json.loads(raw)
+                elif "x-www-form-urlencoded" in content_type and url.path.startswith("/api/"):
+                    # (slack_sdk's sync upload to the upload URL comes without a Content-Type, which urllib sends as a form)
+                    body = {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+                elif content_type.startswith("multipart/form-data"):
+                    body = _parse_multipart(content_type, raw)
+                stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                handler, params = stub.routes.get(f"{method} {url.path}"), {}
+                for route_method, pattern, route_handler in stub.patterns if handler is None else ():
+                    match = pattern.fullmatch(url.path)
+                    if route_method == method and match:
+                        handler, params = route_handler, match.groupdict()
+                        break
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                result = handler(query, body, **params) if handler else (404, {"error": "not_found"})
+                status, payload, extra_headers = result if len(result) == 3 else (*result, {})
+                if isinstance(payload, bytes):
+                    data, content_type = payload, "application/octet-stream"
+                elif isinstance(payload, str):
+                    data, content_type = payload.encode(), "text/plain"
+                else:
+                    data, content_type = json.dumps(payload).encode(), "application/json"
+                self.send_response(status)
+                for name, value in extra_headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def do_PATCH(self):
+                self._dispatch("PATCH")
+
+            def do_DELETE(self):
+                self._dispatch("DELETE")
+
+        self.server = _Server(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def route(self, method, path):
+        def register(handler):
+            if "{" in path:
+                self.patterns.append((method, re.compile(re.sub(r"\{(\w+)\}", r"(?P<\1>[^/]+)", path)), handler))
+            else:
+                self.routes[f"{method} {path}"] = handler
+            return handler
+        return register
+
+    def close(self):
+        self.server.shutdown()
+
+
+class FakeSlackAPI(StubServer):
+    """Slack Web API subset used by the bridges. Point WebClient(base_url=fake.api_url) at it.
+
+    `rate_limit` (requests/second, 0 = off) answers excess calls with 429 + Retry-After like Slack's tiers;
+    channel IDs in `failing_channels` get an internal_error from conversations.history `fail_times` times.
+    post_user_message() adds to a channel's history, which conversations.history then pages through like Slack
+    (newest first, `oldest` exclusive); channels without history answer with a single "latest" message.
+    `users` (user ID -> display name) backs users.list, paged like Slack, and users.info; `lookups` counts the
+    users.info and conversations.info calls.
+    Uploads (files.getUploadURLExternal, the upload URL, files.completeUploadExternal) land in `posts` with their
+    initial comment and `uploaded_bytes`; slack_file() makes a file whose download URL serves zero bytes.
+    """
+
+    def __init__(self, latency=0.0, rate_limit=0, failing_channels=(), fail_times=1):
+        super().__init__(latency)
+        self.api_url = f"{self.url}/api/"
+        self.posts = []  # (received_at, channel, text)
+        self.rate_limit = rate_limit
+        self.rate_limited = 0
+        self.failures_left = {channel: fail_times for channel in failing_channels}
+        self.history = {}  # channel -> [message], oldest first
+        self.history_calls = 0
+        self.updates = []  # (channel, ts, text)
+        self.deletes = []  # (channel, ts)
+        self.uploaded_bytes = 0
+        self.downloaded_bytes = 0
+        self.users = {}
+        self.lookups = 0
+        self._window = [0, 0]  # (second, calls in that second)
+        self._ts = itertools.count(1)
+        self._lock = threading.Lock()
+
+        @self.route("GET", "/api/conversations.history")
+        @self.route("POST", "/api/conversations.history")
+        def conversations_history(query, body):
+            params = {**query, **(body if isinstance(body, dict) else {})}
+            channel = params.get("channel")
+            with self._lock:
+                self.history_calls += 1
+                now = int(time.time())
+                if self._window[0] != now:
+                    self._window = [now, 0]
+                self._window[1] += 1
+                if self.rate_limit and self._window[1] > self.rate_limit:
+                    self.rate_limited += 1
+                    return 429, {"ok": False, "error": "ratelimited"}, {"Retry-After": "1"}
+                if self.failures_left.get(channel, 0) > 0:
+                    self.failures_left[channel] -= 1
+                    return 200, {"ok": False, "error": "internal_error"}
+                if channel in self.history:
+                    oldest = float(params.get("oldest") or 0)
+                    newer = [m for m in reversed(self.history[channel]) if float(m["ts"]) > oldest]
+                    start, limit = int(params.get("cursor") or 0), int(params.get("limit") or 100)
+                    page = newer[start:start + limit]
+                    has_more = start + limit < len(newer)
+                    return 200, {"ok": True, "messages": page, "has_more": has_more,
+                                 "response_metadata": {"next_cursor": str(start + limit) if has_more else ""}}
+            return 200, {"ok": True, "messages": [{"type": "message", "ts": f"1700000000.{abs(hash(channel)) % 999999:06d}", "text": "latest"}]}
+
+        @self.route("POST", "/api/auth.test")
+        def auth_test(query, body):
+            return 200, {"ok": True, "user_id": "UBOT"}
+
+        @self.route("GET", "/api/users.list")
+        @self.route("POST", "/api/users.list")
+        def users_list(query, body):
+            params = {**query, **(body if isinstance(body, dict) else {})}
+            start, limit = int(params.get("cursor") or 0), int(params.get("limit") or 100)
+            ids = sorted(self.users)[start:start + limit]
+            more = start + limit < len(self.users)
+            return 200, {"ok": True, "members": [{"id": user_id, "name": user_id.lower(), "profile": {"display_name": self.users[user_id]}} for user_id in ids],
+                         "response_metadata": {"next_cursor": str(start + limit) if more else ""}}
+
+        @self.route("GET", "/api/users.info")
+        @self.route("POST", "/api/users.info")
+        def users_info(query, body):
+            user_id = {**query, **(body if isinstance(body, dict) else {})}.get("user")
+            with self._lock:
+                self.lookups += 1
+            if user_id not in self.users:
+                return 200, {"ok": False, "error": "user_not_found"}
+            return 200, {"ok": True, "user": {"id": user_id, "name": user_id.lower(), "profile": {"display_name": self.users[user_id]}}}
+
+        @self.route("GET", "/api/conversations.info")
+        @self.route("POST", "/api/conversations.info")
+        def conversations_info(query, body):
+            channel = {**query, **(body if isinstance(body, dict) else {})}.get("channel")
+            with self._lock:
+                self.lookups += 1
+            return 200, {"ok": True, "channel": {"id": channel, "name": f"channel-{channel.lower()}"}}
+
+        @self.route("POST", "/api/chat.postMessage")
+        def post_message(query, body):
+            with self._lock:
+                self.posts.append((time.perf_counter(), body.get("channel"), body.get("text")))
+                ts = f"{1700000000 + next(self._ts)}.000100"
+            return 200, {"ok": True, "channel": body.get("channel"), "ts": ts}
+
+        @self.route("POST", "/api/files.getUploadURLExternal")
+        def get_upload_url(query, body):
+            file_id = f"F{next(self._ts)}"
+            return 200, {"ok": True, "file_id": file_id, "upload_url": f"{self.url}/upload/{file_id}"}
+
+        @self.route("POST", "/upload/{file_id}")
+        def upload(query, body, file_id):
+            with self._lock:
+                self.uploaded_bytes += len(body)
+            return 200, "OK"
+
+        @self.route("POST", "/api/files.completeUploadExternal")
+        def complete_upload(query, body):
+            body = {**query, **(body if isinstance(body, dict) else {})}
+            files = json.loads(body["files"]) if isinstance(body.get("files"), str) else body.get("files")
+            with self._lock:
+                self.posts.append((time.perf_counter(), body.get("channel_id"), body.get("initial_comment")))
+                ts = f"{1700000000 + next(self._ts)}.000100"
+            return 200, {"ok": True, "files": [{"id": f["id"], "title": f.get("title"), "shares": {"public": {body.get("channel_id"): [{"ts": ts}]}}} for f in files]}
+
+        @self.route("GET", "/files/{file_id}/{n_bytes}/{filename}")
+        def download(query, body, file_id, n_bytes, filename):
+            with self._lock:
+                self.downloaded_bytes += int(n_bytes)
+            return 200, bytes(int(n_bytes))
+
+        @self.route("POST", "/api/chat.update")
+        def update_message(query, body):
+            body = {**query, **(body if isinstance(body, dict) else {})}
+            with self._lock:
+                self.updates.append((body.get("channel"), body.get("ts"), body.get("text")))
+            return 200, {"ok": True, "channel": body.get("channel"), "ts": body.get("ts")}
+
+        @self.route("POST", "/api/chat.delete")
+        def delete_message(query, body):
+            body = {**query, **(body if isinstance(body, dict) else {})}
+            with self._lock:
+                self.deletes.append((body.get("channel"), body.get("ts")))
+            return 200, {"ok": True, "channel": body.get("channel"), "ts": body.get("ts")}
+
+    def post_user_message(self, channel, text, user="UTEAM"):
+        """A teammate's message in `channel`; returns the event Slack would push over Socket Mode."""
+        with self._lock:
+            ts = f"{time.time():.6f}"
+            while self.history.get(channel) and float(ts) <= float(self.history[channel][-1]["ts"]):
+                ts = f"{float(ts) + 0.000001:.6f}"
+            message = {"type": "message", "user": user, "text": text, "ts": ts, "channel": channel}
+            self.history.setdefault(channel, []).append(message)
+        return dict(message)
+
+
+class FakeDiscordAPI(StubServer):
+    """Discord REST subset used for DMs. Point discum_ai_http.DISCORD_API_URL at `fake.url`.
+    Messages sent with a file are recorded by their payload_json content; discord_attachment() makes an
+    attachment whose CDN URL serves zero bytes."""
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.messages = []  # (received_at, channel_id, content)
+        self.uploaded_bytes = 0
+        self.downloaded_bytes = 0
+        self._ids = itertools.count(10**17)
+        self._lock = threading.Lock()
+
+        @self.route("POST", "/users/@me/channels")
+        def open_dm(query, body):
+            return 200, {"id": f"9{body['recipients'][0]}", "type": 1}
+
+        @self.route("POST", "/channels/{channel_id}/messages")
+        def create_message(query, body, channel_id):
+            body = body if isinstance(body, dict) else {}
+            content = json.loads(body["payload_json"]).get("content") if "payload_json" in body else body.get("content")
+            with self._lock:
+                self.messages.append((time.perf_counter(), channel_id, content))
+                self.uploaded_bytes += sum(len(value) for value in body.values() if isinstance(value, bytes))
+                message_id = str(next(self._ids))
+            return 200, {"id": message_id, "channel_id": channel_id}
+
+        @self.route("PATCH", "/channels/{channel_id}/messages/{message_id}")
+        def edit_message(query, body, channel_id, message_id):
+            return 200, {"id": message_id, "channel_id": channel_id}
+
+        @self.route("DELETE", "/channels/{channel_id}/messages/{message_id}")
+        def delete_message(query, body, channel_id, message_id):
+            return 204, ""
+
+        @self.route("GET", "/attachments/{attachment_id}/{n_bytes}/{filename}")
+        def download(query, body, attachment_id, n_bytes, filename):
+            with self._lock:
+                self.downloaded_bytes += int(n_bytes)
+            return 200, bytes(int(n_bytes))
+
+
+class FakeWhatsAppGateway(StubServer):
+    """whatsapp-bot/service.js queue, send and media endpoints."""
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.queue = []
+        self.sent = []
+        self.deleted = []
+        self.edited = []
+        self.media_bytes = 0
+        self.media = {}  # mediaId -> (mimetype, filename, data)
+        self.inflight = {}
+        self._batch_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._media_ids = itertools.count(1)
+        self._cond = threading.Condition()
+
+        @self.route("GET", "/get-messages")
+        def get_messages(query, body):
+            with self._cond:
+                messages, self.queue = self.queue, []
+            return 200, messages
+
+        @self.route("GET", "/poll-messages")
+        def poll_messages(query, body):
+            with self._cond:
+                self._cond.wait_for(lambda: self.queue, timeout=int(query.get("timeout", 25000)) / 1000)
+                messages, self.queue = self.queue, []
+                if not messages:
+                    return 200, {"batchId": None, "messages": []}
+                batch_id = str(next(self._batch_ids))
+                self.inflight[batch_id] = messages
+            return 200, {"batchId": batch_id, "messages": messages}
+
+        @self.route("POST", "/ack-messages")
+        def ack_messages(query, body):
+            with self._cond:
+                found = self.inflight.pop(str(body.get("batchId")), None) is not None
+            return (200, {"success": True}) if found else (404, {"success": False})
+
+        @self.route("POST", "/send-message")
+        def send_message(query, body):
+            with self._cond:
+                self.sent.append((time.perf_counter(), body.get("chatId"), body.get("message")))
+                media = body.get("media") or {}
+                if media.get("mediaId"):
+                    uploaded = self.media.pop(media["mediaId"], None)
+                    if uploaded is None:
+                        return 404, {"success": False, "error": "Unknown or expired mediaId"}
+                    self.media_bytes += len(uploaded[2])
+                else:
+                    self.media_bytes += len((media.get("data") or "").rstrip("=")) * 3 // 4
+            return 200, {"success": True, "messageId": f"true_{body.get('chatId')}_{next(self._message_ids)}", "timestamp": int(time.time())}
+
+        @self.route("POST", "/media")
+        def upload_media(query, body):
+            return 200, dict(self.store_media(body, query.get("mimetype"), query.get("filename"), "up"), success=True)
+
+        @self.route("GET", "/media/{media_id}")
+        def download_media(query, body, media_id):
+            with self._cond:
+                media = self.media.get(media_id)
+            return (200, media[2]) if media else (404, {"success": False})
+
+        @self.route("DELETE", "/media/{media_id}")
+        def delete_media(query, body, media_id):
+            with self._cond:
+                self.media.pop(media_id, None)
+            return 200, {"success": True}
+
+        @self.route("POST", "/delete-message")
+        def delete_message(query, body):
+            with self._cond:
+                self.deleted.append(body.get("messageId"))
+            return 200, {"success": True}
+
+        @self.route("POST", "/edit-message")
+        def edit_message(query, body):
+            with self._cond:
+                self.edited.append((body.get("messageId"), body.get("message")))
+            return 200, {"success": True}
+
+        @self.route("GET", "/metrics")
+        def metrics(query, body):
+            with self._cond:
+                return 200, f"whatsapp_service_queue_depth {len(self.queue)}\nwhatsapp_service_inflight_batches {len(self.inflight)}\n"
+
+    def push(self, messages):
+        with self._cond:
+            self.queue.extend(messages)
+            self._cond.notify_all()
+
+    def store_media(self, data, mimetype="image/jpeg", filename="photo.jpg", prefix="in"):
+        """Keeps `data` as received (or uploaded) media and returns the reference the service queues for it."""
+        media_id = f"{prefix}-{next(self._media_ids)}"
+        with self._cond:
+            self.media[media_id] = (mimetype, filename, data)
+        return {"mediaId": media_id, "mimetype": mimetype, "filename": filename, "size": len(data)}
+
+
+def slack_file(slack_url, file_id, size, name="photo.jpg", mimetype="image/jpeg"):
+    """A file object as it appears in a Slack message's `files`, downloadable from FakeSlackAPI at `slack_url`."""
+    return {"id": file_id, "name": name, "mimetype": mimetype, "size": size, "url_private_download": f"{slack_url}/files/{file_id}/{size}/{name}"}
+
+
+def discord_attachment(discord_url, attachment_id, size, filename="photo.jpg"):
+    """An attachment as it appears in a Discord MESSAGE_CREATE, downloadable from FakeDiscordAPI at `discord_url`."""
+    return {"id": attachment_id, "filename": filename, "size": size, "url": f"{discord_url}/attachments/{attachment_id}/{size}/{filename}"}
+
+
+class FakeSheet:
+    """The mappings spreadsheet: get_all_records() sleeps `rows_latency`; bump `version` to mark it changed."""
+
+    def __init__(self, rows, rows_latency=0.0):
+        self.rows, self.rows_latency, self.version = rows, rows_latency, 1
+        self.id = "sheet-id"
+        self.sheet1 = self
+
+    def get_all_records(self):
+        time.sleep(self.rows_latency)
+        return [dict(row) for row in self.rows]
+
+
+class _FakeDriveResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+
+class FakeGspreadClient:
+    """What gspread.service_account() returns: opens the sheet and answers the Drive revision request."""
+
+    def __init__(self, sheet, auth_latency=0.0):
+        self.sheet, self.auth_latency = sheet, auth_latency
+
+    def open(self, name):
+        time.sleep(self.auth_latency / 2)
+        return self.sheet
+
+    def request(self, method, url, params=None):
+        time.sleep(0.05 if self.auth_latency else 0)
+        return _FakeDriveResponse({"version": str(self.sheet.version), "modifiedTime": "2024-01-01T00:00:00Z"})
+
+
+def install_fake_sheets(sheet, auth_latency=0.0):
+    """Points g_sheets_client at `sheet` instead of Google Sheets."""
+    import g_sheets_client
+
+    def service_account(filename):
+        time.sleep(auth_latency / 2)
+        return FakeGspreadClient(sheet, auth_latency)
+    g_sheets_client.gspread.service_account = service_account
+
+
+def serve(latency):
+    """Runs the Slack, Discord and WhatsApp service stubs in this process, for a load generator in another one.
+    Prints their URLs as one JSON line, then answers JSON-line commands on stdin until it closes:
+    {"push": [messages]} queues WhatsApp messages, storing media given as {"size": n} in the service's media store; {"results": true} prints everything the stubs received,
+    with wall-clock receive times."""
+    slack, discord, gateway = FakeSlackAPI(latency), FakeDiscordAPI(latency), FakeWhatsAppGateway(latency)
+    print(json.dumps({"slack": slack.url, "discord": discord.url, "whatsapp": gateway.url}), flush=True)
+    for line in sys.stdin:
+        command = json.loads(line)
+        if "push" in command:
+            for msg in command["push"]:
+                if msg.get("media") and "size" in msg["media"] and "mediaId" not in msg["media"]:
+                    msg["media"] = gateway.store_media(bytes(msg["media"]["size"]), msg["media"].get("mimetype"), msg["media"].get("filename"))
+            gateway.push(command["push"])
+        if command.get("results"):
+            offset = time.time() - time.perf_counter()
+            received = {
+                "slack": [(at + offset, channel, text) for at, channel, text in list(slack.posts)],
+                "discord": [(at + offset, channel, text) for at, channel, text in list(discord.messages)],
+                "whatsapp": [(at + offset, chat_id, text) for at, chat_id, text in list(gateway.sent)],
+                "slack_uploaded_bytes": slack.uploaded_bytes,
+                "discord_uploaded_bytes": discord.uploaded_bytes,
+                "whatsapp_media_bytes": gateway.media_bytes,
+                "requests": slack.requests + discord.requests + gateway.requests,
+            }
+            print(json.dumps(received), flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the Slack, Discord and WhatsApp service stubs")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per request")
+    serve(parser.parse_args().latency)
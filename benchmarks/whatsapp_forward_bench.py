@@ -0,0 +1,87 @@
+# benchmarks/whatsapp_forward_bench.py - messages/s on a 500-message burst through main_whatsapp.py
+#
+# Runs the real forwarding helpers against local stubs (benchmarks/stubs.py):
+#   WhatsApp -> Slack : one polled batch of --messages spread over --chats, forwarded through the chat lanes with
+#                       WHATSAPP_FORWARD_WORKERS=1 (the old one-at-a-time loop) vs --workers
+#   Slack -> WhatsApp : --messages send_whatsapp_message calls from --workers threads, with module-level
+#                       requests (new TCP connection per call) vs the pooled http_session
+#
+# Usage: python benchmarks/whatsapp_forward_bench.py [--messages 500] [--chats 50] [--workers 8] [--latency 0.005]
+
+import argparse
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main_whatsapp
+from chat_dispatcher import ChatDispatcher
+from slack_sdk import WebClient
+from stubs import FakeSlackAPI, FakeWhatsAppGateway
+
+
+def burst(n_messages, n_chats):
+    return [{"chatId": f"92300{i % n_chats:07d}@c.us", "timestamp": 1700000000 + i, "body": f"message {i}",
+             "messageId": f"wa_{i}", "media": None} for i in range(n_messages)]
+
+
+def bench_whatsapp_to_slack(args, workers):
+    slack = FakeSlackAPI(latency=args.latency)
+    messages = burst(args.messages, args.chats)
+    clients = {m["chatId"]: {"slack_channel_id": f"C_{m['chatId']}", "client_name": m["chatId"]} for m in messages}
+    main_whatsapp.processed_whatsapp_events.clear()
+    main_whatsapp.whatsapp_to_slack_dispatcher = ChatDispatcher(workers=workers, max_lane_depth=len(messages), max_queued=len(messages), policy="reject")
+    started = time.perf_counter()
+    main_whatsapp.forward_whatsapp_batch(WebClient(base_url=slack.api_url), messages, clients)
+    main_whatsapp.whatsapp_to_slack_dispatcher.join()
+    elapsed = time.perf_counter() - started
+    per_channel = {}
+    for _, channel, text in slack.posts:
+        per_channel.setdefault(channel, []).append(int(text.rsplit(" ", 1)[1]))
+    in_order = all(seq == sorted(seq) for seq in per_channel.values())
+    slack.close()
+    return len(slack.posts) / elapsed, in_order
+
+
+def bench_slack_to_whatsapp(args, transport):
+    gateway = FakeWhatsAppGateway(latency=args.latency)
+    main_whatsapp.NODE_API_URL = gateway.url
+    main_whatsapp.http_session = transport
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        list(pool.map(lambda i: main_whatsapp.send_whatsapp_message(f"92300{i % args.chats:07d}@c.us", f"reply {i}"), range(args.messages)))
+    elapsed = time.perf_counter() - started
+    gateway.close()
+    return len(gateway.sent) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WhatsApp bridge burst throughput benchmark")
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.005, help="stub latency per request in seconds")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    print(f"{args.messages}-message burst over {args.chats} chats, {args.latency * 1000:.0f} ms stub latency")
+    sequential, _ = bench_whatsapp_to_slack(args, workers=1)
+    concurrent, in_order = bench_whatsapp_to_slack(args, workers=args.workers)
+    print(f"WhatsApp -> Slack  sequential          {sequential:8.0f} msg/s")
+    print(f"WhatsApp -> Slack  {args.workers} workers{'':<10}{concurrent:8.0f} msg/s  (per-chat order kept: {in_order})")
+
+    pooled_session = main_whatsapp.http_session
+    unpooled = bench_slack_to_whatsapp(args, transport=requests)
+    pooled = bench_slack_to_whatsapp(args, transport=pooled_session)
+    print(f"Slack -> WhatsApp  new connection/call {unpooled:8.0f} msg/s")
+    print(f"Slack -> WhatsApp  pooled session      {pooled:8.0f} msg/s")
+
+
+if __name__ == "__main__":
+    main()
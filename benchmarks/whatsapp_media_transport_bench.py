@@ -0,0 +1,134 @@
+# benchmarks/whatsapp_media_transport_bench.py - memory and CPU of moving media between main_whatsapp.py and the Node service
+#
+# Sends --messages messages with one --size file each through main_whatsapp.py, both ways, against the stubs from
+# benchmarks/stubs.py: WhatsApp -> Slack runs the poller's steps (long poll, outbox, ack, forward_whatsapp_batch)
+# and Slack -> WhatsApp runs process_slack_to_whatsapp(). "base64" is the old transport: received files inlined in
+# the queued message as base64, files to send base64-encoded into the /send-message JSON. "binary" queues a media
+# reference fetched from GET /media/:id, and streams files to send into POST /media. Each run is a fresh child
+# process (the stubs stay in this one), which reports its peak RSS above what it used before the first message and
+# the CPU time it spent on them. Linux only (/proc/self).
+#
+# Usage: python benchmarks/whatsapp_media_transport_bench.py [--messages 3] [--size 20971520]
+
+import argparse
+import base64
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from stubs import FakeSlackAPI, FakeWhatsAppGateway, slack_file
+
+CHAT_ID, CHANNEL = "923001234567@c.us", "C0000001"
+
+
+def legacy_download_slack_file(file_info, bot_token):
+    """download_slack_file() before media references: the whole file, base64-encoded into the JSON payload."""
+    import main_whatsapp as whatsapp_bridge
+    f = whatsapp_bridge.media_cache.open(file_info.get("url_private_download")) or whatsapp_bridge.fetch_slack_file(file_info, bot_token)
+    with f:
+        return {"mimetype": file_info.get("mimetype"), "filename": file_info.get("name"), "data": base64.b64encode(f.read()).decode("utf-8")}
+
+
+def rss_kb(field):
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith(f"{field}:"))
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def child(direction, transport, urls, args):
+    """Moves the files in `direction` over `transport` and prints peak RSS growth and CPU time as JSON."""
+    logging.disable(logging.CRITICAL)
+    import main_whatsapp as whatsapp_bridge
+    from outbox import Outbox
+    from rate_limiter import RateLimitedWebClient
+    web_client = RateLimitedWebClient(token="xoxb-bench", base_url=f"{urls['slack']}/api/")
+    whatsapp_bridge.slack_web_client = web_client
+    whatsapp_bridge.NODE_API_URL = urls["whatsapp"]
+    whatsapp_bridge.outbox = Outbox(os.path.join(tempfile.mkdtemp(prefix="bitlink-outbox-"), "outbox.db"))
+    client_info = {"client_name": "Client", "slack_channel_id": CHANNEL, "whatsapp_chat_id": CHAT_ID}
+    whatsapp_bridge.whatsapp_to_slack_map[CHAT_ID] = client_info
+    whatsapp_bridge.slack_to_whatsapp_map[CHANNEL] = client_info
+    if transport == "base64":
+        whatsapp_bridge.download_slack_file = legacy_download_slack_file
+
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")  # resets VmHWM, the peak RSS, to the current RSS
+    baseline_kb = rss_kb("VmRSS")
+    cpu, started = cpu_seconds(), time.perf_counter()
+    if direction == "whatsapp_to_slack":
+        forwarded = 0
+        while forwarded < args.messages:
+            batch_id, messages = whatsapp_bridge.long_poll_whatsapp_messages()
+            outbox_ids = whatsapp_bridge.outbox.enqueue_many("whatsapp_to_slack", [(msg, msg.get("chatId")) for msg in messages])
+            if batch_id:
+                whatsapp_bridge.ack_whatsapp_batch(batch_id)
+            whatsapp_bridge.forward_whatsapp_batch(web_client, messages, dict(whatsapp_bridge.whatsapp_to_slack_map), outbox_ids)
+            whatsapp_bridge.whatsapp_to_slack_dispatcher.join()
+            forwarded += len(messages)
+    else:
+        for n in range(args.messages):
+            event = {"channel": CHANNEL, "ts": f"{time.time():.6f}", "text": "report", "files": [slack_file(urls["slack"], f"F{transport}{n}", args.size, "report.pdf", "application/pdf")]}
+            if not whatsapp_bridge.process_slack_to_whatsapp(event, "xoxb-bench"):
+                sys.exit(f"message {n} was not delivered")
+    result = {"peak_mb": (rss_kb("VmHWM") - baseline_kb) / 1024,
+              "cpu_s": cpu_seconds() - cpu, "wall_s": time.perf_counter() - started}
+    print(json.dumps(result), flush=True)
+    os._exit(0)  # the bridge's worker threads don't exit on their own
+
+
+def measure(direction, transport, urls, args):
+    env = dict(os.environ, DISCORD_TOKEN="bench", WHATSAPP_LONG_POLL_TIMEOUT="5", BRIDGE_DATA_DIR=tempfile.mkdtemp(prefix="bitlink-bench-"),
+               MEDIA_CACHE_DIR=tempfile.mkdtemp(prefix="bitlink-media-cache-"))
+    result = subprocess.run([sys.executable, __file__, "--child", direction, transport, "--urls", json.dumps(urls),
+                             "--messages", str(args.messages), "--size", str(args.size)], capture_output=True, text=True, env=env, timeout=600)
+    if result.returncode:
+        sys.exit(f"{direction} over {transport} failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="base64-in-JSON vs. binary media transport to the Node WhatsApp service")
+    parser.add_argument("--messages", type=int, default=3, help="messages with a file, each way")
+    parser.add_argument("--size", type=int, default=20 * 1024 * 1024, help="bytes per file")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    parser.add_argument("--urls", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child, json.loads(args.urls), args)
+
+    slack, gateway = FakeSlackAPI(), FakeWhatsAppGateway()
+    urls = {"slack": slack.url, "whatsapp": gateway.url}
+    print(f"{args.messages} messages x {args.size / 2**20:.0f} MB file each way")
+    print(f"{'':<20}{'transport':>10}{'peak RSS +MB':>14}{'CPU s':>8}{'wall s':>8}{'delivered MB':>14}")
+    for direction in ("whatsapp_to_slack", "slack_to_whatsapp"):
+        for transport in ("base64", "binary"):
+            before = slack.uploaded_bytes if direction == "whatsapp_to_slack" else gateway.media_bytes
+            if direction == "whatsapp_to_slack":
+                for n in range(args.messages):
+                    data = bytes(args.size)
+                    media = {"mimetype": "application/pdf", "filename": "report.pdf", "data": base64.b64encode(data).decode()} if transport == "base64" \
+                        else gateway.store_media(data, "application/pdf", "report.pdf")
+                    gateway.push([{"chatId": CHAT_ID, "timestamp": time.time(), "body": "report", "messageId": f"wa_{transport}_{n}", "media": media}])
+            r = measure(direction, transport, urls, args)
+            delivered = (slack.uploaded_bytes if direction == "whatsapp_to_slack" else gateway.media_bytes) - before
+            print(f"{direction:<20}{transport:>10}{r['peak_mb']:>14.1f}{r['cpu_s']:>8.2f}{r['wall_s']:>8.2f}{delivered / 2**20:>14.0f}")
+    print(f"media left in the service: {len(gateway.media)}")
+    slack.close()
+    gateway.close()
+
+
+if __name__ == "__main__":
+    main()
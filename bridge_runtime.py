@@ -0,0 +1,126 @@
+# bridge_runtime.py - runs the WhatsApp and Discord bridges in one process, sharing their connections
+#
+# Usage: python bridge_runtime.py
+#
+# Instead of main_whatsapp.py and discum_ai_http.py as two processes, each with its own Slack Socket Mode
+# connection, Sheets client, HTTP pools and endpoints, this runs both adapters on one asyncio loop:
+#   - one Slack Socket Mode connection (SLACK_APP_TOKEN), whose events go to the bridge that maps the channel
+#   - one aiohttp session for the Discord adapter and the Slack Web API calls made from the loop
+#   - one mappings store, rate limiter, media cache and metrics registry
+#   - one /refresh, /stats and /metrics server on WHATSAPP_REFRESH_PORT, which reloads both bridges
+# The WhatsApp adapter keeps its worker threads and requests pool, since its handlers are synchronous.
+
+import asyncio
+import logging
+import os
+import sys
+
+import aiohttp
+from aiohttp import web
+from dotenv import load_dotenv
+from slack_sdk.socket_mode.aiohttp import SocketModeClient
+from slack_sdk.socket_mode.response import SocketModeResponse
+
+import discum_ai_http as discord_bridge
+import main_whatsapp as whatsapp_bridge
+from metrics import CONTENT_TYPE, registry
+from rate_limiter import RateLimitedAsyncWebClient, RateLimitedWebClient
+
+load_dotenv()
+
+SLACK_APP_TOKEN = os.getenv("SLACK_APP_TOKEN")
+SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN")
+BRIDGE_RUNTIME_PORT = int(os.getenv("WHATSAPP_REFRESH_PORT", 8001))
+SLACK_API_URL = "https://www.slack.com/api/"
+
+# Slack events for the WhatsApp bridge as (event, future); run_whatsapp_events() feeds them to its handler
+whatsapp_events = None
+
+async def route_slack_event(client, req):
+    # Handed on before the first await, like the bridges' own listeners, so each channel's events stay in order
+    persisted = None
+    if req.type == "events_api":
+        event = req.payload.get("event", {})
+        if event.get("channel") in discord_bridge.slack_to_discord_map:
+            persisted = discord_bridge.queue_slack_event(event)
+        else:
+            persisted = asyncio.get_running_loop().create_future()
+            whatsapp_events.put_nowait((event, persisted))
+    if persisted:
+        await persisted  # Slack won't redeliver an acked event, so ack only once the bridge has it in its outbox
+    await client.send_socket_mode_response(SocketModeResponse(envelope_id=req.envelope_id))
+
+def handle_whatsapp_events(events):
+    for event in events:
+        try:
+            whatsapp_bridge.handle_slack_event(event, SLACK_BOT_TOKEN)
+        except Exception:
+            logging.error("An exception occurred handling a Slack event for the WhatsApp bridge:", exc_info=True)
+
+async def run_whatsapp_events():
+    """The WhatsApp bridge's handle_slack_event() is synchronous (it writes to the outbox before submitting to
+    the chat's lane), so it runs in the executor: whatever has queued up meanwhile goes as one batch, in order."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await whatsapp_events.get()]
+        while not whatsapp_events.empty():
+            batch.append(whatsapp_events.get_nowait())
+        try:
+            await loop.run_in_executor(None, handle_whatsapp_events, [event for event, _ in batch])
+        finally:
+            for _, persisted in batch:
+                if not persisted.done():
+                    persisted.set_result(None)
+
+async def handle_refresh(request):
+    asyncio.get_running_loop().run_in_executor(None, whatsapp_bridge.reload_config)
+    asyncio.create_task(discord_bridge.reload_config())
+    return web.Response(text="Refresh signal received.")
+
+async def handle_stats(request):
+    return web.json_response({"whatsapp": whatsapp_bridge.bridge_stats(), "discord": discord_bridge.bridge_stats()})
+
+async def handle_metrics(request):
+    return web.Response(body=registry.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+async def run_server():
+    app = web.Application()
+    app.add_routes([web.post('/refresh', handle_refresh), web.get('/stats', handle_stats), web.get('/metrics', handle_metrics)])
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, 'localhost', BRIDGE_RUNTIME_PORT).start()
+    logging.info(f"Bridge runtime server listening on port {BRIDGE_RUNTIME_PORT}")
+    while True:
+        await asyncio.sleep(3600)
+
+async def start(session, slack_api_url=SLACK_API_URL):
+    """Starts both bridges on the running loop and returns their tasks. Slack events reach them through
+    route_slack_event(), so the Discord bridge's own Slack loop only reconciles."""
+    whatsapp_web_client = RateLimitedWebClient(token=SLACK_BOT_TOKEN, base_url=slack_api_url)
+    await asyncio.get_running_loop().run_in_executor(None, whatsapp_bridge.start, whatsapp_web_client)
+    discord_bridge.slack_client = RateLimitedAsyncWebClient(token=SLACK_BOT_TOKEN, base_url=slack_api_url, session=session)
+    discord_bridge.SLACK_INGEST_MODE = "socket"
+    global whatsapp_events
+    whatsapp_events = asyncio.Queue()
+    return [asyncio.create_task(run_whatsapp_events()), *await discord_bridge.start(session)]
+
+async def main():
+    async with aiohttp.ClientSession() as session:
+        tasks = await start(session)
+        tasks.append(asyncio.create_task(run_server()))
+        socket_client = SocketModeClient(app_token=SLACK_APP_TOKEN, web_client=discord_bridge.slack_client)
+        socket_client.socket_mode_request_listeners.append(route_slack_event)
+        logging.info("Connecting to Slack Socket Mode for both bridges...")
+        await socket_client.connect()
+        await asyncio.gather(*tasks)
+
+if __name__ == "__main__":
+    if not all([SLACK_APP_TOKEN, SLACK_BOT_TOKEN, os.getenv("DISCORD_TOKEN")]):
+        sys.exit("FATAL ERROR: One or more required tokens are missing in the .env file.")
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logging.info("Bridge runtime shutting down.")
+    finally:
+        whatsapp_bridge.shutdown()
+        discord_bridge.shutdown()
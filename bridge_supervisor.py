@@ -0,0 +1,226 @@
+# bridge_supervisor.py - runs a bridge as several worker processes, each owning a consistent-hash share of the clients
+#
+# Usage: python bridge_supervisor.py whatsapp|discord [--shards N]
+#
+# The supervisor listens on the bridge's usual refresh port, so management_server.py's refresh signals reach it
+# unchanged; it passes each one on to every worker. POST /refresh?shards=N (or {"shards": N}) grows or shrinks the
+# pool: new workers start with their share, and the rest drop what moved to them on their next reload. A shrink
+# first has every worker reload with the new topology (the retired ones then own nothing and hand over what they
+# receive), stops the retired workers, and replays whatever is left in their outboxes through /shard-handoff to
+# the clients' new owners.
+# Each worker opens its own Slack Socket Mode connection (Slack allows 10 per app) and, for Discord, its own gateway session.
+#
+# State across shards: the message index (Slack ts <-> WhatsApp/Discord message ID) is one SQLite file in
+# BRIDGE_DATA_DIR that every worker shares, so a client's edits and deletes still find messages forwarded before
+# the client moved. Each worker keeps its own outbox, dedupe stores and Slack cursors in BRIDGE_DATA_DIR/shard-N:
+# a moved client's new owner starts its Slack cursor at the channel's newest message, so it doesn't sweep up what
+# the old owner already forwarded, and its dedupe window starts empty.
+
+import argparse
+import json
+import logging
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+from dotenv import load_dotenv
+from flask import Flask, jsonify, request
+
+from sharding import HashRing, client_key
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+BRIDGES = {
+    "whatsapp": {"script": "main_whatsapp.py", "port_env": "WHATSAPP_REFRESH_PORT", "port": 8001, "worker_port_base": 8100,
+                 "index_env": "WHATSAPP_MESSAGE_INDEX_DB", "index_file": "whatsapp_message_index.db", "outbox_file": "whatsapp_outbox.db"},
+    "discord": {"script": "discum_ai_http.py", "port_env": "DISCORD_REFRESH_PORT", "port": 8002, "worker_port_base": 8200,
+                "index_env": "DISCORD_MESSAGE_INDEX_DB", "index_file": "discord_message_index.db", "outbox_file": "discord_outbox.db"},
+}
+# Outbox kind -> (ID of the client it belongs to, /shard-handoff kind, hand-off payload) for an entry's lane and payload
+OUTBOX_HANDOFFS = {
+    "whatsapp_to_slack": lambda lane, payload: (lane, "whatsapp_messages", [payload]),
+    "slack_to_whatsapp": lambda lane, payload: (lane, "slack_event", payload["event"]),
+    "discord_to_slack": lambda lane, payload: (lane, "discord_message", payload),
+    "slack_to_discord": lambda lane, payload: (payload["client_info"]["discord_user_id"], "slack_event", payload["message"]),
+}
+BRIDGE_SHARDS = int(os.getenv("BRIDGE_SHARDS", 2))
+BRIDGE_DATA_DIR = os.getenv("BRIDGE_DATA_DIR", "data")
+# A worker that keeps dying is restarted at most this often
+WORKER_RESTART_DELAY = float(os.getenv("WORKER_RESTART_DELAY", 5))
+# How long a shrink waits for each worker to reload its share before handing over the retired workers' messages
+WORKER_RELOAD_TIMEOUT = float(os.getenv("WORKER_RELOAD_TIMEOUT", 120))
+
+class Supervisor:
+    def __init__(self, bridge, shards):
+        self.platform = bridge
+        self.bridge = BRIDGES[bridge]
+        self.port_base = int(os.getenv(f"{bridge.upper()}_WORKER_PORT_BASE", self.bridge["worker_port_base"]))
+        self.shards = shards
+        self.workers = {}
+        self.restarts = {}
+        self.lock = threading.Lock()
+        self.stopping = False
+
+    def worker_url(self, index):
+        return f"http://localhost:{self.port_base + index}"
+
+    def topology(self):
+        return {"shard_count": self.shards, "peers": [self.worker_url(i) for i in range(self.shards)]}
+
+    def _spawn(self, index):
+        # Every worker keeps its own outbox, dedupe stores and cursors; the message index is shared
+        env = dict(os.environ, BRIDGE_SHARD_INDEX=str(index), BRIDGE_SHARD_COUNT=str(self.shards),
+                   BRIDGE_SHARD_PEERS=",".join(self.topology()["peers"]), BRIDGE_DATA_DIR=os.path.join(BRIDGE_DATA_DIR, f"shard-{index}"))
+        env[self.bridge["port_env"]] = str(self.port_base + index)
+        env.setdefault(self.bridge["index_env"], os.path.join(BRIDGE_DATA_DIR, self.bridge["index_file"]))
+        self.workers[index] = subprocess.Popen([sys.executable, self.bridge["script"]], env=env)
+        logging.info(f"Started {self.bridge['script']} shard {index}/{self.shards} (pid {self.workers[index].pid}) on {self.worker_url(index)}")
+
+    def _stop(self, index):
+        worker = self.workers.pop(index)
+        worker.send_signal(signal.SIGINT)
+        try:
+            worker.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            worker.kill()
+        logging.info(f"Stopped shard {index} (pid {worker.pid})")
+
+    def start(self):
+        with self.lock:
+            for index in range(self.shards):
+                self._spawn(index)
+
+    def resize(self, shards):
+        """Starts or stops workers, then tells the ones that stay about the new topology so they rebalance.
+        Workers being stopped pass on their undelivered messages first (see _hand_off_outbox())."""
+        with self.lock:
+            old = self.shards
+            self.shards = shards
+            if shards < old:
+                # Everyone takes up the new topology before the retired workers go, so no client is left without an owner
+                self._broadcast_refresh(range(old), wait=True)
+                for index in range(shards, old):
+                    self._stop(index)
+                    self._hand_off_outbox(index)
+            else:
+                for index in range(old, shards):
+                    self._spawn(index)
+                self._broadcast_refresh(range(old))
+            logging.info(f"Resized from {old} to {shards} shard(s).")
+
+    def refresh(self):
+        with self.lock:
+            self._broadcast_refresh(self.workers)
+
+    def _broadcast_refresh(self, indexes, wait=False):
+        """Sends the topology to the workers; with `wait`, each answers once it has reloaded its share."""
+        topology = dict(self.topology(), wait=True) if wait else self.topology()
+        for index in indexes:
+            try:
+                requests.post(f"{self.worker_url(index)}/refresh", json=topology, timeout=WORKER_RELOAD_TIMEOUT if wait else 2)
+            except requests.exceptions.RequestException as e:
+                logging.warning(f"Could not refresh shard {index}: {e}")
+
+    def _hand_off_outbox(self, index):
+        """Replays what a stopped worker left in its outbox to the clients' new owners, in order, through their
+        /shard-handoff, and deletes each entry once its owner has it. Entries that can't be handed over stay
+        for the next shrink, or for the worker if the pool grows back."""
+        path = os.path.join(BRIDGE_DATA_DIR, f"shard-{index}", self.bridge["outbox_file"])
+        if not os.path.exists(path):
+            return
+        ring = HashRing(self.shards) if self.shards > 1 else None
+        conn = sqlite3.connect(path, isolation_level=None)
+        try:
+            rows = conn.execute("SELECT id, kind, lane, payload FROM outbox ORDER BY id").fetchall()
+            handed_off, stuck = 0, set()
+            for msg_id, kind, lane, payload in rows:
+                if (kind, lane) in stuck:
+                    continue  # stays behind the earlier message of its lane that couldn't be handed over
+                try:
+                    external_id, handoff_kind, handoff_payload = OUTBOX_HANDOFFS[kind](lane, json.loads(payload))
+                    owner = ring.shard_for(client_key(self.platform, external_id)) if ring else 0
+                    response = requests.post(f"{self.worker_url(owner)}/shard-handoff", json={"kind": handoff_kind, "payload": handoff_payload}, timeout=30)
+                    response.raise_for_status()
+                except (KeyError, ValueError, requests.exceptions.RequestException) as e:
+                    logging.error(f"Could not hand over outbox message {msg_id} ({kind}) of stopped shard {index}: {e}")
+                    stuck.add((kind, lane))
+                    continue
+                conn.execute("DELETE FROM outbox WHERE id = ?", (msg_id,))
+                handed_off += 1
+            logging.info(f"Handed over {handed_off}/{len(rows)} undelivered message(s) of stopped shard {index}.")
+        finally:
+            conn.close()
+
+    def watch(self):
+        """Restarts workers that exit on their own."""
+        while not self.stopping:
+            time.sleep(WORKER_RESTART_DELAY)
+            with self.lock:
+                for index, worker in list(self.workers.items()):
+                    if worker.poll() is not None and not self.stopping:
+                        logging.error(f"Shard {index} exited with code {worker.returncode}. Restarting it.")
+                        self.restarts[index] = self.restarts.get(index, 0) + 1
+                        self._spawn(index)
+
+    def stop(self):
+        self.stopping = True
+        with self.lock:
+            for index in list(self.workers):
+                self._stop(index)
+
+    def stats(self):
+        workers = []
+        with self.lock:
+            for index, worker in sorted(self.workers.items()):
+                entry = {"index": index, "pid": worker.pid, "alive": worker.poll() is None, "url": self.worker_url(index), "restarts": self.restarts.get(index, 0)}
+                try:
+                    entry["stats"] = requests.get(f"{self.worker_url(index)}/stats", timeout=2).json()
+                except (requests.exceptions.RequestException, ValueError):
+                    entry["stats"] = None
+                workers.append(entry)
+        return {"shards": self.shards, "workers": workers}
+
+def run_server(supervisor, port):
+    app = Flask(__name__)
+
+    @app.route('/refresh', methods=['POST'])
+    def refresh_endpoint():
+        body = request.get_json(silent=True) or {}
+        shards = request.args.get("shards", body.get("shards"))
+        if shards is not None and int(shards) != supervisor.shards:
+            if int(shards) < 1:
+                return "shards must be at least 1.", 400
+            threading.Thread(target=supervisor.resize, args=(int(shards),)).start()
+        else:
+            threading.Thread(target=supervisor.refresh).start()
+        return "Refresh signal received.", 200
+
+    @app.route('/stats', methods=['GET'])
+    def stats_endpoint():
+        return jsonify(supervisor.stats())
+
+    logging.info(f"Supervisor listening on port {port}")
+    app.run(port=port)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a bridge as sharded worker processes")
+    parser.add_argument("bridge", choices=sorted(BRIDGES))
+    parser.add_argument("--shards", type=int, default=BRIDGE_SHARDS)
+    args = parser.parse_args()
+
+    supervisor = Supervisor(args.bridge, args.shards)
+    supervisor.start()
+    threading.Thread(target=supervisor.watch, daemon=True).start()
+    try:
+        run_server(supervisor, int(os.getenv(BRIDGES[args.bridge]["port_env"], BRIDGES[args.bridge]["port"])))
+    finally:
+        supervisor.stop()
+
+if __name__ == "__main__":
+    main()
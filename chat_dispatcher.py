@@ -0,0 +1,120 @@
+# chat_dispatcher.py - fixed worker pool with one FIFO lane per chat
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+class ChatDispatcher:
+    """Runs submitted jobs on a fixed number of worker threads. Jobs with the same key (e.g. a WhatsApp chat ID)
+    run one at a time in submission order; different keys run in parallel.
+
+    A lane is "scheduled" while its key is in the ready queue or held by a worker, so at most one worker
+    ever runs a given key. After each job the worker puts the key back at the tail of the ready queue,
+    so a busy chat can't starve the others.
+
+    Backpressure when a lane reaches `max_lane_depth` or all lanes together reach `max_queued`:
+      "block"       - the submitting thread waits up to `block_timeout` seconds, then the job is rejected
+      "drop_oldest" - the oldest queued job of that lane is dropped to make room
+      "reject"      - the new job is dropped
+    """
+
+    POLICIES = ("block", "drop_oldest", "reject")
+
+    def __init__(self, workers=8, max_lane_depth=100, max_queued=5000, policy="block", block_timeout=10.0, name="dispatcher"):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown backpressure policy '{policy}'. Use one of: {', '.join(self.POLICIES)}")
+        self.name = name
+        self.max_lane_depth = max_lane_depth
+        self.max_queued = max_queued
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self._lanes = {}
+        self._ready = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._space = threading.Condition(self._lock)
+        self._queued = 0
+        self._active = 0
+        self._counters = {"submitted": 0, "processed": 0, "failed": 0, "dropped": 0, "rejected": 0, "max_queued_seen": 0}
+        self._workers = [threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True) for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, key, fn, *args):
+        """Queues fn(*args) on `key`'s lane. Returns False if backpressure dropped the job."""
+        deadline = time.monotonic() + self.block_timeout
+        with self._lock:
+            lane = self._lanes.get(key)
+            while self._is_full(lane):
+                if self.policy == "drop_oldest" and lane and lane["jobs"]:
+                    lane["jobs"].popleft()
+                    self._queued -= 1
+                    self._counters["dropped"] += 1
+                    logging.warning(f"({self.name}) Lane {key} full; dropped its oldest queued job.")
+                elif self.policy == "block" and self._space.wait(max(deadline - time.monotonic(), 0)):
+                    lane = self._lanes.get(key)
+                else:
+                    self._counters["rejected"] += 1
+                    logging.error(f"({self.name}) Queue full; rejected job for {key}.")
+                    return False
+            if lane is None:
+                lane = self._lanes[key] = {"jobs": deque(), "scheduled": False}
+            lane["jobs"].append((fn, args))
+            self._queued += 1
+            self._counters["submitted"] += 1
+            self._counters["max_queued_seen"] = max(self._counters["max_queued_seen"], self._queued)
+            if not lane["scheduled"]:
+                lane["scheduled"] = True
+                self._ready.put(key)
+        return True
+
+    def _is_full(self, lane):
+        return self._queued >= self.max_queued or (lane is not None and len(lane["jobs"]) >= self.max_lane_depth)
+
+    def _work(self):
+        while True:
+            key = self._ready.get()
+            if key is None:
+                return
+            with self._lock:
+                lane = self._lanes[key]
+                if not lane["jobs"]:  # everything was dropped by backpressure
+                    del self._lanes[key]
+                    continue
+                fn, args = lane["jobs"].popleft()
+                self._queued -= 1
+                self._active += 1
+                self._space.notify_all()
+            try:
+                fn(*args)
+                failed = False
+            except Exception as e:
+                failed = True
+                logging.error(f"({self.name}) Unhandled exception in job for {key}: {e}", exc_info=True)
+            with self._lock:
+                self._active -= 1
+                self._counters["failed" if failed else "processed"] += 1
+                if lane["jobs"]:
+                    self._ready.put(key)
+                else:
+                    del self._lanes[key]
+                self._space.notify_all()
+
+    def stats(self):
+        with self._lock:
+            depths = [len(lane["jobs"]) for lane in self._lanes.values()]
+            return {"workers": len(self._workers), "active": self._active, "queued": self._queued,
+                    "lanes": len(self._lanes), "deepest_lane": max(depths, default=0), **self._counters}
+
+    def join(self, timeout=None):
+        """Waits up to `timeout` seconds for queued and running jobs to finish. Returns True if they did."""
+        with self._lock:
+            return self._space.wait_for(lambda: self._queued == 0 and self._active == 0, timeout)
+
+    def shutdown(self, timeout=None):
+        """Waits for queued and running jobs to finish (up to `timeout` seconds), then stops the workers."""
+        self.join(timeout)
+        for _ in self._workers:
+            self._ready.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
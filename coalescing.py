@@ -0,0 +1,88 @@
+# coalescing.py - merges a client's burst of short messages into one Slack post
+import os
+import threading
+import time
+
+# Seconds of quiet that end a client's burst; 0 posts every message on its own. A coalesce_seconds column in
+# the mappings sheet overrides it per client.
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", 0))
+# A burst is posted at the latest this long after its first message, however chatty the client is
+COALESCE_MAX_DELAY = float(os.getenv("COALESCE_MAX_DELAY", 10))
+# ...and before its text would grow past this many characters
+COALESCE_MAX_CHARS = int(os.getenv("COALESCE_MAX_CHARS", 3000))
+
+def coalesce_window(row):
+    """A client's coalescing window from its sheet row, falling back to COALESCE_WINDOW."""
+    try:
+        return float(row.get("coalesce_seconds") or COALESCE_WINDOW)
+    except (TypeError, ValueError):
+        return COALESCE_WINDOW
+
+def render_burst(client_name, bodies):
+    return f"*{client_name}:*\n" + "\n".join(bodies)
+
+class Burst:
+    __slots__ = ("key", "context", "items", "parts", "chars", "first_at", "deadline")
+
+    def __init__(self, key, context, now):
+        self.key = key
+        self.context = context
+        self.items = []  # whatever the bridge needs to settle each message, in order
+        self.parts = []  # (remote message ID, body), in order
+        self.chars = 0
+        self.first_at = now
+        self.deadline = now
+
+class BurstBuffer:
+    """Per-client bursts of text messages waiting to be posted as one. add() a coalescible message; a burst is
+    due once `window` seconds pass without another message or COALESCE_MAX_DELAY after its first one.
+    The bridge posts what due() and take() hand back, and take()s a client's burst before posting anything
+    else of theirs so the channel stays in order."""
+
+    def __init__(self, max_delay=COALESCE_MAX_DELAY, max_chars=COALESCE_MAX_CHARS):
+        self.max_delay = max_delay
+        self.max_chars = max_chars
+        self._bursts = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, window, remote_id, body, item, context):
+        """Adds a message to `key`'s burst. Returns the burst to post first if this one would make it too long."""
+        now = time.monotonic()
+        with self._lock:
+            full = None
+            burst = self._bursts.get(key)
+            if burst and burst.chars + len(body) + 1 > self.max_chars:
+                full, burst = self._bursts.pop(key), None
+            if burst is None:
+                burst = self._bursts[key] = Burst(key, context, now)
+            burst.items.append(item)
+            burst.parts.append((remote_id, body))
+            burst.chars += len(body) + 1
+            burst.context = context
+            burst.deadline = min(now + window, burst.first_at + self.max_delay)
+            return full
+
+    def take(self, key):
+        with self._lock:
+            return self._bursts.pop(key, None)
+
+    def due(self):
+        """Keys of the bursts that should be posted now. Each is handed out once, until another message extends it."""
+        now = time.monotonic()
+        with self._lock:
+            keys = [key for key, burst in self._bursts.items() if burst.deadline <= now]
+            for key in keys:
+                self._bursts[key].deadline = float("inf")
+            return keys
+
+    def pending_context(self, remote_id):
+        """The context of the burst still holding `remote_id`, or None."""
+        with self._lock:
+            for burst in self._bursts.values():
+                if any(part_id == remote_id for part_id, _ in burst.parts):
+                    return burst.context
+        return None
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(burst.items) for burst in self._bursts.values())
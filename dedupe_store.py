@@ -0,0 +1,134 @@
+# dedupe_store.py - time-windowed "have we already forwarded this?" set
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+class DedupeStore:
+    """Remembers event keys for `window` seconds with O(1) membership checks.
+
+    Keys live in one dict (key -> bucket start) for lookups, and in time buckets of `window / buckets` seconds
+    for eviction: when a bucket falls out of the window its keys are dropped in one go, so no per-entry
+    timestamps are scanned. `max_entries` caps memory by evicting the oldest keys early.
+
+    With `path`, the store is written to a JSON file every `save_interval` seconds and on close(),
+    and loaded back on start, so a restart doesn't forget what was already forwarded.
+    """
+
+    def __init__(self, window=24 * 3600, buckets=24, max_entries=1_000_000, path=None, save_interval=60.0):
+        self.window = window
+        self.bucket_span = window / buckets
+        self.max_entries = max_entries
+        self.path = path
+        self._seen = {}
+        self._buckets = deque()  # (bucket_start, deque of keys), oldest first
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # the saver thread and SlackCursors both call save()
+        self._load()
+        self._saver = None
+        if path:
+            self._stop = threading.Event()
+            self._saver = threading.Thread(target=self._save_periodically, args=(save_interval,), name="dedupe-saver", daemon=True)
+            self._saver.start()
+
+    def __contains__(self, key):
+        with self._lock:
+            self._expire(time.time())
+            return key in self._seen
+
+    def __len__(self):
+        return len(self._seen)
+
+    def add(self, key):
+        self.check_and_add(key)
+
+    def check_and_add(self, key):
+        """Adds `key` and returns True if it was not seen within the window (i.e. the event should be processed)."""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if key in self._seen:
+                return False
+            bucket_start = now - now % self.bucket_span
+            if not self._buckets or self._buckets[-1][0] != bucket_start:
+                self._buckets.append((bucket_start, deque()))
+            self._buckets[-1][1].append(key)
+            self._seen[key] = bucket_start
+            while len(self._seen) > self.max_entries:
+                self._evict_oldest_key()
+            return True
+
+    def discard(self, key):
+        """Forgets a key (e.g. the forward failed and should be allowed again). The bucket entry is skipped on eviction."""
+        with self._lock:
+            self._seen.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._seen.clear()
+            self._buckets.clear()
+
+    def _expire(self, now):
+        while self._buckets and self._buckets[0][0] + self.bucket_span <= now - self.window:
+            self._drop_oldest_bucket()
+
+    def _evict_oldest_key(self):
+        bucket_start, keys = self._buckets[0]
+        key = keys.popleft()
+        if self._seen.get(key) == bucket_start:
+            del self._seen[key]
+        if not keys:
+            self._buckets.popleft()
+
+    def _drop_oldest_bucket(self):
+        bucket_start, keys = self._buckets.popleft()
+        for key in keys:
+            if self._seen.get(key) == bucket_start:
+                del self._seen[key]
+
+    # --- persistence ---
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+            for bucket_start, keys in saved["buckets"]:
+                keys = deque(tuple(key) if isinstance(key, list) else key for key in keys)
+                self._buckets.append((bucket_start, keys))
+                for key in keys:
+                    self._seen[key] = bucket_start
+            self._expire(time.time())
+            logging.info(f"Loaded {len(self._seen)} dedupe keys from {self.path}")
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Could not load dedupe store from {self.path}: {e}")
+
+    def save(self):
+        """Writes the store to `path`; returns False if that failed."""
+        if not self.path:
+            return True
+        with self._save_lock:
+            with self._lock:
+                buckets = [(bucket_start, [key for key in keys if self._seen.get(key) == bucket_start]) for bucket_start, keys in self._buckets]
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump({"window": self.window, "buckets": buckets}, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logging.warning(f"Could not save dedupe store to {self.path}: {e}")
+                return False
+        return True
+
+    def _save_periodically(self, interval):
+        while not self._stop.wait(interval):
+            self.save()
+
+    def close(self):
+        if self._saver:
+            self._stop.set()
+            self._saver.join()
+        self.save()
@@ -0,0 +1,105 @@
+# discord_dm_cache.py - recipient ID -> DM channel ID cache for the Discord bridge
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+class DMChannelCache:
+    """Bounded LRU map of Discord recipient ID -> DM channel ID, optionally persisted to a JSON file
+    so that a restarted bridge doesn't have to re-open every DM with POST /users/@me/channels.
+
+    put() and invalidate() only mark the cache dirty; a background thread writes it every `save_interval`
+    seconds (and close() once more), so callers on the event loop never wait on disk I/O.
+    """
+
+    def __init__(self, max_size=10000, path=None, save_interval=30.0):
+        self.max_size = max_size
+        self.path = path
+        self._channels = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale_hits = 0
+        self._load()
+        self._saver = None
+        if path:
+            self._stop = threading.Event()
+            self._saver = threading.Thread(target=self._save_periodically, args=(save_interval,), name="dm-cache-saver", daemon=True)
+            self._saver.start()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                for recipient_id, channel_id in json.load(f).items():
+                    self._channels[recipient_id] = channel_id
+            while len(self._channels) > self.max_size:
+                self._channels.popitem(last=False)
+            logging.info(f"Loaded {len(self._channels)} cached Discord DM channels from {self.path}")
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not load Discord DM channel cache from {self.path}: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            channels, self._dirty = dict(self._channels), False
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(channels, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self._dirty = True  # try again next round
+            logging.warning(f"Could not save Discord DM channel cache to {self.path}: {e}")
+
+    def _save_periodically(self, interval):
+        while not self._stop.wait(interval):
+            self.save()
+
+    def close(self):
+        if self._saver:
+            self._stop.set()
+            self._saver.join()
+        self.save()
+
+    def get(self, recipient_id):
+        recipient_id = str(recipient_id)
+        with self._lock:
+            channel_id = self._channels.get(recipient_id)
+            if channel_id is None:
+                self.misses += 1
+                return None
+            self._channels.move_to_end(recipient_id)
+            self.hits += 1
+            return channel_id
+
+    def put(self, recipient_id, channel_id):
+        with self._lock:
+            self._channels[str(recipient_id)] = str(channel_id)
+            self._channels.move_to_end(str(recipient_id))
+            while len(self._channels) > self.max_size:
+                self._channels.popitem(last=False)
+            self._dirty = True
+
+    def invalidate(self, recipient_id):
+        """Drops a channel that a hit returned but Discord rejected; that hit saved no round trip."""
+        with self._lock:
+            self.stale_hits += 1
+            if self._channels.pop(str(recipient_id), None) is not None:
+                self.invalidations += 1
+                self._dirty = True
+
+    def stats(self):
+        # Every fresh hit is one POST /users/@me/channels round trip that didn't happen. A stale hit is
+        # invalidated and the DM opened again anyway, so it saved nothing.
+        fresh_hits = max(self.hits - self.stale_hits, 0)
+        return {"size": len(self._channels), "hits": self.hits, "fresh_hits": fresh_hits, "stale_hits": self.stale_hits,
+                "misses": self.misses, "invalidations": self.invalidations, "round_trips_saved": fresh_hits}
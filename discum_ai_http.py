@@ -2,57 +2,157 @@
 
 import asyncio
 import aiohttp
+import functools
+import json
+import random
 import os
+import sqlite3
 import sys
+import threading
+import time
 import logging
+from collections import deque
+from contextlib import AsyncExitStack
+from datetime import datetime
 from dotenv import load_dotenv
-from slack_sdk.web.async_client import AsyncWebClient
+from slack_sdk.errors import SlackApiError
+from slack_sdk.socket_mode.aiohttp import SocketModeClient
+from slack_sdk.socket_mode.response import SocketModeResponse
 import discum
 from aiohttp import web # <-- NEW IMPORT
 
 from g_sheets_client import get_client_mappings
+from discord_dm_cache import DMChannelCache
+from media_cache import media_cache
+from coalescing import BurstBuffer, coalesce_window, render_burst
+from slack_markup import SLACK_NAME_REFRESH_INTERVAL, slack_names
+from slack_cursors import BackfillProgress, SlackCursors
+from media_relay import RELAY_FILE_CONCURRENCY, SpoolReader, gather_or_raise, relay_budget, relay_files_to_slack, spool_reservation, spooled_download
+from outbox import Outbox
+from dedupe_store import DedupeStore
+from message_index import MessageIndex, file_share_ts
+from sharding import shard_map
+from rate_limiter import RateLimited, RateLimitedAsyncWebClient, acquire_discord, background_calls, discord_route, rate_limiter, record_discord_response
+from metrics import (API_CALL_DURATION, API_CALL_ERRORS, COALESCED_MESSAGES, CONFIG_RELOAD_DURATION, CONTENT_TYPE, DELIVERIES_IN_FLIGHT, FORWARD_FAILURES, REQUEST_RETRIES,
+                     SHARD_HANDOFFS, record_delivery, register_outbox, registry)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(funcName)s] - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
 
 load_dotenv()
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN")
+# Slack only delivers each Socket Mode event to ONE open connection. The WhatsApp bridge already holds one on
+# SLACK_APP_TOKEN, so Socket Mode here needs a separate Slack app; sharing the token would split events between them.
+SLACK_APP_TOKEN = os.getenv("DISCORD_SLACK_APP_TOKEN")
+# "socket" = push-based ingestion over Socket Mode (polling only reconciles), "poll" = poll every channel.
+SLACK_INGEST_MODE = os.getenv("SLACK_INGEST_MODE", "socket" if SLACK_APP_TOKEN else "poll").lower()
+if SLACK_INGEST_MODE == "socket" and not SLACK_APP_TOKEN:
+    logging.error("SLACK_INGEST_MODE=socket needs DISCORD_SLACK_APP_TOKEN (an app separate from the WhatsApp bridge's); polling instead.")
+    SLACK_INGEST_MODE = "poll"
+SLACK_POLL_INTERVAL = float(os.getenv("SLACK_POLL_INTERVAL", 2))
+SLACK_RECONCILE_INTERVAL = float(os.getenv("SLACK_RECONCILE_INTERVAL", 300))
+# Channel cursors are fetched this many at a time on startup/reload; failed channels are retried in the background.
+SLACK_WARMUP_CONCURRENCY = int(os.getenv("SLACK_WARMUP_CONCURRENCY", 8))
+SLACK_WARMUP_RETRY_INTERVAL = float(os.getenv("SLACK_WARMUP_RETRY_INTERVAL", 30))
+BRIDGE_DATA_DIR = os.getenv("BRIDGE_DATA_DIR", "data")
+DISCORD_API_URL = "https://discord.com/api/v9"
+DISCORD_OUTBOX_DB = os.getenv("DISCORD_OUTBOX_DB", os.path.join(BRIDGE_DATA_DIR, "discord_outbox.db"))
+OUTBOX_RETRY_INTERVAL = float(os.getenv("OUTBOX_RETRY_INTERVAL", 1))
+# Slack ts <-> Discord message ID links, kept for edits/deletes for MESSAGE_INDEX_TTL seconds
+DISCORD_MESSAGE_INDEX_DB = os.getenv("DISCORD_MESSAGE_INDEX_DB", os.path.join(BRIDGE_DATA_DIR, "discord_message_index.db"))
+MESSAGE_INDEX_TTL = float(os.getenv("MESSAGE_INDEX_TTL", 30 * 24 * 3600))
+MESSAGE_INDEX_MAX_ENTRIES = int(os.getenv("MESSAGE_INDEX_MAX_ENTRIES", 500_000))
 DISCORD_USER_AGENT = os.getenv("DISCORD_USER_AGENT", "Mozilla/5.0")
+# Discord accepts at most this many files per message; larger Slack albums are split over several DMs
+DISCORD_MAX_FILES_PER_MESSAGE = 10
+# Slack messages already forwarded, so Socket Mode redeliveries and reconciliation sweeps don't send them twice
+DEDUPE_WINDOW = float(os.getenv("DEDUPE_WINDOW", 24 * 3600))
+DEDUPE_MAX_ENTRIES = int(os.getenv("DEDUPE_MAX_ENTRIES", 1_000_000))
+DISCORD_SLACK_SEEN_FILE = os.getenv("DISCORD_SLACK_SEEN_FILE", os.path.join(BRIDGE_DATA_DIR, "discord_slack_seen.json"))
+SLACK_SWEEP_PAGE_SIZE = int(os.getenv("SLACK_SWEEP_PAGE_SIZE", 200))
+DISCORD_SLACK_CURSORS_FILE = os.getenv("DISCORD_SLACK_CURSORS_FILE", os.path.join(BRIDGE_DATA_DIR, "discord_slack_cursors.json"))
+# Channels caught up on at the same time after a restart
+SLACK_BACKFILL_CONCURRENCY = int(os.getenv("SLACK_BACKFILL_CONCURRENCY", 4))
 # --- NEW: Port for this bridge's refresh server ---
 DISCORD_REFRESH_PORT = int(os.getenv("DISCORD_REFRESH_PORT", 8002))
 
-slack_client = AsyncWebClient(token=SLACK_BOT_TOKEN)
+slack_client = RateLimitedAsyncWebClient(token=SLACK_BOT_TOKEN)
 bot = discum.Client(token=DISCORD_TOKEN, log=False)
 
 MY_USER_ID, main_loop, aiohttp_session = None, None, None
+slack_bot_user_id = None
+# Durable record of every message between receipt and delivery; opened in main()
+outbox = None
 discord_id_to_slack_map, slack_to_discord_map = {}, {}
-slack_channel_state = {}
+# Per channel: ts of the newest message the last sweep saw. Sweeps fetch from here, and after a restart the
+# bridge catches up from it; it doesn't decide duplicates.
+processed_slack_messages = DedupeStore(window=DEDUPE_WINDOW, max_entries=DEDUPE_MAX_ENTRIES, path=DISCORD_SLACK_SEEN_FILE)
+slack_channel_state = SlackCursors(DISCORD_SLACK_CURSORS_FILE, seen=processed_slack_messages)
+slack_backfill = BackfillProgress()
+# Lane key -> deliveries waiting their turn; one task drains each lane so a chat's messages go out in order
+delivery_lanes = {}
+# Short DMs of clients with a coalescing window, waiting to be posted together from the client's lane
+discord_bursts = BurstBuffer()
+# Gateway events the discum thread accepted, waiting for the event loop; it takes them a batch at a time
+discord_inbox = []
+discord_inbox_lock = threading.Lock()
+discord_inbox_ready = None
+# Slack messages claimed on receipt, waiting for run_slack_ingest() to write them to the outbox a batch at a time:
+# (kind, event, client_info, background, persisted future)
+slack_inbox = []
+slack_inbox_ready = None
+# Channels whose cursor couldn't be fetched yet; sweeps skip them so they don't re-forward old history
+slack_channels_warming = set()
+dm_messages_sent = 0
+# Set DISCORD_DM_CACHE_FILE to an empty string to keep the cache in memory only.
+dm_channel_cache = DMChannelCache(
+    max_size=int(os.getenv("DISCORD_DM_CACHE_SIZE", 10000)),
+    path=os.getenv("DISCORD_DM_CACHE_FILE", os.path.join(BRIDGE_DATA_DIR, "discord_dm_channels.json")) or None,
+)
+message_index = MessageIndex(DISCORD_MESSAGE_INDEX_DB, ttl=MESSAGE_INDEX_TTL, max_entries=MESSAGE_INDEX_MAX_ENTRIES)
+
+# Read at scrape time from state the bridge already keeps
+register_outbox(lambda: outbox)
+registry.callback("bridge_slack_channels_warming", "Slack channels still waiting for their cursor.", lambda: len(slack_channels_warming))
+registry.callback("bridge_coalescing_messages", "Messages waiting in a burst to be posted together.", lambda: len(discord_bursts))
+registry.callback("bridge_discord_inbox_depth", "Accepted Discord gateway events waiting for the event loop.", lambda: len(discord_inbox))
+registry.callback("bridge_discord_dm_cache_entries", "Cached Discord DM channels.", lambda: dm_channel_cache.stats()["size"])
 
 # --- NEW: The async function that gets called on-demand to refresh the config ---
-async def reload_config():
-    global discord_id_to_slack_map, slack_to_discord_map, slack_channel_state
+async def reload_config(refresh=True):
+    with CONFIG_RELOAD_DURATION.labels("discord").time():
+        await _reload_config(refresh)
+
+async def _reload_config(refresh):
+    global discord_id_to_slack_map, slack_to_discord_map
     loop = asyncio.get_running_loop()
     logging.info("(Discord Bridge) Refresh signal received! Reloading config...")
     
     # Run the synchronous gspread function in a separate thread to avoid blocking asyncio
-    client_mappings_raw = await loop.run_in_executor(None, get_client_mappings, "Discord")
+    client_mappings_raw = await loop.run_in_executor(None, get_client_mappings, "Discord", refresh)
     
     if client_mappings_raw:
-        new_mappings = [{"client_name": c.get("client_name"), "discord_user_id": c.get("external_id"), "slack_channel_id": c.get("slack_channel_id")} for c in client_mappings_raw]
+        # Under bridge_supervisor.py each worker keeps only its share of the clients
+        client_mappings_raw = shard_map.assign(client_mappings_raw, "discord")
+        new_mappings = [{"client_name": c.get("client_name"), "discord_user_id": c.get("external_id"), "slack_channel_id": c.get("slack_channel_id"),
+                         "coalesce_window": coalesce_window(c)} for c in client_mappings_raw]
         new_discord_map = {item["discord_user_id"]: item for item in new_mappings if item.get("discord_user_id")}
         new_slack_map = {item["slack_channel_id"]: item for item in new_mappings if item.get("slack_channel_id")}
 
-        # Check for newly added Slack channels to initialize their state
-        for new_channel_id in new_slack_map:
-            if new_channel_id not in slack_to_discord_map:
-                logging.info(f"New client channel found: {new_channel_id}. Initializing state.")
-                try:
-                    response = await slack_client.conversations_history(channel=new_channel_id, limit=1)
-                    if response.get("messages"):
-                        slack_channel_state[new_channel_id] = response["messages"][0]['ts']
-                except Exception as e:
-                     logging.error(f"Could not initialize state for new channel {new_channel_id}: {e}")
+        # Check for newly added Slack channels to initialize their state; the ones with a saved cursor are
+        # caught up on by backfill_slack_channels() instead
+        slack_channel_state.retain(new_slack_map)
+        new_channel_ids = [channel_id for channel_id in new_slack_map if channel_id not in slack_to_discord_map and channel_id not in slack_channel_state]
+        if new_channel_ids:
+            # In the background: at Slack's Tier 3 pace (50 history calls/min) hundreds of channels take minutes,
+            # and startup shouldn't wait for them. Sweeps skip a channel until it has its cursor.
+            logging.info(f"{len(new_channel_ids)} new client channel(s) found. Initializing state in the background.")
+            slack_channels_warming.update(new_channel_ids)
+            asyncio.create_task(warm_up_slack_state(new_channel_ids))
         
+        if new_discord_map == discord_id_to_slack_map and new_slack_map == slack_to_discord_map:
+            logging.info("(Discord Bridge) Client mappings unchanged.")
+            return
         discord_id_to_slack_map = new_discord_map
         slack_to_discord_map = new_slack_map
         logging.info(f"(Discord Bridge) Configuration reloaded. Now tracking {len(discord_id_to_slack_map)} clients.")
@@ -60,13 +160,45 @@ async def reload_config():
 # --- NEW: The aiohttp server and its endpoint ---
 async def handle_refresh(request):
     """Endpoint handler that triggers the config reload as a background task."""
+    # The supervisor sends the new shard topology along; the reload then picks up this worker's new share
+    topology = await request.json() if request.can_read_body else {}
+    if "shard_count" in topology:
+        shard_map.update(topology["shard_count"], topology.get("peers", []))
+    if topology.get("wait"):
+        await reload_config()  # a shrink hands over the retired workers' messages once everyone has their new share
+        return web.Response(text="Configuration reloaded.")
     asyncio.create_task(reload_config())
     return web.Response(text="Refresh signal received.")
 
+async def handle_shard_handoff(request):
+    handoff = await request.json()
+    if handoff["kind"] == "slack_event":
+        persisted = queue_own_slack_event(handoff["payload"])
+        if persisted:
+            await persisted  # the sender may forget the event once we answer
+    elif handoff["kind"] == "discord_message":
+        # A DM a retired worker received but hadn't forwarded (bridge_supervisor.py)
+        message_dict = handoff["payload"]["message"]
+        author_id = str(message_dict['author']['id'])
+        client_info = discord_id_to_slack_map.get(author_id)
+        if client_info:
+            msg_id = await main_loop.run_in_executor(None, outbox.enqueue, "discord_to_slack", {"message": message_dict, "client_info": client_info}, author_id) if outbox else None
+            submit_in_lane(("discord_to_slack", author_id), deliver_discord_to_slack(msg_id, message_dict, client_info))
+    else:
+        return web.Response(status=400, text="Unknown hand-off kind.")
+    return web.Response(text="OK")
+
+async def handle_stats(request):
+    return web.json_response(bridge_stats())
+
+async def handle_metrics(request):
+    return web.Response(body=registry.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
 async def run_refresh_server():
     """Runs the aiohttp server to listen for the refresh signal."""
     app = web.Application()
-    app.add_routes([web.post('/refresh', handle_refresh)])
+    app.add_routes([web.post('/refresh', handle_refresh), web.post('/shard-handoff', handle_shard_handoff), web.get('/stats', handle_stats),
+                    web.get('/metrics', handle_metrics)])
     runner = web.AppRunner(app)
     await runner.setup()
     site = web.TCPSite(runner, 'localhost', DISCORD_REFRESH_PORT)
@@ -76,115 +208,647 @@ async def run_refresh_server():
     while True:
         await asyncio.sleep(3600)
 
-async def main():
-    global main_loop, aiohttp_session
+async def start(session):
+    """Loads the mappings, opens the outbox and starts the bridge's tasks on the running loop; returns them.
+    bridge_runtime.py calls this too, with its own Slack connection and endpoints."""
+    global main_loop, aiohttp_session, outbox, discord_inbox_ready, slack_inbox_ready
     main_loop = asyncio.get_running_loop()
-    
-    # Perform the initial config load on startup
-    await reload_config()
+    discord_inbox_ready = asyncio.Event()
+    slack_inbox_ready = asyncio.Event()
+    aiohttp_session = session
 
+    # Start from the last snapshot right away; the sheet itself is checked in the background.
+    started = time.perf_counter()
+    await reload_config(refresh=False)
+    logging.info(f"Client mappings ready after {(time.perf_counter() - started) * 1000:.0f} ms.")
+    asyncio.create_task(reload_config())
+    outbox = Outbox(DISCORD_OUTBOX_DB)
+
+    tasks = [asyncio.create_task(poll_slack_and_forward()), asyncio.create_task(run_outbox_relay()),
+             asyncio.create_task(run_discord_ingest()), asyncio.create_task(run_slack_ingest()), asyncio.create_task(run_burst_flusher()),
+             asyncio.create_task(run_slack_names_refresh())]
+    logging.info("Starting Discum gateway in a separate thread...")
+    tasks.append(main_loop.run_in_executor(None, discum_wrapper))
+    return tasks
+
+def bridge_stats():
+    return {"rate_limits": rate_limiter.stats(), "dm_channel_cache": dm_channel_cache.stats(), "shard": shard_map.stats(), "media_cache": media_cache.stats(),
+            "slack_names": slack_names.stats(), "slack_backfill": slack_backfill.stats()}
+
+def shutdown():
+    message_index.close()
+    processed_slack_messages.close()
+    slack_channel_state.close()
+    dm_channel_cache.close()
+    if bot.gateway.READY:
+        logging.info("Closing Discum gateway...")
+        bot.gateway.close()
+
+async def main():
     async with aiohttp.ClientSession() as session:
-        aiohttp_session = session
-        
-        # --- MODIFIED: Start all background tasks concurrently ---
-        slack_polling_task = asyncio.create_task(poll_slack_and_forward())
-        refresh_server_task = asyncio.create_task(run_refresh_server()) # <-- NEW
-        
-        logging.info("Starting Discum gateway in a separate thread...")
-        discum_thread_task = main_loop.run_in_executor(None, discum_wrapper)
+        tasks = await start(session)
+        tasks.append(asyncio.create_task(run_refresh_server()))
+        if SLACK_INGEST_MODE == "socket":
+            # Push-based Slack -> Discord ingestion; the polling task only reconciles missed events.
+            socket_client = SocketModeClient(app_token=SLACK_APP_TOKEN, web_client=slack_client)
+            socket_client.socket_mode_request_listeners.append(handle_slack_socket_event)
+            logging.info("Connecting to Slack Socket Mode for Slack -> Discord ingestion...")
+            await socket_client.connect()
 
         # Run all tasks together. If one fails, the others will be cancelled.
-        await asyncio.gather(slack_polling_task, refresh_server_task, discum_thread_task)
+        await asyncio.gather(*tasks)
 
 # --- All other Discord bridge functions (discum_wrapper, on_discord_message, etc.) remain unchanged ---
 async def retry_async_request(func, max_retries=3, *args, **kwargs):
     for i in range(max_retries):
         try: return await func(*args, **kwargs)
+        except RateLimited as e:
+            # The limiter already holds the bucket for Retry-After, so the retry simply queues behind it
+            REQUEST_RETRIES.labels("rate_limited").inc()
+            logging.warning(f"Request rate limited for {e.retry_after:.1f}s. Retrying...")
         except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-            logging.warning(f"Request failed: {e}. Retrying in {2**i} seconds...")
-            await asyncio.sleep(2**i)
+            REQUEST_RETRIES.labels("error").inc()
+            delay = 2**i * random.uniform(0.5, 1.5)
+            logging.warning(f"Request failed: {e}. Retrying in {delay:.1f} seconds...")
+            await asyncio.sleep(delay)
     logging.error(f"Request failed after {max_retries} retries. Giving up.")
     return None
-async def forward_file_to_slack(message_obj, client_info):
-    attachment = message_obj.attachments[0]
-    logging.info(f"Downloading file '{attachment.filename}' from Discord...")
-    async with aiohttp_session.get(attachment.url) as response:
-        if response.status == 200:
-            file_data = await response.read()
-            await slack_client.files_upload_v2(channel=client_info["slack_channel_id"], content=file_data, filename=attachment.filename, initial_comment=f"*{client_info['client_name']}:*\n{message_obj.content}")
-            logging.info("File forwarded to Slack successfully.")
-        else: logging.error(f"Failed to download file from Discord. Status: {response.status}")
-async def send_discord_dm_with_file(recipient_id, content, file_url, filename):
-    async with aiohttp_session.get(file_url, headers={"Authorization": f"Bearer {SLACK_BOT_TOKEN}"}) as response:
-        if response.status != 200:
-            logging.error(f"Failed to download file from Slack. Status: {response.status}")
-            return False
-        file_data = await response.read()
-    url = "https://discord.com/api/v9/users/@me/channels"
-    payload = {"recipients": [str(recipient_id)]}
+async def discord_api(method, path, build_request=dict):
+    """Calls the Discord REST API through the shared rate limiter and returns (status, JSON body or None).
+    `build_request` returns the aiohttp request kwargs; a 429 raises RateLimited after blocking the bucket."""
+    key = await acquire_discord(method, path)
+    route = discord_route(method, path)
     headers = {"Authorization": DISCORD_TOKEN, "User-Agent": DISCORD_USER_AGENT}
-    async with aiohttp_session.post(url, json=payload, headers=headers) as dm_response:
-        if dm_response.status in [200, 201]:
-            channel = await dm_response.json()
-            msg_url = f"https://discord.com/api/v9/channels/{channel['id']}/messages"
+    started = time.perf_counter()
+    try:
+        async with aiohttp_session.request(method, f"{DISCORD_API_URL}{path}", headers=headers, **build_request()) as response:
+            body = await response.json() if response.content_type == "application/json" else None
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        API_CALL_ERRORS.labels("discord", route).inc()
+        raise
+    finally:
+        API_CALL_DURATION.labels("discord", route).observe(time.perf_counter() - started)
+    if response.status >= 400:
+        API_CALL_ERRORS.labels("discord", route).inc()
+    record_discord_response(key, response.status, response.headers, body)
+    return response.status, body
+async def forward_files_to_slack(message_dict, client_info):
+    """Relays all of a Discord message's attachments as one Slack message, in order, captioned with its text."""
+    files = [(a['url'], a['filename'], a.get('size')) for a in message_dict['attachments']]
+    logging.info(f"Relaying {len(files)} file(s) from Discord...")
+    initial_comment = f"*{client_info['client_name']}:*\n{message_dict.get('content', '')}"
+    shared = await relay_files_to_slack(slack_client, aiohttp_session, files, client_info["slack_channel_id"], initial_comment)
+    if shared is None:
+        return False
+    slack_ts = await posted_file_ts(shared, client_info["slack_channel_id"])
+    await index_call(message_index.link, "discord", client_info["slack_channel_id"], slack_ts, message_dict.get("id"), message_dict.get("channel_id"), origin="discord")
+    logging.info(f"{len(files)} file(s) forwarded to Slack successfully.")
+    return True
+async def posted_file_ts(files, channel):
+    """The ts of the Slack message that shared just-uploaded `files`, asking files.info if the upload's response
+    didn't have it yet. None if Slack still hasn't reported it; the post then just isn't linked."""
+    slack_ts = file_share_ts(files, channel)
+    if slack_ts or not files:
+        return slack_ts
+    try:
+        info = await slack_client.files_info(file=files[0]["id"])
+        return file_share_ts([info.get("file") or {}], channel)
+    except SlackApiError as e:
+        logging.warning(f"Could not look up the Slack post of file {files[0]['id']}: {e.response.get('error')}")
+        return None
+async def index_call(method, *args, **kwargs):
+    """Runs a message_index call in the executor: its SQLite work, and the prune every so many writes, stays off the loop."""
+    return await main_loop.run_in_executor(None, functools.partial(method, *args, **kwargs))
+async def resolve_dm_channel(recipient_id):
+    """Returns (channel_id, was_cached) for a Discord user's DM, only opening the DM over the API on a cache miss."""
+    channel_id = dm_channel_cache.get(recipient_id)
+    if channel_id:
+        return channel_id, True
+    payload = {"recipients": [str(recipient_id)]}
+    status, channel = await discord_api("POST", "/users/@me/channels", lambda: {"json": payload})
+    if status in [200, 201]:
+        dm_channel_cache.put(recipient_id, channel['id'])
+        return channel['id'], False
+    logging.error(f"Failed to open Discord DM channel for {recipient_id}. Status: {status}")
+    return None, False
+async def post_discord_dm(recipient_id, build_request):
+    """POSTs a message to the recipient's DM channel and returns the created Discord message (None on failure).
+    `build_request` returns the aiohttp request kwargs (a FormData can't be sent twice).
+    A stale cached channel (403/404) is dropped and resolved again once."""
+    global dm_messages_sent
+    for attempt in range(2):
+        channel_id, was_cached = await resolve_dm_channel(recipient_id)
+        if not channel_id:
+            return None
+        status, sent = await discord_api("POST", f"/channels/{channel_id}/messages", build_request)
+        if status in [403, 404] and was_cached and attempt == 0:
+            logging.warning(f"Cached DM channel {channel_id} for {recipient_id} is stale (status {status}). Re-resolving...")
+            dm_channel_cache.invalidate(recipient_id)
+            continue
+        if status not in [200, 201]:
+            logging.error(f"Failed to send Discord DM to {recipient_id}. Status: {status}")
+            return None
+        dm_messages_sent += 1
+        if dm_messages_sent % 100 == 0:
+            stats = dm_channel_cache.stats()
+            logging.info(f"Discord DM channel cache: {stats['hits']} hits, {stats['misses']} misses, "
+                         f"{stats['round_trips_saved']} round trips saved over {dm_messages_sent} messages.")
+        return sent
+    return None
+async def send_discord_dm_with_files(recipient_id, content, files):
+    """Sends Slack `files` as one DM captioned `content`, downloading RELAY_FILE_CONCURRENCY of them at a time.
+    All the spools are open until the DM is sent, so their RAM is reserved from the relay budget in one go:
+    two albums each holding part of the budget while waiting for the rest would never finish."""
+    slack_headers = {"Authorization": f"Bearer {SLACK_BOT_TOKEN}"}
+    semaphore = asyncio.Semaphore(RELAY_FILE_CONCURRENCY)
+    async with relay_budget.reserve(sum(spool_reservation(f.get("size")) for f in files)), AsyncExitStack() as spools:
+        async def download(file_info):
+            async with semaphore:
+                return await spools.enter_async_context(spooled_download(
+                    aiohttp_session, file_info.get("url_private_download"), headers=slack_headers, expected_size=file_info.get("size"), budget=None))
+        downloads = await gather_or_raise([download(f) for f in files])
+        if any(spool is None for spool, _ in downloads):
+            logging.error(f"Failed to download {len(files)} file(s) from Slack for Discord.")
+            return None
+        def build_request():
             form_data = aiohttp.FormData()
-            form_data.add_field('file', file_data, filename=filename)
-            form_data.add_field('payload_json', f'{{"content": "{content}"}}')
-            async with aiohttp_session.post(msg_url, data=form_data, headers={"Authorization": DISCORD_TOKEN, "User-Agent": DISCORD_USER_AGENT}) as msg_response:
-                if msg_response.status == 200: return True
-    logging.error(f"Failed to forward file to Discord.")
-    return False
+            for i, ((spool, _), file_info) in enumerate(zip(downloads, files)):
+                form_data.add_field(f'files[{i}]', SpoolReader(spool), filename=file_info.get("name"))
+            attachments = [{"id": i, "filename": f.get("name")} for i, f in enumerate(files)]
+            form_data.add_field('payload_json', json.dumps({"content": content, "attachments": attachments}))
+            return {"data": form_data}
+        sent = await post_discord_dm(recipient_id, build_request)
+        if sent: return sent
+    logging.error(f"Failed to forward file(s) to Discord.")
+    return None
 async def send_discord_dm(recipient_id, content):
-    url = "https://discord.com/api/v9/users/@me/channels"
-    payload = {"recipients": [str(recipient_id)]}
-    headers = {"Authorization": DISCORD_TOKEN, "Content-Type": "application/json", "User-Agent": DISCORD_USER_AGENT}
-    async with aiohttp_session.post(url, json=payload, headers=headers) as response:
-        if response.status in [200, 201]:
-            channel = await response.json()
-            msg_url = f"https://discord.com/api/v9/channels/{channel['id']}/messages"
-            msg_payload = {"content": content}
-            await aiohttp_session.post(msg_url, json=msg_payload, headers=headers)
-            return True
-    return False
+    return await post_discord_dm(recipient_id, lambda: {"json": {"content": content}})
+async def sync_slack_change_to_discord(event):
+    """Mirrors a Slack edit or delete onto the Discord DM it was forwarded as."""
+    channel_id = event.get("channel")
+    if event.get("subtype") == "message_deleted":
+        linked = await index_call(message_index.remote_for, "discord", channel_id, event.get("deleted_ts"))
+        if not linked: return
+        dm_channel_id, discord_message_id = linked
+        status, _ = await discord_api("DELETE", f"/channels/{dm_channel_id}/messages/{discord_message_id}")
+        if status not in [200, 204, 404]:
+            logging.error(f"Failed to delete Discord message {discord_message_id}. Status: {status}")
+            return
+        await index_call(message_index.forget, "discord", channel_id, event.get("deleted_ts"))
+        logging.info(f"Deleted Discord message {discord_message_id} after its Slack original was deleted.")
+    else:
+        edited = event.get("message", {})
+        linked = await index_call(message_index.remote_for, "discord", channel_id, edited.get("ts"))
+        if not linked or edited.get("bot_id"): return
+        dm_channel_id, discord_message_id = linked
+        payload = {"content": await slack_names.resolve_async(slack_client, edited.get("text", ""))}
+        status, _ = await discord_api("PATCH", f"/channels/{dm_channel_id}/messages/{discord_message_id}", lambda: {"json": payload})
+        if status != 200:
+            logging.error(f"Failed to edit Discord message {discord_message_id}. Status: {status}")
+            return
+        logging.info(f"Edited Discord message {discord_message_id} to match its Slack original.")
 @bot.gateway.command
 def on_discord_message(resp):
-    global MY_USER_ID, main_loop
-    if resp.event.ready:
+    global MY_USER_ID
+    # Runs on the discum thread for every gateway event. An account in busy guilds gets mostly guild traffic,
+    # so events are rejected on the raw type/guild/author fields before anything is parsed.
+    event_type, data = resp.raw.get('t'), resp.raw.get('d') or {}
+    if event_type == 'MESSAGE_CREATE':
+        if 'guild_id' in data: return
+        author_id = str((data.get('author') or {}).get('id'))
+        client_info = discord_id_to_slack_map.get(author_id)
+        if not client_info or author_id == MY_USER_ID: return
+        logging.info(f"-> Discord DM received from '{client_info['client_name']}'. Forwarding to Slack...")
+        hand_to_loop(("message", resp.parsed.auto(), client_info))
+    elif event_type in ('MESSAGE_UPDATE', 'MESSAGE_DELETE'):
+        # Embed-only updates carry no content; only real edits are mirrored
+        if 'guild_id' not in data and (event_type == 'MESSAGE_DELETE' or 'content' in data):
+            hand_to_loop(("change", data, event_type == 'MESSAGE_DELETE'))
+    elif event_type == 'READY':
         user = bot.gateway.session.user; MY_USER_ID = user['id']
         logging.info(f"Discord Userbot is LIVE. Logged in as: {user['username']}#{user['discriminator']}")
+def hand_to_loop(item):
+    """Queues an accepted gateway event for the event loop, waking it only when the queue was empty."""
+    with discord_inbox_lock:
+        discord_inbox.append(item)
+        if len(discord_inbox) > 1: return
+    main_loop.call_soon_threadsafe(discord_inbox_ready.set)
+async def run_discord_ingest():
+    """Takes accepted gateway events off the inbox in batches: one outbox write per batch, then each into its lane in arrival order."""
+    while True:
+        await discord_inbox_ready.wait()
+        discord_inbox_ready.clear()
+        with discord_inbox_lock:
+            batch = discord_inbox[:]
+            discord_inbox.clear()
+        messages = [(item[1], item[2]) for item in batch if item[0] == "message"]
+        changes = [item[1] for item in batch if item[0] == "change"]
+        msg_ids = iter([None] * len(messages))
+        if outbox and messages:
+            entries = [({"message": message_dict, "client_info": client_info}, str(message_dict['author']['id'])) for message_dict, client_info in messages]
+            msg_ids = iter(await main_loop.run_in_executor(None, outbox.enqueue_many, "discord_to_slack", entries))
+        linked = iter(await index_call(lambda: [message_index.slack_for("discord", data.get('id')) for data in changes]) if changes else ())
+        for kind, data, extra in batch:
+            if kind == "message":
+                submit_in_lane(("discord_to_slack", str(data['author']['id'])), deliver_discord_to_slack(next(msg_ids), data, extra))
+            else:
+                queue_discord_change(data, extra, next(linked))
+def queue_discord_change(data, deleted, linked):
+    """Queues a client's Discord edit/delete in their lane, behind the message it changes. `linked` is the
+    message's Slack post from message_index.slack_for(), looked up off the loop."""
+    client_info = (linked and slack_to_discord_map.get(linked[0])) or discord_bursts.pending_context(data.get('id'))
+    if client_info:
+        submit_in_lane(("discord_to_slack", str(client_info["discord_user_id"])), sync_discord_change_to_slack(data, deleted, client_info))
+async def sync_discord_change_to_slack(data, deleted, client_info):
+    """Mirrors a Discord edit or delete onto the Slack message it was forwarded as."""
+    await flush_discord_burst(str(client_info["discord_user_id"]))  # the message may still be waiting in its burst
+    linked = await index_call(message_index.slack_for, "discord", data.get('id'))
+    if not linked: return
+    slack_channel, slack_ts = linked
+    # A message that went out in a merged post only changes its own line of it
+    burst = await index_call(message_index.update_burst, "discord", data.get('id'), None if deleted else data.get('content', ''))
+    try:
+        if burst and burst[2]:
+            await slack_client.chat_update(channel=slack_channel, ts=slack_ts, text=render_burst(client_info['client_name'], burst[2]))
+        elif deleted:
+            await slack_client.chat_delete(channel=slack_channel, ts=slack_ts)
+            await index_call(message_index.forget, "discord", slack_channel, slack_ts)
+        else:
+            await slack_client.chat_update(channel=slack_channel, ts=slack_ts, text=f"*{client_info['client_name']}:*\n{data.get('content', '')}")
+        logging.info(f"Synced Discord {'delete' if deleted else 'edit'} from '{client_info['client_name']}' to Slack.")
+    except SlackApiError as e:
+        if e.response.get("error") == "message_not_found":
+            await index_call(message_index.forget, "discord", slack_channel, slack_ts)
+            return
+        logging.error(f"Failed to sync Discord {'delete' if deleted else 'edit'} to Slack: {e.response.get('error')}")
+def defer_if_blocked(msg_id):
+    """Leaves a message to the outbox relay while an earlier message of its chat waits for a retry, keeping the chat in order."""
+    if outbox is None or msg_id is None or not outbox.is_blocked(msg_id): return False
+    outbox.defer(msg_id)
+    return True
+def settle_outbox(msg_id, delivered, error="delivery failed"):
+    """Removes a delivered message from the outbox, or schedules its retry."""
+    if outbox is None or msg_id is None: return
+    if delivered:
+        outbox.complete(msg_id)
+    else:
+        outbox.fail(msg_id, error)
+async def record_outbox_progress(msg_id, payload):
+    """Saves how far a message sent in several parts got, so its retry only sends the rest."""
+    if outbox is None or msg_id is None: return
+    try:
+        await main_loop.run_in_executor(None, outbox.update, msg_id, payload)
+    except sqlite3.Error as e:
+        logging.warning(f"Could not record the progress of outbox message {msg_id}: {e}. Its retry may repeat parts of it.")
+def message_size(text, files):
+    """Bytes a message carries: its text plus the attachments' sizes where the platform reports them."""
+    return len((text or "").encode()) + sum(f.get("size") or 0 for f in files or ())
+def record_outcome(direction, delivered, sent_at, size):
+    if delivered:
+        record_delivery(direction, sent_at, size)
+    else:
+        FORWARD_FAILURES.labels(direction).inc()
+def discord_timestamp(message_dict):
+    try:
+        return datetime.fromisoformat(message_dict["timestamp"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return None
+def is_coalescible(message_dict, client_info):
+    return bool(client_info.get("coalesce_window")) and not message_dict.get('attachments')
+async def post_discord_burst(burst):
+    """Posts a burst of a client's DMs as one Slack message, linking it to each of them."""
+    client_info = burst.context
+    try:
+        response = await slack_client.chat_postMessage(channel=client_info["slack_channel_id"], text=render_burst(client_info["client_name"], [body for _, body in burst.parts]))
+        delivered = True
+    except Exception:
+        logging.error(f"Failed to forward {len(burst.items)} Discord message(s) from '{client_info['client_name']}':", exc_info=True)
+        delivered = False
+    if delivered:
+        try:
+            await index_call(message_index.link_burst, "discord", client_info["slack_channel_id"], response.get("ts"), burst.parts, burst.items[0][1].get("channel_id"))
+        except Exception as e:
+            logging.error(f"Could not link merged Slack post {response.get('ts')} to its Discord messages: {e}")
+        COALESCED_MESSAGES.labels("discord_to_slack").inc(len(burst.items) - 1)
+    for (msg_id, message_dict), (_, body) in zip(burst.items, burst.parts):
+        record_outcome("discord_to_slack", delivered, discord_timestamp(message_dict), message_size(body, None))
+        settle_outbox(msg_id, delivered)
+async def flush_discord_burst(author_id):
+    burst = discord_bursts.take(author_id)
+    if burst:
+        await post_discord_burst(burst)
+async def run_slack_names_refresh():
+    """Keeps the display names for Slack mentions loaded, so forwarding rarely has to look one up."""
+    while True:
+        if slack_names.refresh_due():
+            try:
+                with background_calls():
+                    await slack_names.warm_async(slack_client)
+            except Exception as e:
+                logging.warning(f"Could not load Slack user names: {e}")
+        await asyncio.sleep(min(SLACK_NAME_REFRESH_INTERVAL, 60))
+async def run_burst_flusher():
+    """Posts bursts whose coalescing window has passed, from their client's lane so they stay in order."""
+    while True:
+        await asyncio.sleep(0.1)
+        for author_id in discord_bursts.due():
+            submit_in_lane(("discord_to_slack", author_id), flush_discord_burst(author_id))
+async def deliver_discord_to_slack(msg_id, message_dict, client_info):
+    if defer_if_blocked(msg_id): return
+    author_id = str(message_dict['author']['id'])
+    if is_coalescible(message_dict, client_info):
+        # Settled when its burst is posted
+        full = discord_bursts.add(author_id, client_info["coalesce_window"], message_dict.get('id'), message_dict.get('content', ''), (msg_id, message_dict), client_info)
+        if full:
+            await post_discord_burst(full)
         return
-    if resp.event.message:
-        message_dict = resp.parsed.auto()
-        author_id = message_dict['author']['id']
-        if 'guild_id' not in message_dict and str(author_id) in discord_id_to_slack_map and author_id != MY_USER_ID:
-            client_info = discord_id_to_slack_map[str(author_id)]
-            logging.info(f"-> Discord DM received from '{client_info['client_name']}'. Forwarding to Slack...")
-            coro = process_discord_to_slack(message_dict, client_info)
-            asyncio.run_coroutine_threadsafe(coro, main_loop)
+    await flush_discord_burst(author_id)
+    in_flight = DELIVERIES_IN_FLIGHT.labels("discord_to_slack")
+    in_flight.inc()
+    try:
+        delivered = await process_discord_to_slack(message_dict, client_info)
+    finally:
+        in_flight.inc(-1)
+    record_outcome("discord_to_slack", delivered, discord_timestamp(message_dict), message_size(message_dict.get("content"), message_dict.get("attachments")))
+    settle_outbox(msg_id, delivered)
+async def deliver_slack_to_discord(message, client_info, msg_id=None, sent=0):
+    if not is_client_bound_slack_message(message):
+        settle_outbox(msg_id, True)
+        return
+    if defer_if_blocked(msg_id): return
+    in_flight = DELIVERIES_IN_FLIGHT.labels("slack_to_discord")
+    in_flight.inc()
+    try:
+        delivered = await forward_slack_message_to_discord(message, client_info, msg_id, sent)
+    except Exception as e:
+        logging.error(f"An exception occurred forwarding Slack message to Discord: {e}", exc_info=True)
+        delivered = False
+    finally:
+        in_flight.inc(-1)
+    record_outcome("slack_to_discord", delivered, message.get("ts"), message_size(message.get("text"), message.get("files")))
+    settle_outbox(msg_id, delivered)
+async def run_outbox_relay():
+    """Replays whatever the previous process left undelivered, then keeps retrying failed messages as they fall due."""
+    loop = asyncio.get_running_loop()
+    entries = await loop.run_in_executor(None, lambda: list(outbox.replay()))
+    if entries:
+        logging.info(f"Replaying {len(entries)} undelivered message(s) from the outbox...")
+    while True:
+        for msg_id, kind, lane, payload in entries:
+            # Through the chat's lane, after anything already queued there, so each chat is retried in order
+            if kind == "discord_to_slack":
+                submit_in_lane((kind, lane), deliver_discord_to_slack(msg_id, payload["message"], payload["client_info"]))
+            elif kind == "slack_to_discord":
+                submit_in_lane((kind, lane), deliver_slack_to_discord(payload["message"], payload["client_info"], msg_id, payload.get("sent", 0)))
+            else:
+                logging.error(f"Unknown outbox message kind '{kind}' (id {msg_id}); leaving it for inspection.")
+        await asyncio.sleep(OUTBOX_RETRY_INTERVAL)
+        entries = await loop.run_in_executor(None, outbox.claim_due)
 async def process_discord_to_slack(message_dict, client_info):
+    """Returns False only if the message should be retried later."""
     try:
         if message_dict.get('attachments'):
-            class Attachment:
-                def __init__(self, data): self.url, self.filename = data['url'], data['filename']
-            class Message:
-                def __init__(self, data, attachment): self.content, self.attachments = data.get('content', ''), [attachment]
-            attachment_obj = Attachment(message_dict['attachments'][0])
-            message_obj = Message(message_dict, attachment_obj)
-            await retry_async_request(forward_file_to_slack, 3, message_obj, client_info)
-        else:
-            await slack_client.chat_postMessage(channel=client_info["slack_channel_id"], text=f"*{client_info['client_name']}:*\n{message_dict.get('content', '')}")
+            return bool(await retry_async_request(forward_files_to_slack, 3, message_dict, client_info))
+        response = await slack_client.chat_postMessage(channel=client_info["slack_channel_id"], text=f"*{client_info['client_name']}:*\n{message_dict.get('content', '')}")
+        await index_call(message_index.link, "discord", client_info["slack_channel_id"], response.get("ts"), message_dict.get("id"), message_dict.get("channel_id"), origin="discord")
+        return True
     except Exception:
         logging.error("An exception occurred in process_discord_to_slack:", exc_info=True)
+        return False
+async def fetch_channel_cursor(channel_id):
+    """Stores the ts of the channel's newest message as its cursor. Returns False if it should be retried."""
+    try:
+        # slack_client paces conversations.history and waits out 429s; warm-up yields to interactive calls
+        with background_calls():
+            response = await slack_client.conversations_history(channel=channel_id, limit=1)
+    except SlackApiError as e:
+        logging.error(f"Could not initialize state for Slack channel {channel_id}: {e.response.get('error')}")
+        return False
+    except Exception as e:
+        logging.error(f"Could not initialize state for Slack channel {channel_id}: {e}")
+        return False
+    messages = response.get("messages", [])
+    # A sweep may already have set a newer cursor while we waited
+    if messages:
+        slack_channel_state.advance(channel_id, messages[0]['ts'])
+    return True
+async def warm_up_slack_state(channel_ids):
+    """Fetches the cursors of `channel_ids`, SLACK_WARMUP_CONCURRENCY at a time. Channels that fail stay out of
+    sweeps and are retried in the background. Returns the channel IDs that failed."""
+    semaphore = asyncio.Semaphore(SLACK_WARMUP_CONCURRENCY)
+    started = time.perf_counter()
+    slack_channels_warming.update(channel_ids)
+    async def warm(channel_id):
+        async with semaphore:
+            if await fetch_channel_cursor(channel_id):
+                slack_channels_warming.discard(channel_id)
+                return None
+            return channel_id
+    failed = [channel_id for channel_id in await asyncio.gather(*(warm(c) for c in channel_ids)) if channel_id]
+    logging.info(f"Slack state warmed up for {len(channel_ids) - len(failed)}/{len(channel_ids)} channel(s) in {time.perf_counter() - started:.1f}s.")
+    if failed:
+        logging.warning(f"{len(failed)} channel(s) failed to initialize; retrying every {SLACK_WARMUP_RETRY_INTERVAL}s in the background.")
+        asyncio.create_task(retry_slack_warm_up(failed))
+    return failed
+async def retry_slack_warm_up(channel_ids):
+    delay = SLACK_WARMUP_RETRY_INTERVAL
+    while channel_ids:
+        await asyncio.sleep(delay)
+        # Drop channels that were removed from the mappings or got a cursor meanwhile
+        still_needed = [c for c in channel_ids if c in slack_to_discord_map and c not in slack_channel_state]
+        slack_channels_warming.difference_update(set(channel_ids) - set(still_needed))
+        channel_ids = still_needed
+        retry = []
+        for channel_id in channel_ids:
+            if await fetch_channel_cursor(channel_id):
+                slack_channels_warming.discard(channel_id)
+            else:
+                retry.append(channel_id)
+        if len(retry) < len(channel_ids):
+            logging.info(f"Background warm-up initialized {len(channel_ids) - len(retry)} more channel(s); {len(retry)} left.")
+        channel_ids = retry
+        delay = min(delay * 2, 600)
 async def initialize_slack_state():
-    for channel_id in slack_to_discord_map.keys():
+    # reload_config() already started warming up the channels it loaded; this only picks up anything it missed
+    channel_ids = [c for c in slack_to_discord_map if c not in slack_channel_state and c not in slack_channels_warming]
+    if channel_ids:
+        slack_channels_warming.update(channel_ids)
+        asyncio.create_task(warm_up_slack_state(channel_ids))
+    logging.info(f"Slack state: {len(slack_channel_state)} channel(s) ready, {len(slack_channels_warming)} warming up in the background.")
+    asyncio.create_task(backfill_slack_channels([c for c in slack_to_discord_map if c in slack_channel_state]))
+def claim_slack_message(channel_id, ts):
+    """Returns True the first time a message is seen. Socket Mode events and reconciliation sweeps both go
+    through here, so a message is sent once whichever path, and in whatever order, it arrives by."""
+    return bool(ts) and processed_slack_messages.check_and_add((channel_id, ts))
+def submit_in_lane(key, coro):
+    """Runs `coro` after everything already submitted to the lane `key`. Must be called on the event loop."""
+    lane = delivery_lanes.get(key)
+    if lane is not None:
+        lane.append(coro)
+        return
+    lane = delivery_lanes[key] = deque([coro])
+    asyncio.create_task(drain_lane(key, lane))
+async def drain_lane(key, lane):
+    try:
+        while lane:
+            try:
+                await lane[0]
+            except Exception:
+                logging.error(f"An exception occurred delivering in lane {key}:", exc_info=True)
+            lane.popleft()
+    finally:
+        delivery_lanes.pop(key, None)
+def is_client_bound_slack_message(message):
+    """True for messages a teammate wrote in the client's channel (not the bridge's own posts)."""
+    user = message.get("user")
+    return bool(user) and user != slack_bot_user_id and not message.get("bot_id")
+async def forward_slack_message_to_discord(message, client_info, msg_id=None, sent=0):
+    """Returns False only if the message should be retried later. More than DISCORD_MAX_FILES_PER_MESSAGE files go
+    out as several DMs; `sent` is how many of them an earlier attempt already delivered, and they are skipped."""
+    text = await slack_names.resolve_async(slack_client, message.get("text", ""))
+    logging.info(f"<- Slack message received for '{client_info['client_name']}'. Forwarding to Discord...")
+    discord_user_id = client_info["discord_user_id"]
+    files = [f for f in message.get("files") or () if f.get("url_private_download")]
+    if not files:
+        dm = await retry_async_request(send_discord_dm, 3, discord_user_id, text)
+        if dm:
+            await index_call(message_index.link, "discord", client_info["slack_channel_id"], message.get("ts"), dm.get("id"), dm.get("channel_id"))
+        return bool(dm)
+    batches = range(0, len(files), DISCORD_MAX_FILES_PER_MESSAGE)
+    for batch, start in enumerate(batches):
+        if batch < sent:
+            continue
+        # The caption goes with the first batch; the message is linked to the first DM for edits/deletes
+        dm = await retry_async_request(send_discord_dm_with_files, 3, discord_user_id, text if start == 0 else "", files[start:start + DISCORD_MAX_FILES_PER_MESSAGE])
+        if not dm: return False
+        if batch == 0:
+            await index_call(message_index.link, "discord", client_info["slack_channel_id"], message.get("ts"), dm.get("id"), dm.get("channel_id"))
+        if batch + 1 < len(batches):
+            await record_outbox_progress(msg_id, {"message": message, "client_info": client_info, "sent": batch + 1})
+    return True
+async def handle_slack_socket_event(client, req):
+    # slack_sdk runs each listener as its own task: claim and queue before the first await so lanes keep arrival order
+    persisted = queue_slack_event(req.payload.get("event", {})) if req.type == "events_api" else None
+    if persisted:
+        await persisted  # Slack won't redeliver an acked event, so ack only once it's in the outbox
+    await client.send_socket_mode_response(SocketModeResponse(envelope_id=req.envelope_id))
+async def hand_off(owner_url, kind, payload):
+    """Gives an event for another shard's client to the worker that owns it."""
+    try:
+        async with aiohttp_session.post(f"{owner_url}/shard-handoff", json={"kind": kind, "payload": payload}, timeout=aiohttp.ClientTimeout(total=10)) as response:
+            response.raise_for_status()
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        SHARD_HANDOFFS.labels(kind, "failed").inc()
+        raise
+    SHARD_HANDOFFS.labels(kind, "ok").inc()
+def queue_slack_event(event):
+    """Claims and queues a Slack event. Returns a future that's done once a new message is in the outbox, or None."""
+    if event.get("type") != "message":
+        return None
+    # Slack spreads events over the workers' connections; another shard's channel goes to its owner, in the
+    # channel's lane so its events arrive in order. If that fails for good, the owner's sweep still picks it up.
+    owner = shard_map.owner_of(event.get("channel"))
+    if owner:
+        submit_in_lane(("shard_handoff", event.get("channel")), retry_async_request(hand_off, 3, owner, "slack_event", event))
+        return None
+    return queue_own_slack_event(event)
+def queue_own_slack_event(event, background=False):
+    """Claims a Slack event for one of our channels and queues it for run_slack_ingest(), which keeps arrival order.
+    Returns a future that's done once a new message is in the outbox, or None if there's nothing to deliver."""
+    channel_id = event.get("channel")
+    client_info = slack_to_discord_map.get(channel_id)
+    if not client_info:
+        return None
+    if event.get("subtype") in ("message_deleted", "message_changed"):
+        slack_inbox.append(("change", event, client_info, False, None))
+        slack_inbox_ready.set()
+        return None
+    if event.get("subtype") in (None, "file_share") and claim_slack_message(channel_id, event.get("ts")):
+        persisted = main_loop.create_future()
+        slack_inbox.append(("message", event, client_info, background, persisted))
+        slack_inbox_ready.set()
+        return persisted
+    return None
+async def run_slack_ingest():
+    """Takes claimed Slack events off the inbox in batches: one outbox write per batch, then each into its channel's
+    lane in arrival order. A message is durable from the moment it's claimed, before it waits for its lane."""
+    while True:
+        await slack_inbox_ready.wait()
+        slack_inbox_ready.clear()
+        batch = slack_inbox[:]
+        slack_inbox.clear()
+        messages = [(event, client_info) for kind, event, client_info, _, _ in batch if kind == "message"]
+        msg_ids = [None] * len(messages)
+        if outbox and messages:
+            entries = [({"message": event, "client_info": client_info}, client_info["slack_channel_id"]) for event, client_info in messages]
+            try:
+                msg_ids = await main_loop.run_in_executor(None, outbox.enqueue_many, "slack_to_discord", entries)
+            except sqlite3.Error as e:
+                logging.error(f"Could not persist {len(messages)} Slack message(s) to the outbox: {e}. Delivering them without retries.")
+        msg_ids = iter(msg_ids)
+        for kind, event, client_info, background, persisted in batch:
+            # Backfill shares the channel's lane with live messages and edits, so the channel stays in order and an
+            # edit right after a post finds its Discord copy
+            lane = ("slack_to_discord", client_info["slack_channel_id"])
+            if kind == "change":
+                submit_in_lane(lane, retry_async_request(sync_slack_change_to_discord, 3, event))
+                continue
+            delivery = deliver_slack_to_discord(event, client_info, next(msg_ids))
+            submit_in_lane(lane, in_background(delivery) if background else delivery)
+            if not persisted.done():
+                persisted.set_result(None)
+async def in_background(coro):
+    """Runs `coro` with its API calls at BACKGROUND priority, behind live deliveries."""
+    with background_calls():
+        return await coro
+async def sweep_slack_channel(slack_channel_id, client_info, catching_up=False):
+    """Forwards everything in the channel newer than its cursor, oldest first, and advances the cursor.
+    Returns how many of the messages hadn't been seen yet. A catch-up after a restart goes through the channel's
+    lane like live messages, with its API calls at background priority."""
+    messages, cursor = [], None
+    oldest = slack_channel_state.oldest(slack_channel_id)
+    while True:
+        with background_calls():
+            response = await slack_client.conversations_history(channel=slack_channel_id, oldest=oldest, limit=SLACK_SWEEP_PAGE_SIZE, cursor=cursor)
+        messages.extend(response.get("messages", []))
+        cursor = (response.get("response_metadata") or {}).get("next_cursor")
+        if not response.get("has_more") or not cursor:
+            break
+    messages.sort(key=lambda message: float(message["ts"]))
+    # History messages don't carry their channel; queued like Socket Mode events, claimed the same way
+    persisted = [queue_own_slack_event({**message, "channel": slack_channel_id}, background=catching_up) for message in messages]
+    persisted = [future for future in persisted if future]
+    # The cursor only moves past messages that are safely in the outbox
+    await asyncio.gather(*persisted)
+    new = len(persisted)
+    if messages:
+        slack_channel_state.advance(slack_channel_id, messages[-1]["ts"])
+    return new
+async def sweep_slack_channels():
+    """One pass of conversations_history over every mapped channel, forwarding anything newer than its cursor."""
+    current_slack_map = dict(slack_to_discord_map)
+    for slack_channel_id, client_info in current_slack_map.items():
+        if slack_channel_id in slack_channels_warming: continue
         try:
-            response = await slack_client.conversations_history(channel=channel_id, limit=1)
-            messages = response.get("messages", [])
-            if messages: slack_channel_state[channel_id] = messages[0]['ts']
-        except Exception as e:
-            logging.error(f"Could not initialize state for Slack channel {channel_id}: {e}")
-    logging.info(f"Slack state initialized for {len(slack_channel_state)} channels.")
+            await sweep_slack_channel(slack_channel_id, client_info)
+        except Exception:
+            logging.error(f"An exception occurred while polling channel {slack_channel_id}:", exc_info=True)
+async def backfill_slack_channels(channel_ids):
+    """Catches up on what was posted while the bridge was down: sweeps the channels with a saved cursor,
+    SLACK_BACKFILL_CONCURRENCY at a time, fetching and delivering at background priority so live messages go first."""
+    semaphore = asyncio.Semaphore(SLACK_BACKFILL_CONCURRENCY)
+    slack_backfill.start(len(channel_ids))
+    async def backfill(channel_id):
+        async with semaphore:
+            client_info = slack_to_discord_map.get(channel_id)
+            try:
+                slack_backfill.channel_done(await sweep_slack_channel(channel_id, client_info, catching_up=True) if client_info else 0)
+            except Exception:
+                logging.error(f"An exception occurred while catching up on channel {channel_id}:", exc_info=True)
+                slack_backfill.channel_done(0, failed=True)
+    await asyncio.gather(*(backfill(c) for c in channel_ids))
 async def poll_slack_and_forward():
+    global slack_bot_user_id
     try:
         auth_test = await slack_client.auth_test()
         slack_bot_user_id = auth_test["user_id"]
@@ -192,31 +856,12 @@ async def poll_slack_and_forward():
         logging.critical("Could not fetch Slack bot user ID. Exiting.", exc_info=True)
         return
     await initialize_slack_state()
-    logging.info("Slack polling loop is running...")
+    # In socket mode events arrive pushed; this loop only reconciles anything Socket Mode missed (e.g. during a reconnect).
+    interval = SLACK_RECONCILE_INTERVAL if SLACK_INGEST_MODE == "socket" else SLACK_POLL_INTERVAL
+    logging.info(f"Slack {'reconciliation' if SLACK_INGEST_MODE == 'socket' else 'polling'} loop is running every {interval}s...")
     while True:
-        current_slack_map = dict(slack_to_discord_map)
-        for slack_channel_id, client_info in current_slack_map.items():
-             try:
-                last_known_ts = slack_channel_state.get(slack_channel_id)
-                response = await slack_client.conversations_history(channel=slack_channel_id, oldest=last_known_ts, limit=20)
-                messages = response.get("messages", [])
-                if messages:
-                    messages.reverse()
-                    for message in messages:
-                        user, text, ts = message.get("user"), message.get("text", ""), message.get("ts")
-                        if user and user != slack_bot_user_id and ts != last_known_ts:
-                            logging.info(f"<- Slack message received for '{client_info['client_name']}'. Forwarding to Discord...")
-                            discord_user_id = client_info["discord_user_id"]
-                            if message.get("files"):
-                                file_info = message["files"][0]
-                                file_url, filename = file_info.get("url_private_download"), file_info.get("name")
-                                await retry_async_request(send_discord_dm_with_file, 3, discord_user_id, text, file_url, filename)
-                            else:
-                                await retry_async_request(send_discord_dm, 3, discord_user_id, text)
-                    slack_channel_state[slack_channel_id] = messages[-1]['ts']
-             except Exception:
-                logging.error(f"An exception occurred while polling channel {slack_channel_id}:", exc_info=True)
-        await asyncio.sleep(2)
+        await asyncio.sleep(interval)
+        await sweep_slack_channels()
 
 def discum_wrapper():
     bot.gateway.run(auto_reconnect=True)
@@ -229,6 +874,4 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         logging.info("Discord bridge shutting down.")
     finally:
-        if bot.gateway.READY:
-            logging.info("Closing Discum gateway...")
-            bot.gateway.close()
\ No newline at end of file
+        shutdown()
\ No newline at end of file
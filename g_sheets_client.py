@@ -1,29 +1,128 @@
 # g_sheets_client.py
 import gspread
+import json
 import logging
+import os
+import threading
+import time
+from gspread.urls import DRIVE_FILES_API_V3_URL
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(funcName)s] - %(message)s')
 CREDENTIALS_FILE = 'credentials/service_account.json'
 SPREADSHEET_NAME = 'BitLink Client Mappings'
+BRIDGE_DATA_DIR = os.getenv("BRIDGE_DATA_DIR", "data")
+# Last-known-good copy of the sheet, so a bridge can start (and keep running) while Sheets is slow or down
+MAPPINGS_SNAPSHOT_FILE = os.getenv("MAPPINGS_SNAPSHOT_FILE", os.path.join(BRIDGE_DATA_DIR, "client_mappings.json"))
 
-def get_client_mappings(platform: str) -> list:
+class ClientMappingsStore:
+    """Client mappings from the Google Sheet, cached in memory and in a snapshot file.
+
+    The authenticated gspread client and spreadsheet handle are reused across reloads. refresh() first asks
+    Drive for the sheet's version/modifiedTime (a tiny request) and only downloads the rows when it changed;
+    the new rows are diffed against the old ones and the per-platform index is rebuilt once.
+    """
+
+    def __init__(self, snapshot_path=MAPPINGS_SNAPSHOT_FILE):
+        self.snapshot_path = snapshot_path
+        self.revision = None
+        self.loaded = False
+        self._records = {}  # (platform, external_id) -> row
+        self._by_platform = {}
+        self._lock = threading.Lock()
+        self._gc = None
+        self._spreadsheet = None
+        self._load_snapshot()
+
+    def _open(self):
+        if self._spreadsheet is None:
+            self._gc = gspread.service_account(filename=CREDENTIALS_FILE)
+            self._spreadsheet = self._gc.open(SPREADSHEET_NAME)
+        return self._spreadsheet
+
+    def _fetch_revision(self, spreadsheet):
+        response = self._gc.request("get", f"{DRIVE_FILES_API_V3_URL}/{spreadsheet.id}",
+                                    params={"fields": "version,modifiedTime", "supportsAllDrives": True})
+        metadata = response.json()
+        return f"{metadata.get('version')}:{metadata.get('modifiedTime')}"
+
+    def refresh(self, force=False):
+        """Reloads the sheet if it changed since the last load. Returns True if the mappings changed.
+        On any error the last-known-good mappings stay in place."""
+        with self._lock:
+            try:
+                spreadsheet = self._open()
+                revision = self._fetch_revision(spreadsheet)
+                if revision == self.revision and not force:
+                    logging.info(f"Client mappings unchanged (revision {revision}); skipping download.")
+                    return False
+                rows = spreadsheet.sheet1.get_all_records()
+            except Exception as e:
+                # Drop the handles so the next attempt re-authenticates, e.g. after a credentials or network problem
+                self._gc = self._spreadsheet = None
+                source = "the last snapshot" if self.loaded else "no mappings"
+                logging.error(f"Could not reload client mappings from Google Sheets, keeping {source}: {e}")
+                return False
+            changed = self._apply(rows, revision)
+        self._save_snapshot(rows)
+        return changed
+
+    def _apply(self, rows, revision):
+        records = {}
+        for row in rows:
+            row = dict(row, external_id=str(row.get('external_id', '')))
+            records[(str(row.get('platform', '')).lower(), row['external_id'])] = row
+        added = records.keys() - self._records.keys()
+        removed = self._records.keys() - records.keys()
+        changed = [key for key in records.keys() & self._records.keys() if records[key] != self._records[key]]
+        self.revision = revision
+        self.loaded = True
+        if not (added or removed or changed) and self._by_platform:
+            return False
+        by_platform = {}
+        for (platform, _), row in records.items():
+            by_platform.setdefault(platform, []).append(row)
+        self._records, self._by_platform = records, by_platform
+        logging.info(f"Client mappings updated: {len(added)} added, {len(removed)} removed, {len(changed)} changed ({len(records)} total).")
+        return True
+
+    def get(self, platform):
+        return [dict(row) for row in self._by_platform.get(platform.lower(), [])]
+
+    def _load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            self._apply(snapshot["rows"], snapshot.get("revision"))
+            logging.info(f"Loaded {len(self._records)} client mappings from snapshot {self.snapshot_path} (saved {time.ctime(snapshot.get('saved_at', 0))}).")
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Could not load client mappings snapshot {self.snapshot_path}: {e}")
+
+    def _save_snapshot(self, rows):
+        if not self.snapshot_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+            tmp_path = f"{self.snapshot_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"revision": self.revision, "saved_at": time.time(), "rows": rows}, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            logging.warning(f"Could not save client mappings snapshot: {e}")
+
+mappings_store = ClientMappingsStore()
+
+def get_client_mappings(platform: str, refresh: bool = True) -> list:
+    """Returns the clients for `platform`. With refresh=False the snapshot is used as-is when there is one
+    (instant startup); otherwise the sheet is checked for changes first."""
     logging.info(f"Contacting the records department (Google Sheets) for '{platform}' client list...")
-    try:
-        gc = gspread.service_account(filename=CREDENTIALS_FILE)
-        spreadsheet = gc.open(SPREADSHEET_NAME)
-        worksheet = spreadsheet.sheet1
-        all_clients = worksheet.get_all_records()
-        platform_clients = [
-            client for client in all_clients 
-            if client.get('platform', '').lower() == platform.lower()
-        ]
-        if not platform_clients:
-            logging.warning(f"No client files found for '{platform}' in the records.")
-            return []
-        logging.info(f"Successfully received {len(platform_clients)} client file(s) for {platform}.")
-        for client in platform_clients:
-            client['external_id'] = str(client['external_id'])
-        return platform_clients
-    except Exception as e:
-        logging.error(f"FATAL: A critical error occurred while accessing the records department: {e}")
-        return []
\ No newline at end of file
+    started = time.perf_counter()
+    if refresh or not mappings_store.loaded:
+        mappings_store.refresh()
+    platform_clients = mappings_store.get(platform)
+    if not platform_clients:
+        logging.warning(f"No client files found for '{platform}' in the records.")
+        return []
+    logging.info(f"Successfully received {len(platform_clients)} client file(s) for {platform} in {(time.perf_counter() - started) * 1000:.0f} ms.")
+    return platform_clients
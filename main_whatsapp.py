@@ -6,15 +6,32 @@ import os
 import sys
 import logging
 import base64
+import io
+import sqlite3
+import tempfile
 import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 from slack_sdk import WebClient
 from slack_sdk.socket_mode import SocketModeClient
 from slack_sdk.errors import SlackApiError
-from flask import Flask
-from collections import deque
+from flask import Flask, Response, jsonify, request
 
 from g_sheets_client import get_client_mappings
+from chat_dispatcher import ChatDispatcher
+from outbox import Outbox
+from dedupe_store import DedupeStore
+from message_index import MessageIndex, file_share_ts
+from rate_limiter import RateLimitedWebClient, background_calls, rate_limiter
+from sharding import shard_map
+from media_cache import media_cache
+from coalescing import BurstBuffer, coalesce_window, render_burst
+from slack_markup import SLACK_NAME_REFRESH_INTERVAL, slack_names
+from slack_cursors import BackfillProgress, SlackCursors
+from metrics import (API_CALL_DURATION, API_CALL_ERRORS, COALESCED_MESSAGES, CONFIG_RELOAD_DURATION, CONTENT_TYPE, DELIVERIES_IN_FLIGHT,
+                     FORWARD_FAILURES, SHARD_HANDOFFS, record_delivery, register_outbox, registry)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(name)s] - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
 
@@ -23,33 +40,127 @@ SLACK_APP_TOKEN = os.getenv("SLACK_APP_TOKEN")
 SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN")
 NODE_API_URL = os.getenv("NODE_API_URL", "http://localhost:3000")
 WHATSAPP_REFRESH_PORT = os.getenv("WHATSAPP_REFRESH_PORT", 8001)
+# "longpoll" = hold /poll-messages open until messages arrive and ack each batch, "poll" = legacy 1s /get-messages polling
+WHATSAPP_TRANSPORT = os.getenv("WHATSAPP_TRANSPORT", "longpoll").lower()
+WHATSAPP_LONG_POLL_TIMEOUT = float(os.getenv("WHATSAPP_LONG_POLL_TIMEOUT", 25))
+# WhatsApp -> Slack delivery: WHATSAPP_FORWARD_WORKERS chats at a time, each chat's messages in order on its own
+# lane across polls. A message that finds its lane full is left to the outbox relay.
+WHATSAPP_FORWARD_WORKERS = int(os.getenv("WHATSAPP_FORWARD_WORKERS", 8))
+WHATSAPP_TO_SLACK_LANE_DEPTH = int(os.getenv("WHATSAPP_TO_SLACK_LANE_DEPTH", 1000))
+WHATSAPP_TO_SLACK_MAX_QUEUED = int(os.getenv("WHATSAPP_TO_SLACK_MAX_QUEUED", 20000))
+# Slack -> WhatsApp delivery: fixed worker pool, one FIFO lane per WhatsApp chat, bounded queues
+SLACK_TO_WHATSAPP_WORKERS = int(os.getenv("SLACK_TO_WHATSAPP_WORKERS", 8))
+SLACK_TO_WHATSAPP_LANE_DEPTH = int(os.getenv("SLACK_TO_WHATSAPP_LANE_DEPTH", 100))
+SLACK_TO_WHATSAPP_MAX_QUEUED = int(os.getenv("SLACK_TO_WHATSAPP_MAX_QUEUED", 5000))
+SLACK_TO_WHATSAPP_BACKPRESSURE = os.getenv("SLACK_TO_WHATSAPP_BACKPRESSURE", "block")
+BRIDGE_DATA_DIR = os.getenv("BRIDGE_DATA_DIR", "data")
+WHATSAPP_OUTBOX_DB = os.getenv("WHATSAPP_OUTBOX_DB", os.path.join(BRIDGE_DATA_DIR, "whatsapp_outbox.db"))
+OUTBOX_RETRY_INTERVAL = float(os.getenv("OUTBOX_RETRY_INTERVAL", 1))
+# Already-forwarded event IDs are remembered for this long, so late redeliveries and restarts don't double-post
+DEDUPE_WINDOW = float(os.getenv("DEDUPE_WINDOW", 24 * 3600))
+DEDUPE_MAX_ENTRIES = int(os.getenv("DEDUPE_MAX_ENTRIES", 1_000_000))
+SLACK_SEEN_FILE = os.getenv("SLACK_SEEN_FILE", os.path.join(BRIDGE_DATA_DIR, "slack_events_seen.json"))
+WHATSAPP_SEEN_FILE = os.getenv("WHATSAPP_SEEN_FILE", os.path.join(BRIDGE_DATA_DIR, "whatsapp_events_seen.json"))
+# Slack ts <-> WhatsApp message ID links, kept for edits/deletes for MESSAGE_INDEX_TTL seconds
+WHATSAPP_MESSAGE_INDEX_DB = os.getenv("WHATSAPP_MESSAGE_INDEX_DB", os.path.join(BRIDGE_DATA_DIR, "whatsapp_message_index.db"))
+MESSAGE_INDEX_TTL = float(os.getenv("MESSAGE_INDEX_TTL", 30 * 24 * 3600))
+MESSAGE_INDEX_MAX_ENTRIES = int(os.getenv("MESSAGE_INDEX_MAX_ENTRIES", 500_000))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 32))
+# (connect, read) timeouts for calls to the Node service and Slack file downloads
+HTTP_TIMEOUT = (float(os.getenv("HTTP_CONNECT_TIMEOUT", 5)), float(os.getenv("HTTP_READ_TIMEOUT", 60)))
+# Files of one Slack message downloaded at the same time
+RELAY_FILE_CONCURRENCY = int(os.getenv("RELAY_FILE_CONCURRENCY", 10))
+MEDIA_CHUNK_SIZE = 64 * 1024
+# Sweeps of the mapped Slack channels pick up what Socket Mode missed; after a restart they catch up from the
+# saved cursors, SLACK_BACKFILL_CONCURRENCY channels at a time
+SLACK_RECONCILE_INTERVAL = float(os.getenv("SLACK_RECONCILE_INTERVAL", 300))
+SLACK_SWEEP_PAGE_SIZE = int(os.getenv("SLACK_SWEEP_PAGE_SIZE", 200))
+SLACK_BACKFILL_CONCURRENCY = int(os.getenv("SLACK_BACKFILL_CONCURRENCY", 4))
+WHATSAPP_SLACK_CURSORS_FILE = os.getenv("WHATSAPP_SLACK_CURSORS_FILE", os.path.join(BRIDGE_DATA_DIR, "whatsapp_slack_cursors.json"))
 
 config_lock = threading.Lock()
 stop_event = threading.Event()
-active_threads = []
-processed_slack_events = deque(maxlen=500)
-processed_whatsapp_events = deque(maxlen=500)
+processed_slack_events = DedupeStore(window=DEDUPE_WINDOW, max_entries=DEDUPE_MAX_ENTRIES, path=SLACK_SEEN_FILE)
+processed_whatsapp_events = DedupeStore(window=DEDUPE_WINDOW, max_entries=DEDUPE_MAX_ENTRIES, path=WHATSAPP_SEEN_FILE)
 whatsapp_to_slack_map = {}
 slack_to_whatsapp_map = {}
+# Per channel: ts of the newest message a sweep handed on
+slack_cursors = SlackCursors(WHATSAPP_SLACK_CURSORS_FILE, seen=processed_slack_events)
+slack_backfill = BackfillProgress()
+message_index = MessageIndex(WHATSAPP_MESSAGE_INDEX_DB, ttl=MESSAGE_INDEX_TTL, max_entries=MESSAGE_INDEX_MAX_ENTRIES)
 
-# ⭐ ONLY NEW ADDITION: Simple message mapping for deletion
-slack_to_whatsapp_msg_map = {}
+# One keep-alive connection pool shared by every thread instead of a new TCP connection per request
+http_session = requests.Session()
+http_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE))
+http_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE))
+# Durable record of every message between receipt and delivery; opened in main()
+outbox = None
+# Set in start(); used for messages other shards hand over
+slack_web_client = None
+# Short text messages of clients with a coalescing window, waiting to be posted together; a chat's lock keeps
+# its burst in order with the chat's other messages
+whatsapp_bursts = BurstBuffer()
+burst_locks = defaultdict(threading.Lock)
+slack_to_whatsapp_dispatcher = ChatDispatcher(
+    workers=SLACK_TO_WHATSAPP_WORKERS, max_lane_depth=SLACK_TO_WHATSAPP_LANE_DEPTH,
+    max_queued=SLACK_TO_WHATSAPP_MAX_QUEUED, policy=SLACK_TO_WHATSAPP_BACKPRESSURE, name="slack-to-whatsapp",
+)
+# Never blocks the poller: everything it submits is already in the outbox
+whatsapp_to_slack_dispatcher = ChatDispatcher(
+    workers=WHATSAPP_FORWARD_WORKERS, max_lane_depth=WHATSAPP_TO_SLACK_LANE_DEPTH,
+    max_queued=WHATSAPP_TO_SLACK_MAX_QUEUED, policy="reject", name="whatsapp-to-slack",
+)
 
-def reload_config():
+# Read at scrape time from state the bridge already keeps
+register_outbox(lambda: outbox)
+registry.callback("bridge_coalescing_messages", "Messages waiting in a burst to be posted together.", lambda: len(whatsapp_bursts))
+registry.callback("bridge_dispatcher_jobs", "Slack -> WhatsApp jobs by state (queued, active) and lanes with work.",
+                  lambda: {(key,): value for key, value in slack_to_whatsapp_dispatcher.stats().items() if key in ("queued", "active", "lanes", "deepest_lane")},
+                  ("state",))
+registry.callback("bridge_whatsapp_forward_jobs", "WhatsApp -> Slack jobs by state (queued, active) and lanes with work.",
+                  lambda: {(key,): value for key, value in whatsapp_to_slack_dispatcher.stats().items() if key in ("queued", "active", "lanes", "deepest_lane")},
+                  ("state",))
+WHATSAPP_BATCH_SIZE = registry.gauge("bridge_whatsapp_last_batch_size", "Messages in the last batch taken from the WhatsApp service.")
+
+def apply_mapping_diff(current, new):
+    """Updates `current` in place to match `new`, touching only keys that were added, removed or changed."""
+    for key in current.keys() - new.keys():
+        del current[key]
+    for key, item in new.items():
+        if current.get(key) != item:
+            current[key] = item
+
+def reload_config(refresh=True):
     """Fetches the latest mappings from Google Sheets and safely updates the global maps."""
-    global whatsapp_to_slack_map, slack_to_whatsapp_map
+    with CONFIG_RELOAD_DURATION.labels("whatsapp").time():
+        return _reload_config(refresh)
+
+def _reload_config(refresh):
     logging.info("(WhatsApp Bridge) Refresh signal received! Reloading config...")
-    client_mappings_raw = get_client_mappings("WhatsApp")
+    client_mappings_raw = get_client_mappings("WhatsApp", refresh=refresh)
     if client_mappings_raw:
-        new_mappings = [{"client_name": c.get("client_name"), "whatsapp_chat_id": c.get("external_id"), "slack_channel_id": c.get("slack_channel_id")} for c in client_mappings_raw]
+        # Under bridge_supervisor.py each worker keeps only its share of the clients
+        client_mappings_raw = shard_map.assign(client_mappings_raw, "whatsapp")
+        new_mappings = [{"client_name": c.get("client_name"), "whatsapp_chat_id": c.get("external_id"), "slack_channel_id": c.get("slack_channel_id"),
+                         "coalesce_window": coalesce_window(c)} for c in client_mappings_raw]
         with config_lock:
-            whatsapp_to_slack_map.clear()
-            slack_to_whatsapp_map.clear()
-            whatsapp_to_slack_map.update({item["whatsapp_chat_id"]: item for item in new_mappings if item.get("whatsapp_chat_id")})
-            slack_to_whatsapp_map.update({item["slack_channel_id"]: item for item in new_mappings if item.get("slack_channel_id")})
+            apply_mapping_diff(whatsapp_to_slack_map, {item["whatsapp_chat_id"]: item for item in new_mappings if item.get("whatsapp_chat_id")})
+            apply_mapping_diff(slack_to_whatsapp_map, {item["slack_channel_id"]: item for item in new_mappings if item.get("slack_channel_id")})
+            slack_cursors.retain(slack_to_whatsapp_map)
         logging.info(f"Configuration reloaded. Now tracking {len(whatsapp_to_slack_map)} clients.")
     return "Configuration reloaded.", 200
 
+def scrape_whatsapp_service_metrics():
+    """The Node service's queue depth and counters, so one scrape of the bridge covers both processes."""
+    try:
+        response = http_session.get(f"{NODE_API_URL}/metrics", timeout=2)
+        response.raise_for_status()
+        up, text = 1, response.text
+    except requests.exceptions.RequestException:
+        up, text = 0, ""
+    return (f"# HELP bridge_whatsapp_service_up 1 if the WhatsApp service answered the metrics scrape.\n"
+            f"# TYPE bridge_whatsapp_service_up gauge\nbridge_whatsapp_service_up {up}\n{text}")
+
 def run_refresh_server():
     """Runs a simple Flask server to listen for the /refresh webhook."""
     app = Flask(__name__)
@@ -58,23 +169,79 @@ def run_refresh_server():
 
     @app.route('/refresh', methods=['POST'])
     def refresh_endpoint():
+        # The supervisor sends the new shard topology along; the reload then picks up this worker's new share
+        topology = request.get_json(silent=True) or {}
+        if "shard_count" in topology:
+            shard_map.update(topology["shard_count"], topology.get("peers", []))
+        if topology.get("wait"):
+            reload_config()  # a shrink hands over the retired workers' messages once everyone has their new share
+            return "Configuration reloaded.", 200
         threading.Thread(target=reload_config).start()
         return "Refresh signal received.", 200
+
+    @app.route('/shard-handoff', methods=['POST'])
+    def shard_handoff_endpoint():
+        handoff = request.get_json()
+        if handoff["kind"] == "slack_event":
+            handle_slack_event(handoff["payload"], SLACK_BOT_TOKEN)
+        elif handoff["kind"] == "whatsapp_messages":
+            accept_whatsapp_messages(handoff["payload"])
+        else:
+            return "Unknown hand-off kind.", 400
+        return "OK", 200
+
+    @app.route('/stats', methods=['GET'])
+    def stats_endpoint():
+        return jsonify(bridge_stats())
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        return Response(registry.render() + scrape_whatsapp_service_metrics(), headers={"Content-Type": CONTENT_TYPE})
     
     logging.info(f"WhatsApp refresh server listening on port {WHATSAPP_REFRESH_PORT}")
     app.run(port=int(WHATSAPP_REFRESH_PORT))
 
+def start(web_client):
+    """Loads the mappings, opens the outbox and starts the worker threads. bridge_runtime.py calls this too,
+    with its own Slack connection and endpoints."""
+    global outbox, slack_web_client
+    # Start from the last snapshot right away; the sheet itself is checked in the background.
+    started = time.perf_counter()
+    reload_config(refresh=False)
+    logging.info(f"Client mappings ready after {(time.perf_counter() - started) * 1000:.0f} ms.")
+    threading.Thread(target=reload_config, daemon=True).start()
+    outbox = Outbox(WHATSAPP_OUTBOX_DB)
+    slack_web_client = web_client
+    threading.Thread(target=poll_whatsapp_and_forward, args=(web_client,), daemon=True).start()
+    threading.Thread(target=run_outbox_relay, args=(web_client,), daemon=True).start()
+    threading.Thread(target=run_burst_flusher, args=(web_client,), daemon=True).start()
+    threading.Thread(target=run_slack_names_refresh, args=(web_client,), daemon=True).start()
+    threading.Thread(target=run_slack_reconciler, args=(web_client,), daemon=True).start()
+
+def shutdown():
+    logging.info("Shutdown signal received. Waiting for queued Slack messages to be delivered...")
+    stop_event.set()
+    slack_to_whatsapp_dispatcher.shutdown(timeout=30)
+    whatsapp_to_slack_dispatcher.shutdown(timeout=30)
+    if outbox:
+        outbox.close()
+    processed_slack_events.close()
+    processed_whatsapp_events.close()
+    slack_cursors.close()
+    message_index.close()
+    logging.info("All processing threads have finished. Bridge shut down.")
+
+def bridge_stats():
+    return {"slack_to_whatsapp": slack_to_whatsapp_dispatcher.stats(), "whatsapp_to_slack": whatsapp_to_slack_dispatcher.stats(), "rate_limits": rate_limiter.stats(), "shard": shard_map.stats(),
+            "media_cache": media_cache.stats(), "slack_names": slack_names.stats(),
+            "slack_backfill": slack_backfill.stats()}
+
 def main():
-    reload_config() 
-    web_client = WebClient(token=SLACK_BOT_TOKEN)
+    # Paces every Slack call per method/channel and waits out 429s instead of dropping the message
+    web_client = RateLimitedWebClient(token=SLACK_BOT_TOKEN)
+    start(web_client)
+    threading.Thread(target=run_refresh_server, daemon=True).start()
     socket_client = SocketModeClient(app_token=SLACK_APP_TOKEN, web_client=web_client)
-    whatsapp_poller_thread = threading.Thread(target=poll_whatsapp_and_forward, args=(web_client,))
-    whatsapp_poller_thread.daemon = True
-    whatsapp_poller_thread.start()
-    refresh_server_thread = threading.Thread(target=run_refresh_server)
-    refresh_server_thread.daemon = True
-    refresh_server_thread.start()
-    
     socket_client.socket_mode_request_listeners.append(
         lambda client, req: handle_slack_message(client, req, web_client)
     )
@@ -86,9 +253,99 @@ def main():
         time.sleep(1)
 
 # --- Helper functions (YOUR ORIGINAL + MINIMAL ADDITIONS) ---
+def gateway_request(method, endpoint, route=None, **kwargs):
+    """Calls the Node WhatsApp service, recording latency and errors per endpoint (or `route`, for paths with IDs)."""
+    route = route or endpoint
+    started = time.perf_counter()
+    try:
+        response = http_session.request(method, f"{NODE_API_URL}{endpoint}", timeout=HTTP_TIMEOUT, **kwargs)
+    except requests.exceptions.RequestException:
+        API_CALL_ERRORS.labels("whatsapp_gateway", route).inc()
+        raise
+    finally:
+        API_CALL_DURATION.labels("whatsapp_gateway", route).observe(time.perf_counter() - started)
+    if response.status_code >= 400:
+        API_CALL_ERRORS.labels("whatsapp_gateway", route).inc()
+    return response
+
+def open_whatsapp_media(media):
+    """A received file as a binary file object, streamed from the Node service into a temp file. None if there's
+    no file or the service no longer has it; connection errors propagate so the message is retried."""
+    if not media:
+        return None
+    if media.get('data'):
+        # Queued inline by a service from before media references (or left in the outbox by one)
+        return io.BytesIO(base64.b64decode(media['data']))
+    if not media.get('mediaId'):
+        return None
+    f = tempfile.TemporaryFile()
+    try:
+        with gateway_request("GET", f"/media/{media['mediaId']}", route="/media", stream=True) as response:
+            if response.status_code == 404:
+                f.close()
+                return None
+            response.raise_for_status()
+            for chunk in response.iter_content(MEDIA_CHUNK_SIZE):
+                f.write(chunk)
+        f.seek(0)
+        return f
+    except BaseException:
+        f.close()
+        raise
+
+def release_whatsapp_media(media):
+    """Lets the Node service delete a received file once it's on Slack; it expires there on its own otherwise."""
+    if not (media and media.get('mediaId')):
+        return
+    try:
+        gateway_request("DELETE", f"/media/{media['mediaId']}", route="/media")
+    except requests.exceptions.RequestException as e:
+        logging.warning(f"Could not release WhatsApp media {media['mediaId']}: {e}")
+
+def upload_whatsapp_media(f, mimetype, filename):
+    """Streams an open binary file to the Node service for /send-message. Returns its media reference, or None."""
+    response = gateway_request("POST", "/media", params={"mimetype": mimetype or "application/octet-stream", "filename": filename or "file.bin"},
+                               data=f, headers={"Content-Type": "application/octet-stream"})
+    if response.status_code >= 500:
+        response.raise_for_status()  # retried with the message
+    if response.status_code != 200:
+        logging.error(f"WhatsApp service did not accept file '{filename}' (status {response.status_code})")
+        return None
+    return response.json()
+
+def hand_off(owner_url, kind, payload):
+    """Gives events for another shard's clients to the worker that owns them. Returns False if it couldn't be reached."""
+    try:
+        response = http_session.post(f"{owner_url}/shard-handoff", json={"kind": kind, "payload": payload}, timeout=HTTP_TIMEOUT)
+        handed_off = response.status_code == 200
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Could not hand {kind} over to {owner_url}: {e}")
+        handed_off = False
+    SHARD_HANDOFFS.labels(kind, "ok" if handed_off else "failed").inc()
+    return handed_off
+
+def hand_off_whatsapp_messages(messages):
+    """Hands the messages of chats other workers own over to them. Returns (our messages, whether every hand-off succeeded)."""
+    ours, theirs = [], {}
+    for msg in messages:
+        owner = shard_map.owner_of(msg.get('chatId'))
+        if owner:
+            theirs.setdefault(owner, []).append(msg)
+        else:
+            ours.append(msg)
+    handed_off = [hand_off(owner, "whatsapp_messages", batch) for owner, batch in theirs.items()]
+    return ours, all(handed_off)
+
+def accept_whatsapp_messages(messages):
+    """Takes over messages another worker polled for our chats: persisted before answering, then forwarded."""
+    with config_lock:
+        current_clients = dict(whatsapp_to_slack_map)
+    outbox_ids = outbox.enqueue_many("whatsapp_to_slack", [(msg, msg.get('chatId')) for msg in messages]) if outbox else None
+    forward_whatsapp_batch(slack_web_client, messages, current_clients, outbox_ids)
+
 def get_whatsapp_messages():
     try:
-        response = requests.get(f"{NODE_API_URL}/get-messages")
+        response = gateway_request("GET", "/get-messages")
         if response.status_code == 200: return response.json()
     except requests.exceptions.RequestException as e:
         logging.error(f"Error connecting to WhatsApp service: {e}")
@@ -98,7 +355,7 @@ def get_whatsapp_messages():
 def send_whatsapp_message(chat_id, message, media=None):
     try:
         payload = {"chatId": chat_id, "message": message, "media": media}
-        response = requests.post(f"{NODE_API_URL}/send-message", json=payload)
+        response = gateway_request("POST", "/send-message", json=payload)
         if response.status_code == 200:
             return response.json()  # Return full response to get messageId
         return None
@@ -110,59 +367,372 @@ def send_whatsapp_message(chat_id, message, media=None):
 def delete_whatsapp_message(message_id):
     try:
         payload = {"messageId": message_id}
-        response = requests.post(f"{NODE_API_URL}/delete-message", json=payload)
+        response = gateway_request("POST", "/delete-message", json=payload)
         return response.status_code == 200
     except requests.exceptions.RequestException as e:
         logging.error(f"Error deleting WhatsApp message: {e}")
     return False
 
+def edit_whatsapp_message(message_id, text):
+    try:
+        payload = {"messageId": message_id, "message": slack_names.resolve(slack_web_client, text)}
+        response = gateway_request("POST", "/edit-message", json=payload)
+        return response.status_code == 200
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Error editing WhatsApp message: {e}")
+    return False
+
+def delete_whatsapp_copy(slack_channel, slack_ts, whatsapp_msg_id):
+    """Deletes the WhatsApp copy of a deleted Slack message; the link is kept if that fails."""
+    if delete_whatsapp_message(whatsapp_msg_id):
+        message_index.forget("whatsapp", slack_channel, slack_ts)
+    else:
+        logging.error(f"Failed to delete WhatsApp message {whatsapp_msg_id}")
+
+def long_poll_whatsapp_messages():
+    """Waits up to WHATSAPP_LONG_POLL_TIMEOUT for new messages. Returns (batch_id, messages); connection errors propagate."""
+    response = http_session.get(f"{NODE_API_URL}/poll-messages", params={"timeout": int(WHATSAPP_LONG_POLL_TIMEOUT * 1000)}, timeout=WHATSAPP_LONG_POLL_TIMEOUT + 10)
+    response.raise_for_status()
+    data = response.json()
+    return data.get("batchId"), data.get("messages", [])
+
+def ack_whatsapp_batch(batch_id):
+    try:
+        response = gateway_request("POST", "/ack-messages", json={"batchId": batch_id})
+        if response.status_code != 200:
+            logging.warning(f"WhatsApp service did not accept ack for batch {batch_id} (status {response.status_code}); it may be re-delivered.")
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Error acknowledging WhatsApp batch {batch_id}: {e}")
+
+def sync_whatsapp_change_to_slack(web_client: WebClient, msg, current_clients):
+    """Mirrors a client's WhatsApp edit or delete onto the Slack message it was forwarded as. Returns False to retry."""
+    linked = message_index.slack_for("whatsapp", msg.get("messageId"))
+    client_info = current_clients.get(msg.get("chatId"))
+    if not linked or not client_info: return True
+    slack_channel, slack_ts = linked
+    # A message that went out in a merged post only changes its own line of it
+    burst = message_index.update_burst("whatsapp", msg.get("messageId"), None if msg["kind"] == "delete" else whatsapp_body(msg))
+    try:
+        if burst and burst[2]:
+            web_client.chat_update(channel=slack_channel, ts=slack_ts, text=render_burst(client_info['client_name'], burst[2]))
+        elif msg["kind"] == "delete":
+            web_client.chat_delete(channel=slack_channel, ts=slack_ts)
+            message_index.forget("whatsapp", slack_channel, slack_ts)
+        else:
+            web_client.chat_update(channel=slack_channel, ts=slack_ts, text=f"*{client_info['client_name']}:*\n{msg.get('body', '')}")
+        logging.info(f"Synced WhatsApp {msg['kind']} from '{client_info['client_name']}' to Slack")
+    except SlackApiError as e:
+        if e.response["error"] == "message_not_found":
+            message_index.forget("whatsapp", slack_channel, slack_ts)
+            return True
+        logging.error(f"Slack API error syncing WhatsApp {msg['kind']} from '{client_info['client_name']}': {e.response['error']}")
+        return False
+    return True
+
+def forward_whatsapp_message(web_client: WebClient, msg, current_clients):
+    """Posts one WhatsApp message to Slack. Returns False only if it should be retried later."""
+    chat_id, ts = msg.get('chatId'), msg.get('timestamp')
+    if not ts or not chat_id: return True
+    if msg.get('kind') in ("edit", "delete"):
+        return sync_whatsapp_change_to_slack(web_client, msg, current_clients)
+    event_id = (chat_id, ts)
+    if event_id not in processed_whatsapp_events and chat_id in current_clients:
+        client_info = current_clients[chat_id]
+        slack_channel, client_name = client_info["slack_channel_id"], client_info["client_name"]
+        content = msg.get('body', '')
+        quoted_body = msg.get('quotedBody')
+        final_text = ""
+        if quoted_body:
+            final_text += f"> {quoted_body}\n"
+        final_text += f"*{client_name}:*\n{content}"
+        try:
+            size = len(final_text.encode())
+            media_file = open_whatsapp_media(msg.get('media'))
+            if msg.get('media') and media_file is None:
+                logging.warning(f"WhatsApp media from '{client_name}' is no longer available; forwarding the text only")
+            if media_file:
+                with media_file:
+                    size += media_file.seek(0, io.SEEK_END)
+                    media_file.seek(0)
+                    response = web_client.files_upload_v2(channel=slack_channel, file=media_file, filename=msg['media'].get('filename', 'file.bin'), initial_comment=final_text)
+                release_whatsapp_media(msg['media'])
+                slack_ts = posted_file_ts(web_client, response.get("files"), slack_channel)
+            else:
+                slack_ts = web_client.chat_postMessage(channel=slack_channel, text=final_text).get("ts")
+            message_index.link("whatsapp", slack_channel, slack_ts, msg.get("messageId"), chat_id, origin="whatsapp")
+            processed_whatsapp_events.add(event_id)
+            record_delivery("whatsapp_to_slack", ts, size)
+            logging.info(f"Forwarded WhatsApp message from '{client_name}' to Slack")
+        except SlackApiError as e:
+            FORWARD_FAILURES.labels("whatsapp_to_slack").inc()
+            logging.error(f"Slack API error forwarding from '{client_name}': {e.response['error']}")
+            return False
+    return True
+
+def posted_file_ts(web_client: WebClient, files, channel):
+    """The ts of the Slack message that shared just-uploaded `files`, asking files.info if the upload's response
+    didn't have it yet. None if Slack still hasn't reported it; the post then just isn't linked."""
+    slack_ts = file_share_ts(files, channel)
+    if slack_ts or not files:
+        return slack_ts
+    try:
+        return file_share_ts([web_client.files_info(file=files[0]["id"]).get("file") or {}], channel)
+    except SlackApiError as e:
+        logging.warning(f"Could not look up the Slack post of file {files[0]['id']}: {e.response.get('error')}")
+        return None
+
+def whatsapp_body(msg):
+    """A message's line in a merged post."""
+    quoted_body = msg.get('quotedBody')
+    return (f"> {quoted_body}\n" if quoted_body else "") + msg.get('body', '')
+
+def is_coalescible(msg, client_info):
+    return bool(client_info and client_info.get("coalesce_window")) and not msg.get('kind') and not msg.get('media')
+
+def post_whatsapp_burst(web_client: WebClient, burst):
+    """Posts a burst of a client's messages as one Slack message, linking it to each of them. Call with the chat's burst lock held."""
+    client_info = burst.context
+    try:
+        response = web_client.chat_postMessage(channel=client_info["slack_channel_id"], text=render_burst(client_info["client_name"], [body for _, body in burst.parts]))
+        delivered = True
+    except SlackApiError as e:
+        FORWARD_FAILURES.labels("whatsapp_to_slack").inc(len(burst.items))
+        logging.error(f"Slack API error forwarding {len(burst.items)} message(s) from '{client_info['client_name']}': {e.response['error']}")
+        delivered = False
+    except Exception:
+        FORWARD_FAILURES.labels("whatsapp_to_slack").inc(len(burst.items))
+        logging.error(f"Failed to forward {len(burst.items)} message(s) from '{client_info['client_name']}':", exc_info=True)
+        delivered = False
+    if delivered:
+        try:
+            message_index.link_burst("whatsapp", client_info["slack_channel_id"], response.get("ts"), burst.parts, burst.key)
+        except Exception as e:
+            # Posted all the same; only later edits and deletes of these messages won't reach Slack
+            logging.error(f"Could not link merged Slack post {response.get('ts')} to its WhatsApp messages: {e}")
+        for (_, msg), (_, body) in zip(burst.items, burst.parts):
+            processed_whatsapp_events.add((msg.get('chatId'), msg.get('timestamp')))
+            record_delivery("whatsapp_to_slack", msg.get('timestamp'), len(body.encode()))
+        COALESCED_MESSAGES.labels("whatsapp_to_slack").inc(len(burst.items) - 1)
+        logging.info(f"Forwarded {len(burst.items)} WhatsApp message(s) from '{client_info['client_name']}' to Slack as one post")
+    for msg_id, _ in burst.items:
+        settle_outbox(msg_id, delivered)
+
+def flush_whatsapp_burst(web_client: WebClient, chat_id):
+    burst = whatsapp_bursts.take(chat_id)
+    if not burst:
+        return
+    try:
+        post_whatsapp_burst(web_client, burst)
+    except Exception:
+        # take() already removed the burst: hand its messages to the outbox relay rather than lose them
+        logging.error(f"Unhandled exception posting a burst of {len(burst.items)} WhatsApp message(s):", exc_info=True)
+        for msg_id, _ in burst.items:
+            settle_outbox(msg_id, False)
+
+def run_burst_flusher(web_client: WebClient):
+    """Posts bursts whose coalescing window has passed."""
+    while not stop_event.wait(0.1):
+        for chat_id in whatsapp_bursts.due():
+            try:
+                with burst_locks[chat_id]:
+                    flush_whatsapp_burst(web_client, chat_id)
+            except Exception:
+                logging.error(f"Unhandled exception flushing WhatsApp burst of chat {chat_id}:", exc_info=True)
+
+def defer_if_blocked(msg_id):
+    """Leaves a message to the outbox relay while an earlier message of its chat waits for a retry, keeping the chat in order."""
+    if outbox is None or msg_id is None or not outbox.is_blocked(msg_id): return False
+    outbox.defer(msg_id)
+    return True
+
+def settle_outbox(msg_id, delivered, error="delivery failed"):
+    """Removes a delivered message from the outbox, or schedules its retry."""
+    if outbox is None or msg_id is None: return
+    if delivered:
+        outbox.complete(msg_id)
+    else:
+        outbox.fail(msg_id, error)
+
+def record_outbox_progress(msg_id, payload):
+    """Saves how far a message sent in several parts got, so its retry only sends the rest."""
+    if outbox is None or msg_id is None: return
+    try:
+        outbox.update(msg_id, payload)
+    except sqlite3.Error as e:
+        logging.warning(f"Could not record the progress of outbox message {msg_id}: {e}. Its retry may repeat parts of it.")
+
+def forward_whatsapp_chat_message(web_client: WebClient, msg_id, msg, current_clients):
+    """One message's turn on its chat's lane."""
+    chat_id = msg.get('chatId')
+    try:
+        with burst_locks[chat_id]:
+            if defer_if_blocked(msg_id):
+                return
+            client_info = current_clients.get(chat_id)
+            try:
+                if is_coalescible(msg, client_info) and (chat_id, msg.get('timestamp')) not in processed_whatsapp_events:
+                    # Settled when its burst is posted
+                    full = whatsapp_bursts.add(chat_id, client_info["coalesce_window"], msg.get("messageId"), whatsapp_body(msg), (msg_id, msg), client_info)
+                    if full:
+                        post_whatsapp_burst(web_client, full)
+                    return
+                # Anything else of the chat's (media, edits, deletes) goes out after the burst before it
+                flush_whatsapp_burst(web_client, chat_id)
+                delivered = forward_whatsapp_message(web_client, msg, current_clients)
+            except Exception as e:
+                logging.error(f"Unhandled exception forwarding WhatsApp message: {e}", exc_info=True)
+                FORWARD_FAILURES.labels("whatsapp_to_slack").inc()
+                delivered = False
+            settle_outbox(msg_id, delivered)
+    finally:
+        DELIVERIES_IN_FLIGHT.labels("whatsapp_to_slack").inc(-1)
+
+def forward_whatsapp_batch(web_client: WebClient, messages, current_clients, outbox_ids=None):
+    """Queues each message on its chat's lane and returns: chats run in parallel, each chat's messages stay in order,
+    and a slow chat only holds up its own later messages."""
+    in_flight = DELIVERIES_IN_FLIGHT.labels("whatsapp_to_slack")
+    for msg, msg_id in zip(messages, outbox_ids or [None] * len(messages)):
+        in_flight.inc()
+        if not whatsapp_to_slack_dispatcher.submit(msg.get('chatId'), forward_whatsapp_chat_message, web_client, msg_id, msg, current_clients):
+            in_flight.inc(-1)
+            FORWARD_FAILURES.labels("whatsapp_to_slack").inc()
+            settle_outbox(msg_id, False, "forwarding lanes full")
+
 def poll_whatsapp_and_forward(web_client: WebClient):
-    logging.info("WhatsApp polling worker has started.")
+    logging.info(f"WhatsApp polling worker has started ({WHATSAPP_TRANSPORT} transport).")
+    backoff = 1
     while not stop_event.is_set():
+        batch_id = None
+        if WHATSAPP_TRANSPORT == "longpoll":
+            try:
+                batch_id, new_messages = long_poll_whatsapp_messages()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logging.error(f"Error connecting to WhatsApp service: {e}. Reconnecting in {backoff}s...")
+                stop_event.wait(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+        else:
+            new_messages = get_whatsapp_messages()
+        WHATSAPP_BATCH_SIZE.labels().set(len(new_messages))
+        # Every worker polls the one WhatsApp service queue; other shards' chats go to their owners
+        new_messages, handed_off = hand_off_whatsapp_messages(new_messages) if shard_map.sharded else (new_messages, True)
         with config_lock:
             current_clients = dict(whatsapp_to_slack_map)
-        new_messages = get_whatsapp_messages()
-        for msg in new_messages:
-            chat_id, ts = msg.get('chatId'), msg.get('timestamp')
-            if not ts or not chat_id: continue
-            event_id = (chat_id, ts)
-            if event_id not in processed_whatsapp_events and chat_id in current_clients:
-                processed_whatsapp_events.append(event_id)
-                client_info = current_clients[chat_id]
-                slack_channel, client_name = client_info["slack_channel_id"], client_info["client_name"]
-                content = msg.get('body', '')
-                quoted_body = msg.get('quotedBody')
-                final_text = ""
-                if quoted_body:
-                    final_text += f"> {quoted_body}\n"
-                final_text += f"*{client_name}:*\n{content}"
-                try:
-                    if msg.get('media') and msg['media'].get('data'):
-                        file_content = base64.b64decode(msg['media']['data'])
-                        web_client.files_upload_v2(channel=slack_channel, content=file_content, filename=msg['media'].get('filename', 'file.bin'), initial_comment=final_text)
-                    else:
-                        web_client.chat_postMessage(channel=slack_channel, text=final_text)
-                    logging.info(f"Forwarded WhatsApp message from '{client_name}' to Slack")
-                except SlackApiError as e:
-                    logging.error(f"Slack API error forwarding from '{client_name}': {e.response['error']}")
-        time.sleep(1)
+        # Persist the batch before acking it: from here on the outbox, not the Node queue, owns redelivery.
+        try:
+            outbox_ids = outbox.enqueue_many("whatsapp_to_slack", [(msg, msg.get('chatId')) for msg in new_messages]) if outbox else None
+        except sqlite3.Error as e:
+            if WHATSAPP_TRANSPORT != "longpoll":
+                # /get-messages can't redeliver: forward what we have without the outbox's retries
+                logging.error(f"Could not persist {len(new_messages)} WhatsApp message(s) to the outbox: {e}. Forwarding them without retries.")
+                forward_whatsapp_batch(web_client, new_messages, current_clients)
+                time.sleep(1)
+                continue
+            # Left unacked, the service redelivers the batch once the outbox can take it
+            logging.error(f"Could not persist WhatsApp batch {batch_id} to the outbox: {e}. Polling again in {backoff}s...")
+            stop_event.wait(backoff)
+            backoff = min(backoff * 2, 30)
+            continue
+        backoff = 1
+        if batch_id and handed_off:
+            ack_whatsapp_batch(batch_id)
+        elif batch_id:
+            # The service redelivers the batch; the messages already forwarded here are skipped as duplicates
+            logging.warning(f"Leaving WhatsApp batch {batch_id} unacked: another shard couldn't take its messages.")
+        forward_whatsapp_batch(web_client, new_messages, current_clients, outbox_ids)
+        if WHATSAPP_TRANSPORT != "longpoll":
+            time.sleep(1)
     logging.info("WhatsApp polling worker is shutting down.")
 
+def hand_off_outbox_entries(entries):
+    """Hands entries whose chat moved to another shard (after a rebalance) over to it. Returns the ones still ours."""
+    ours = []
+    for entry in entries:
+        msg_id, kind, lane, payload = entry
+        owner = shard_map.owner_of(lane)
+        if not owner:
+            ours.append(entry)
+            continue
+        if kind == "whatsapp_to_slack":
+            handed_off = hand_off(owner, "whatsapp_messages", [payload])
+        else:
+            handed_off = hand_off(owner, "slack_event", payload["event"])
+        if handed_off:
+            outbox.complete(msg_id)
+        else:
+            outbox.fail(msg_id, f"could not hand over to {owner}")
+    return ours
+
+def dispatch_outbox_entries(web_client: WebClient, entries):
+    """Re-delivers claimed outbox entries: WhatsApp -> Slack as one ordered batch, Slack -> WhatsApp through the chat lanes."""
+    if shard_map.sharded:
+        entries = hand_off_outbox_entries(entries)
+    to_slack = [(msg_id, payload) for msg_id, kind, lane, payload in entries if kind == "whatsapp_to_slack"]
+    for msg_id, kind, lane, payload in entries:
+        if kind == "slack_to_whatsapp":
+            slack_to_whatsapp_dispatcher.submit(lane, deliver_slack_to_whatsapp, msg_id, payload["event"], web_client.token, payload.get("sent", 0))
+        elif kind != "whatsapp_to_slack":
+            logging.error(f"Unknown outbox message kind '{kind}' (id {msg_id}); leaving it for inspection.")
+    if to_slack:
+        with config_lock:
+            current_clients = dict(whatsapp_to_slack_map)
+        forward_whatsapp_batch(web_client, [payload for _, payload in to_slack], current_clients, [msg_id for msg_id, _ in to_slack])
+
+def run_outbox_relay(web_client: WebClient):
+    """Replays whatever the previous process left undelivered, then keeps retrying failed messages as they fall due."""
+    replayed = list(outbox.replay())
+    if replayed:
+        logging.info(f"Replaying {len(replayed)} undelivered message(s) from the outbox...")
+        dispatch_outbox_entries(web_client, replayed)
+    while not stop_event.wait(OUTBOX_RETRY_INTERVAL):
+        due = outbox.claim_due()
+        if due:
+            dispatch_outbox_entries(web_client, due)
+
+def run_slack_names_refresh(web_client: WebClient):
+    """Keeps the display names for Slack mentions loaded, so forwarding rarely has to look one up."""
+    while True:
+        if slack_names.refresh_due():
+            try:
+                with background_calls():
+                    slack_names.warm(web_client)
+            except Exception as e:
+                logging.warning(f"Could not load Slack user names: {e}")
+        if stop_event.wait(min(SLACK_NAME_REFRESH_INTERVAL, 60)):
+            return
+
 # ⭐ MODIFIED: Added deletion detection (keeping your fast direct threading style)
 def handle_slack_message(client: SocketModeClient, req, web_client: WebClient):
-    client.send_socket_mode_response({"envelope_id": req.envelope_id})
-    
     event = req.payload.get("event", {})
+    # Slack spreads events over the workers' connections: another shard's channel goes to its owner, and is
+    # only acked once the owner has it (otherwise Slack redelivers it)
+    owner = shard_map.owner_of(event.get("channel"))
+    if owner and not hand_off(owner, "slack_event", event):
+        return
+    client.send_socket_mode_response({"envelope_id": req.envelope_id})
+    if not owner:
+        handle_slack_event(event, web_client.token)
+
+def handle_slack_event(event, bot_token):
     event_type = event.get("type")
     
     # Handle message deletion (simple and fast)
     if event_type == "message" and event.get("subtype") == "message_deleted":
-        deleted_ts = event.get("deleted_ts")
-        if deleted_ts and deleted_ts in slack_to_whatsapp_msg_map:
-            whatsapp_msg_id = slack_to_whatsapp_msg_map.pop(deleted_ts)
+        linked = message_index.remote_for("whatsapp", event.get("channel"), event.get("deleted_ts"))
+        if linked:
+            whatsapp_chat_id, whatsapp_msg_id = linked
             logging.info(f"🗑️ Deleting WhatsApp message: {whatsapp_msg_id}")
-            # Keep your style: direct threading, no queues
-            threading.Thread(target=delete_whatsapp_message, args=(whatsapp_msg_id,), daemon=True).start()
+            # Deletes and edits share the chat's lane so they stay ordered with its sends
+            slack_to_whatsapp_dispatcher.submit(whatsapp_chat_id or whatsapp_msg_id, delete_whatsapp_copy, event.get("channel"), event.get("deleted_ts"), whatsapp_msg_id)
+        return
+
+    if event_type == "message" and event.get("subtype") == "message_changed":
+        edited = event.get("message", {})
+        linked = message_index.remote_for("whatsapp", event.get("channel"), edited.get("ts"))
+        if linked and not edited.get("bot_id"):
+            whatsapp_chat_id, whatsapp_msg_id = linked
+            logging.info(f"✏️ Editing WhatsApp message: {whatsapp_msg_id}")
+            slack_to_whatsapp_dispatcher.submit(whatsapp_chat_id or whatsapp_msg_id, edit_whatsapp_message, whatsapp_msg_id, edited.get("text", ""))
         return
     
     # Regular message handling (YOUR ORIGINAL CODE)
@@ -170,47 +740,151 @@ def handle_slack_message(client: SocketModeClient, req, web_client: WebClient):
     channel_id, ts = event.get("channel"), event.get("ts")
     event_id = (channel_id, ts)
     with config_lock:
-        is_managed_channel = channel_id in slack_to_whatsapp_map
-    if is_managed_channel and event_id not in processed_slack_events:
-        processed_slack_events.append(event_id)
-        thread = threading.Thread(target=process_slack_to_whatsapp, args=(event, web_client.token))
-        active_threads.append(thread)
-        thread.start()
+        mapping = slack_to_whatsapp_map.get(channel_id)
+    if mapping and processed_slack_events.check_and_add(event_id):
+        msg_id = outbox.enqueue("slack_to_whatsapp", {"event": event}, lane=mapping["whatsapp_chat_id"]) if outbox else None
+        slack_to_whatsapp_dispatcher.submit(mapping["whatsapp_chat_id"], deliver_slack_to_whatsapp, msg_id, event, bot_token)
+        return True
+
+def sweep_slack_channel(web_client: WebClient, channel_id):
+    """Hands everything in the channel newer than its cursor to handle_slack_event(), oldest first, and advances
+    the cursor; a channel without one only gets one. Returns how many of the messages hadn't been seen yet."""
+    oldest = slack_cursors.oldest(channel_id)
+    messages, cursor = [], None
+    while True:
+        with background_calls():
+            response = web_client.conversations_history(channel=channel_id, oldest=oldest, limit=SLACK_SWEEP_PAGE_SIZE if oldest else 1, cursor=cursor)
+        messages.extend(response.get("messages", []))
+        cursor = (response.get("response_metadata") or {}).get("next_cursor")
+        if not oldest or not response.get("has_more") or not cursor:
+            break
+    messages.sort(key=lambda message: float(message["ts"]))
+    if not oldest:
+        slack_cursors.advance(channel_id, messages[-1]["ts"] if messages else "0")
+        return 0
+    new = sum(1 for message in messages
+              if message.get("subtype") in (None, "file_share") and handle_slack_event(dict(message, channel=channel_id), web_client.token))
+    if messages:
+        slack_cursors.advance(channel_id, messages[-1]["ts"])
+    return new
+
+def run_slack_reconciler(web_client: WebClient):
+    """Catches up on the Slack messages posted while the bridge was down, then sweeps every mapped channel each
+    SLACK_RECONCILE_INTERVAL for anything Socket Mode missed (e.g. during a reconnect)."""
+    with config_lock:
+        backfill = [channel_id for channel_id in slack_to_whatsapp_map if channel_id in slack_cursors]
+    slack_backfill.start(len(backfill))
+    def catch_up(channel_id):
+        try:
+            slack_backfill.channel_done(sweep_slack_channel(web_client, channel_id))
+        except Exception:
+            logging.error(f"An exception occurred while catching up on channel {channel_id}:", exc_info=True)
+            slack_backfill.channel_done(0, failed=True)
+    with ThreadPoolExecutor(max_workers=SLACK_BACKFILL_CONCURRENCY, thread_name_prefix="slack-backfill") as pool:
+        list(pool.map(catch_up, backfill))
+    while not stop_event.is_set():
+        with config_lock:
+            channel_ids = list(slack_to_whatsapp_map)
+        for channel_id in channel_ids:
+            if stop_event.is_set():
+                return
+            try:
+                sweep_slack_channel(web_client, channel_id)
+            except Exception:
+                logging.error(f"An exception occurred while sweeping channel {channel_id}:", exc_info=True)
+        stop_event.wait(SLACK_RECONCILE_INTERVAL)
+
+def deliver_slack_to_whatsapp(msg_id, event, bot_token, sent=0):
+    if defer_if_blocked(msg_id): return
+    in_flight = DELIVERIES_IN_FLIGHT.labels("slack_to_whatsapp")
+    in_flight.inc()
+    try:
+        delivered = process_slack_to_whatsapp(event, bot_token, msg_id, sent)
+    finally:
+        in_flight.inc(-1)
+    if not delivered:
+        FORWARD_FAILURES.labels("slack_to_whatsapp").inc()
+    settle_outbox(msg_id, delivered)
+
+def fetch_slack_file(file_info, bot_token):
+    """Downloads a Slack file into the media cache and returns it open for reading, or None on failure."""
+    url = file_info.get("url_private_download")
+    f = media_cache.create()
+    try:
+        with http_session.get(url, headers={"Authorization": f"Bearer {bot_token}"}, timeout=HTTP_TIMEOUT, stream=True) as file_response:
+            if file_response.status_code != 200:
+                logging.error(f"Failed to download Slack file '{file_info.get('name')}'. Status: {file_response.status_code}")
+                media_cache.discard(f)
+                return None
+            for chunk in file_response.iter_content(MEDIA_CHUNK_SIZE):
+                f.write(chunk)
+        media_cache.commit(url, f)
+        return f
+    except BaseException:
+        media_cache.discard(f)
+        raise
+
+def download_slack_file(file_info, bot_token):
+    """Uploads a Slack file to the Node service and returns its media reference for /send-message, or None if it
+    couldn't be downloaded or uploaded. A file already in the media cache (from an earlier attempt, or the Discord
+    bridge) is streamed from disk."""
+    f = media_cache.open(file_info.get("url_private_download")) or fetch_slack_file(file_info, bot_token)
+    if f is None:
+        return None
+    with f:
+        return upload_whatsapp_media(f, file_info.get("mimetype"), file_info.get("name"))
+
+def download_slack_files(files, bot_token):
+    """Downloads a message's files RELAY_FILE_CONCURRENCY at a time, keeping their order."""
+    if len(files) <= 1:
+        return [download_slack_file(f, bot_token) for f in files]
+    with ThreadPoolExecutor(max_workers=min(len(files), RELAY_FILE_CONCURRENCY), thread_name_prefix="slack-file") as pool:
+        return list(pool.map(lambda f: download_slack_file(f, bot_token), files))
 
 # ⭐ MODIFIED: Store message mapping for deletion (minimal change to your function)
-def process_slack_to_whatsapp(event, bot_token):
+def process_slack_to_whatsapp(event, bot_token, msg_id=None, sent=0):
+    """Returns False only if the message should be retried later. `sent` is how many of its parts an earlier
+    attempt already delivered; they are skipped."""
     try:
         channel_id = event.get("channel")
         slack_ts = event.get("ts")  # ⭐ Get Slack timestamp for mapping
         
         with config_lock:
-            if channel_id not in slack_to_whatsapp_map: return
+            if channel_id not in slack_to_whatsapp_map: return True  # client was removed; nothing to retry
             mapping = slack_to_whatsapp_map[channel_id]
         whatsapp_chat_id, client_name = mapping["whatsapp_chat_id"], mapping["client_name"]
-        text = event.get("text", "")
-        media_payload = None
-        if "files" in event:
-            file_info = event["files"][0]
-            file_url = file_info.get("url_private_download")
-            file_response = requests.get(file_url, headers={"Authorization": f"Bearer {bot_token}"})
-            if file_response.status_code == 200:
-                file_content_base64 = base64.b64encode(file_response.content).decode('utf-8')
-                media_payload = {"mimetype": file_info.get("mimetype"), "filename": file_info.get("name"), "data": file_content_base64}
+        text = slack_names.resolve(slack_web_client, event.get("text", ""))
+        files = [f for f in event.get("files") or () if f.get("url_private_download")]
+        # A WhatsApp message carries one file: the first goes out with the text as its caption, the rest follow in order
+        media_payloads = download_slack_files(files[sent:], bot_token) or [None]
+        if files and not all(media_payloads):
+            # Nothing goes out until every file is in hand, so a retry never repeats part of the message
+            logging.error(f"Could not fetch every file of a Slack message for WhatsApp user '{client_name}'; retrying it later")
+            for media in media_payloads:
+                release_whatsapp_media(media)
+            return False
+        size = len(text.encode()) + sum(media.get("size", 0) for media in media_payloads if media)
         
-        # ⭐ MODIFIED: Get response to store mapping
-        response = send_whatsapp_message(whatsapp_chat_id, text, media_payload)
-        if response and response.get("success"):
-            # ⭐ Store mapping for future deletion (simple dict, no complexity)
-            whatsapp_msg_id = response.get("messageId")
-            if whatsapp_msg_id:
-                slack_to_whatsapp_msg_map[slack_ts] = whatsapp_msg_id
-            logging.info(f"Forwarded Slack message to WhatsApp user '{client_name}'")
-        else:
-            logging.error(f"Failed to forward Slack message to WhatsApp user '{client_name}'")
+        for part, media in enumerate(media_payloads, start=sent):
+            # ⭐ MODIFIED: Get response to store mapping
+            response = send_whatsapp_message(whatsapp_chat_id, text if part == 0 else "", media)
+            if not (response and response.get("success")):
+                logging.error(f"Failed to forward Slack message to WhatsApp user '{client_name}'" if part == 0 else
+                              f"Failed to send file '{media['filename']}' to WhatsApp user '{client_name}'")
+                for unsent in media_payloads[part - sent + 1:]:
+                    release_whatsapp_media(unsent)
+                return False
+            if part == 0:
+                # ⭐ Store mapping for future edits/deletions
+                message_index.link("whatsapp", channel_id, slack_ts, response.get("messageId"), whatsapp_chat_id)
+            if part + 1 < len(files):
+                record_outbox_progress(msg_id, {"event": event, "sent": part + 1})
+        record_delivery("slack_to_whatsapp", slack_ts, size)
+        logging.info(f"Forwarded Slack message to WhatsApp user '{client_name}'")
+        return True
     except Exception as e:
         logging.error(f"Unhandled exception in process_slack_to_whatsapp: {e}", exc_info=True)
-    finally:
-        active_threads.remove(threading.current_thread())
+    return False
 
 if __name__ == "__main__":
     if not SLACK_APP_TOKEN:
@@ -218,8 +892,4 @@ if __name__ == "__main__":
     try:
         main()
     except KeyboardInterrupt:
-        logging.info("Shutdown signal received. Waiting for threads to finish...")
-        stop_event.set()
-        for thread in active_threads:
-            thread.join()
-        logging.info("All processing threads have finished. Bridge shut down.")
\ No newline at end of file
+        shutdown()
\ No newline at end of file
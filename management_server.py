@@ -1,11 +1,14 @@
 # management_server.py - FINAL, INSTANT REFRESH VERSION
 
 import os
+import csv
 import gspread
 import shlex
 import threading
+import time
 import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, jsonify
 from slack_sdk.signature import SignatureVerifier
 from dotenv import load_dotenv
@@ -13,6 +16,35 @@ from dotenv import load_dotenv
 load_dotenv()
 app = Flask(__name__)
 
+CREDENTIALS_FILE = 'credentials/service_account.json'
+SPREADSHEET_NAME = "BitLink Client Mappings"
+# /add-client calls arriving within this window are written to the sheet in one append_rows call
+ADD_CLIENT_BATCH_WINDOW = float(os.getenv("ADD_CLIENT_BATCH_WINDOW", 0.5))
+# Bridges are refreshed once, this many seconds after the last write of a burst
+REFRESH_DEBOUNCE_SECONDS = float(os.getenv("REFRESH_DEBOUNCE_SECONDS", 2))
+
+# --- Shared Google Sheets handle (authenticating costs a token exchange + a Drive lookup per call) ---
+_worksheet = None
+_worksheet_lock = threading.Lock()
+
+def get_worksheet():
+    global _worksheet
+    with _worksheet_lock:
+        if _worksheet is None:
+            gc = gspread.service_account(filename=CREDENTIALS_FILE)
+            _worksheet = gc.open(SPREADSHEET_NAME).sheet1
+        return _worksheet
+
+def append_client_rows(rows):
+    """Appends rows in a single Sheets API call. The cached handle is dropped on failure so the next call re-authenticates."""
+    global _worksheet
+    try:
+        get_worksheet().append_rows(rows)
+    except Exception:
+        with _worksheet_lock:
+            _worksheet = None
+        raise
+
 # --- NEW: Function to send the "refresh" signal to the running bridges ---
 def send_refresh_signals():
     """Sends a POST request to the bridge servers to trigger a config reload."""
@@ -25,9 +57,8 @@ def send_refresh_signals():
         f"http://localhost:{whatsapp_port}/refresh",
         f"http://localhost:{discord_port}/refresh"
     ]
-    
-    print("Sending refresh signals to bridge services...")
-    for url in urls:
+
+    def signal(url):
         try:
             # We don't need to wait for a response, just fire and forget.
             # A short timeout prevents this from hanging if a service is offline.
@@ -37,6 +68,65 @@ def send_refresh_signals():
             # This is not an error. It just means that bridge is not currently running.
             print(f"Could not send refresh signal to {url}. Bridge may be offline (this is normal).")
 
+    print("Sending refresh signals to bridge services...")
+    # All bridges at once, so an offline one doesn't delay the others by its timeout
+    with ThreadPoolExecutor(max_workers=len(urls)) as pool:
+        list(pool.map(signal, urls))
+
+# --- Debounced refresh: a burst of writes triggers one reload per bridge ---
+_refresh_timer = None
+_refresh_lock = threading.Lock()
+
+def schedule_refresh():
+    global _refresh_timer
+    with _refresh_lock:
+        if _refresh_timer is not None:
+            _refresh_timer.cancel()
+        _refresh_timer = threading.Timer(REFRESH_DEBOUNCE_SECONDS, send_refresh_signals)
+        _refresh_timer.daemon = True
+        _refresh_timer.start()
+
+# --- Coalescing of concurrent /add-client calls into one batched write ---
+class RowBatcher:
+    """Collects rows submitted within `window` seconds of each other and appends them with one append_rows call.
+    add() blocks until its row is written and re-raises the write error, if any."""
+
+    def __init__(self, window):
+        self.window = window
+        self._pending = []
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def add(self, row):
+        entry = {"row": row, "done": threading.Event(), "error": None}
+        with self._cond:
+            self._pending.append(entry)
+            self._cond.notify()
+        entry["done"].wait()
+        if entry["error"]:
+            raise entry["error"]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending)
+            # Give concurrent calls a moment to join this batch
+            time.sleep(self.window)
+            with self._cond:
+                batch, self._pending = self._pending, []
+            error = None
+            try:
+                append_client_rows([entry["row"] for entry in batch])
+                print(f"Wrote {len(batch)} client row(s) to Google Sheets in one call.")
+                schedule_refresh()
+            except Exception as e:
+                error = e
+            for entry in batch:
+                entry["error"] = error
+                entry["done"].set()
+
+row_batcher = RowBatcher(ADD_CLIENT_BATCH_WINDOW)
+
 # --- MODIFIED: The background task now sends the refresh signal ---
 def process_and_respond(response_url, command_text):
     """
@@ -49,16 +139,10 @@ def process_and_respond(response_url, command_text):
         
         platform, client_name, external_id, slack_channel_id = parts
 
-        # 1. Write to Google Sheets
-        gc = gspread.service_account(filename='credentials/service_account.json')
-        spreadsheet = gc.open("BitLink Client Mappings")
-        worksheet = spreadsheet.sheet1
+        # 1. Write to Google Sheets (batched with any concurrent /add-client calls)
+        # 2. The batcher then tells the running bridges to reload their configuration (debounced)
         new_row = [client_name, platform, external_id, slack_channel_id]
-        worksheet.append_row(new_row)
-        
-        # --- THIS IS THE NEW PART ---
-        # 2. Tell the running bridges to reload their configuration
-        send_refresh_signals()
+        row_batcher.add(new_row)
         
         # 3. Prepare the success message for Slack
         payload = {
@@ -82,6 +166,48 @@ def process_and_respond(response_url, command_text):
     requests.post(response_url, data=json.dumps(payload), headers={'Content-Type': 'application/json'})
 
 
+def parse_client_rows(text):
+    """Parses one client per line: platform,"Client Name",external_id,slack_channel_id (an optional header line is skipped)."""
+    rows, errors = [], []
+    for line_number, fields in enumerate(csv.reader(text.strip().splitlines(), skipinitialspace=True), start=1):
+        if not fields or (line_number == 1 and fields[0].strip().lower() == "platform"):
+            continue
+        if len(fields) != 4 or not all(field.strip() for field in fields):
+            errors.append(f"line {line_number}: expected 4 fields, got {len(fields)}")
+            continue
+        platform, client_name, external_id, slack_channel_id = (field.strip() for field in fields)
+        rows.append([client_name, platform, external_id, slack_channel_id])
+    return rows, errors
+
+def import_and_respond(response_url, command_text):
+    """Bulk variant of process_and_respond: all rows go to Google Sheets in one call, followed by one refresh."""
+    rows, errors = parse_client_rows(command_text)
+    try:
+        if errors:
+            raise ValueError("Nothing imported. Fix these lines and retry:\n" + "\n".join(errors[:20]))
+        if not rows:
+            raise ValueError("No clients found. Send one per line: platform,\"Client Name\",external_id,slack_channel_id")
+        append_client_rows(rows)
+        schedule_refresh()
+        payload = {"response_type": "in_channel", "text": f"✅ Imported {len(rows)} client mapping(s). The bridges will refresh momentarily."}
+    except Exception as e:
+        print(f"Error in background thread: {e}")
+        payload = {"response_type": "ephemeral", "text": f"❌ An error occurred: {e}"}
+    requests.post(response_url, data=json.dumps(payload), headers={'Content-Type': 'application/json'})
+
+@app.route('/slack/commands/import-clients', methods=['POST'])
+def import_clients_command():
+    verifier = SignatureVerifier(os.environ.get("SLACK_SIGNING_SECRET"))
+    if not verifier.is_valid_request(request.get_data(), request.headers):
+        return "Invalid request signature", 403
+
+    threading.Thread(target=import_and_respond, args=(request.form['response_url'], request.form['text'])).start()
+
+    return jsonify({
+        "response_type": "ephemeral",
+        "text": "Got it! Importing clients and signaling bridges to refresh..."
+    })
+
 # --- The rest of the file is unchanged ---
 @app.route('/slack/commands/add-client', methods=['POST'])
 def add_client_command():
@@ -0,0 +1,143 @@
+# media_cache.py - disk cache of downloaded media, shared by the bridges so a file is fetched once
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+# Shared by both bridges and every shard, so it doesn't follow BRIDGE_DATA_DIR
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", os.path.join("data", "media_cache"))
+# Least recently used files are removed past this many bytes; 0 disables the cache
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+# Downloads left half-written by a process that died are removed at startup once this old
+STALE_PART_SECONDS = 3600
+
+def source_key(url):
+    """Cache key of a download URL: host and path, which carry the Slack file ID or Discord attachment ID.
+    The query string is dropped because Discord signs CDN URLs with parameters that change between fetches."""
+    parts = urlsplit(url)
+    return f"{parts.netloc}{parts.path}"
+
+class MediaCache:
+    """Content-addressed files under `directory`, named by the SHA-256 of their source key, evicted least
+    recently used first once they pass `max_bytes`.
+
+    A download is written into create()'s temp file and commit()ted, which renames it into place: other
+    processes only ever see complete files. Files stay readable through open handles after eviction.
+    Each process evicts from what it has seen (the files present at startup plus its own hits and commits),
+    so with several processes the directory can briefly exceed max_bytes.
+    """
+
+    def __init__(self, directory=MEDIA_CACHE_DIR, max_bytes=MEDIA_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._files = OrderedDict()  # name -> size, least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.enabled:
+            self._scan()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _scan(self):
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue  # evicted by another process meanwhile
+            if entry.name.endswith(".part"):
+                if time.time() - stat.st_mtime > STALE_PART_SECONDS:
+                    os.unlink(entry.path)
+                continue
+            found.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(found):
+            self._files[name] = size
+            self._bytes += size
+        if found:
+            logging.info(f"Media cache: {len(found)} file(s), {self._bytes // (1024 * 1024)} MB in {self.directory}")
+        self._evict()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _name(self, url):
+        return hashlib.sha256(source_key(url).encode()).hexdigest()
+
+    def open(self, url):
+        """A binary file with the cached download of `url`, or None on a miss."""
+        if not self.enabled:
+            return None
+        name = self._name(url)
+        try:
+            f = open(self._path(name), "rb")
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+                if name in self._files:
+                    self._bytes -= self._files.pop(name)  # evicted by another process
+            return None
+        size = os.fstat(f.fileno()).st_size
+        os.utime(f.fileno())  # recency for the other processes' next scan
+        with self._lock:
+            self.hits += 1
+            if name not in self._files:
+                self._bytes += size
+            self._files[name] = size
+            self._files.move_to_end(name)
+        return f
+
+    def create(self):
+        """A temp file to download into; pass it to commit() when complete, or discard() it."""
+        if not self.enabled:
+            return tempfile.TemporaryFile()
+        return tempfile.NamedTemporaryFile(dir=self.directory, suffix=".part", delete=False)
+
+    def commit(self, url, f):
+        """Adds the complete download in `f` (from create()) as `url`'s. `f` stays open and is rewound for reading."""
+        f.flush()
+        f.seek(0)
+        if not self.enabled:
+            return
+        name = self._name(url)
+        size = os.fstat(f.fileno()).st_size
+        os.replace(f.name, self._path(name))
+        with self._lock:
+            self._bytes += size - self._files.pop(name, 0)
+            self._files[name] = size
+            self._evict()
+
+    def discard(self, f):
+        f.close()
+        if self.enabled:
+            try:
+                os.unlink(f.name)
+            except FileNotFoundError:
+                pass
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._files:
+            name, size = self._files.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.unlink(self._path(name))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"files": len(self._files), "bytes": self._bytes, "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / lookups, 3) if lookups else None, "evictions": self.evictions}
+
+media_cache = MediaCache()
@@ -0,0 +1,141 @@
+# media_relay.py - bounded-memory file relay between Discord and Slack
+import asyncio
+import io
+import logging
+import os
+import tempfile
+from contextlib import asynccontextmanager, nullcontext
+
+from media_cache import media_cache
+
+RELAY_CHUNK_SIZE = 64 * 1024
+# Files up to this size stay in RAM; anything bigger is spooled to a temp file on disk.
+RELAY_SPOOL_THRESHOLD = int(os.getenv("RELAY_SPOOL_THRESHOLD", 8 * 1024 * 1024))
+# Transfers larger than this are refused instead of relayed.
+RELAY_MAX_TRANSFER_BYTES = int(os.getenv("RELAY_MAX_TRANSFER_BYTES", 1024 * 1024 * 1024))
+# Upper bound on file bytes held in RAM across all concurrent transfers.
+RELAY_MAX_INFLIGHT_BYTES = int(os.getenv("RELAY_MAX_INFLIGHT_BYTES", 64 * 1024 * 1024))
+# Files of one message that are downloaded and uploaded at the same time (10 = a full Discord album);
+# RAM stays bounded by RELAY_MAX_INFLIGHT_BYTES whatever this is.
+RELAY_FILE_CONCURRENCY = int(os.getenv("RELAY_FILE_CONCURRENCY", 10))
+
+class ByteBudget:
+    """An asyncio semaphore counted in bytes. Transfers wait until their reservation fits under the limit."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self._cond = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reserve(self, n_bytes):
+        n_bytes = min(n_bytes, self.limit)
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_use + n_bytes <= self.limit)
+            self.in_use += n_bytes
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self.in_use -= n_bytes
+                self._cond.notify_all()
+
+relay_budget = ByteBudget(RELAY_MAX_INFLIGHT_BYTES)
+
+def spool_reservation(expected_size):
+    """Bytes of RAM a spooled download of `expected_size` bytes can use."""
+    return min(expected_size or RELAY_SPOOL_THRESHOLD, RELAY_SPOOL_THRESHOLD) + RELAY_CHUNK_SIZE
+
+@asynccontextmanager
+async def spooled_download(session, url, headers=None, expected_size=None, budget=relay_budget, cache=media_cache):
+    """Streams `url` chunk by chunk into `cache` and yields (file, size), or (None, 0) on failure. A file the cache
+    already has (from an earlier attempt, or the other bridge) is read from disk instead of downloaded again.
+    With the cache disabled the file goes into a SpooledTemporaryFile. At most RELAY_SPOOL_THRESHOLD bytes of it
+    live in RAM, and that amount is reserved from `budget` (None when the caller already reserved it)."""
+    cached = cache.open(url)
+    if cached:
+        with cached:
+            yield cached, os.fstat(cached.fileno()).st_size
+        return
+    if expected_size and expected_size > RELAY_MAX_TRANSFER_BYTES:
+        logging.error(f"Refusing to relay {url}: {expected_size} bytes exceeds RELAY_MAX_TRANSFER_BYTES.")
+        yield None, 0
+        return
+    async with budget.reserve(spool_reservation(expected_size)) if budget else nullcontext():
+        spool = cache.create() if cache.enabled else tempfile.SpooledTemporaryFile(max_size=RELAY_SPOOL_THRESHOLD)
+        try:
+            size = 0
+            async with session.get(url, headers=headers) as response:
+                if response.status != 200:
+                    logging.error(f"Failed to download file for relay. Status: {response.status}")
+                    yield None, 0
+                    return
+                async for chunk in response.content.iter_chunked(RELAY_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > RELAY_MAX_TRANSFER_BYTES:
+                        logging.error(f"Aborting relay of {url}: exceeded RELAY_MAX_TRANSFER_BYTES.")
+                        yield None, 0
+                        return
+                    spool.write(chunk)
+            cache.commit(url, spool)
+            yield spool, size
+        finally:
+            cache.discard(spool)
+
+class SpoolReader(io.RawIOBase):
+    """Read-only view of a spool from the start. aiohttp closes request payloads once they are sent,
+    so each attempt gets its own reader and the spool stays usable for a retry."""
+
+    def __init__(self, spool):
+        self._spool = spool
+        spool.seek(0)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._spool.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+async def gather_or_raise(coros):
+    """Runs `coros` concurrently and returns their results in order. Unlike plain gather, every one has
+    finished before the first exception is raised, so nothing keeps transferring behind a retry."""
+    results = await asyncio.gather(*coros, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+async def stage_slack_upload(slack_client, session, spool, size, filename):
+    """Steps 1 and 2 of files_upload_v2 for an already spooled file (which files_upload_v2 would read into memory
+    first): get an upload URL and POST the body. The file isn't shared until completed. Returns its ID, or None."""
+    url_response = await slack_client.files_getUploadURLExternal(filename=filename, length=size)
+    async with session.post(url_response["upload_url"], data=SpoolReader(spool)) as response:
+        await response.read()  # a response left unread closes the connection instead of returning it to the pool
+        if response.status != 200:
+            logging.error(f"Slack file upload failed for '{filename}'. Status: {response.status}")
+            return None
+    return url_response["file_id"]
+
+async def relay_files_to_slack(slack_client, session, files, channel, initial_comment, headers=None):
+    """Relays every (url, filename, size) in `files` into one Slack message captioned `initial_comment`, like the
+    multi-file form of files_upload_v2: RELAY_FILE_CONCURRENCY files at a time are downloaded and staged, then one
+    files.completeUploadExternal shares them in their original order. Returns the shared files as Slack file objects,
+    or None if any file failed."""
+    semaphore = asyncio.Semaphore(RELAY_FILE_CONCURRENCY)
+
+    async def stage(url, filename, expected_size):
+        async with semaphore:
+            async with spooled_download(session, url, headers=headers, expected_size=expected_size) as (spool, size):
+                if spool is None: return None
+                return await stage_slack_upload(slack_client, session, spool, size, filename)
+
+    file_ids = await gather_or_raise([stage(*f) for f in files])
+    if not all(file_ids):
+        return None
+    response = await slack_client.files_completeUploadExternal(
+        files=[{"id": file_id, "title": filename} for file_id, (_, filename, _) in zip(file_ids, files)],
+        channel_id=channel, initial_comment=initial_comment,
+    )
+    return response.get("files") or []
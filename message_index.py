@@ -0,0 +1,149 @@
+# message_index.py - persistent Slack ts <-> WhatsApp / Discord message ID index
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS links (
+    platform TEXT NOT NULL,
+    slack_channel TEXT NOT NULL,
+    slack_ts TEXT NOT NULL,
+    remote_chat TEXT,
+    remote_id TEXT NOT NULL,
+    origin TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (platform, slack_channel, slack_ts)
+);
+CREATE INDEX IF NOT EXISTS links_remote ON links(platform, remote_id);
+CREATE INDEX IF NOT EXISTS links_created ON links(created_at);
+CREATE TABLE IF NOT EXISTS burst_parts (
+    platform TEXT NOT NULL,
+    remote_id TEXT NOT NULL,
+    slack_channel TEXT NOT NULL,
+    slack_ts TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (platform, remote_id)
+);
+CREATE INDEX IF NOT EXISTS burst_parts_post ON burst_parts(platform, slack_channel, slack_ts);
+"""
+
+def file_share_ts(files, channel):
+    """The ts of the Slack message that shared `files` (file objects from files.completeUploadExternal or files.info)
+    in `channel`, which is what a file post is linked by; None if Slack hasn't reported the share yet."""
+    for file in files or ():
+        shares = file.get("shares") or {}
+        for visibility in ("public", "private"):
+            posts = (shares.get(visibility) or {}).get(channel)
+            if posts:
+                return posts[0].get("ts")
+    return None
+
+class MessageIndex:
+    """Maps a Slack message (channel, ts) to the message it was bridged to or from on another platform
+    ("whatsapp" or "discord"), in both directions, so edits and deletes can follow the original message.
+    `origin` records which side the message was first written on ("slack" or the platform), so a link is
+    only used to mirror changes from that side.
+
+    A Slack post that merges a burst of a client's messages (see coalescing.py) is linked to its first message
+    like any other, and every message's body is kept in burst_parts so an edit or delete can re-render the post.
+
+    Links older than `ttl` seconds are pruned, and the table is trimmed to the newest `max_entries`; a burst's
+    parts go with its link. Pruning runs every `prune_every` writes so it costs nothing per lookup. Both lookups
+    are indexed. Every call may wait on SQLite, so the Discord bridge makes them from its executor.
+    """
+
+    def __init__(self, path, ttl=30 * 24 * 3600, max_entries=500_000, prune_every=1000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self.prune()
+
+    def link(self, platform, slack_channel, slack_ts, remote_id, remote_chat=None, origin="slack"):
+        if not (slack_channel and slack_ts and remote_id):
+            return
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO links VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (platform, slack_channel, str(slack_ts), remote_chat, str(remote_id), origin, time.time()))
+            self._writes += 1
+            due = self._writes % self.prune_every == 0
+        if due:
+            self.prune()
+
+    def link_burst(self, platform, slack_channel, slack_ts, parts, remote_chat=None):
+        """Links a post merging `parts`, (remote message ID, body) pairs in order, all written on `platform`."""
+        if not (slack_channel and slack_ts and parts):
+            return
+        self.link(platform, slack_channel, slack_ts, parts[0][0], remote_chat, origin=platform)
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO burst_parts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   [(platform, str(remote_id), slack_channel, str(slack_ts), position, body, now) for position, (remote_id, body) in enumerate(parts)])
+
+    def update_burst(self, platform, remote_id, body):
+        """Replaces the body of a message that was posted as part of a burst, or removes it if `body` is None.
+        Returns (slack_channel, slack_ts, remaining bodies in order), or None if the message wasn't in a burst."""
+        with self._lock:
+            post = self._conn.execute("SELECT slack_channel, slack_ts FROM burst_parts WHERE platform = ? AND remote_id = ?", (platform, str(remote_id))).fetchone()
+            if not post:
+                return None
+            if body is None:
+                self._conn.execute("DELETE FROM burst_parts WHERE platform = ? AND remote_id = ?", (platform, str(remote_id)))
+            else:
+                self._conn.execute("UPDATE burst_parts SET body = ? WHERE platform = ? AND remote_id = ?", (body, platform, str(remote_id)))
+            bodies = [row[0] for row in self._conn.execute("SELECT body FROM burst_parts WHERE platform = ? AND slack_channel = ? AND slack_ts = ? ORDER BY position",
+                                                           (platform, *post))]
+        return post[0], post[1], bodies
+
+    def remote_for(self, platform, slack_channel, slack_ts, origin="slack"):
+        """Returns (remote_chat, remote_id) for a Slack message that originated on `origin`, or None."""
+        with self._lock:
+            return self._conn.execute("SELECT remote_chat, remote_id FROM links WHERE platform = ? AND slack_channel = ? AND slack_ts = ? AND origin = ?",
+                                      (platform, slack_channel, str(slack_ts), origin)).fetchone()
+
+    def slack_for(self, platform, remote_id, origin=None):
+        """Returns (slack_channel, slack_ts) for a WhatsApp/Discord message ID, or None. `origin` defaults to `platform`."""
+        with self._lock:
+            linked = self._conn.execute("SELECT slack_channel, slack_ts FROM links WHERE platform = ? AND remote_id = ? AND origin = ?",
+                                        (platform, str(remote_id), origin or platform)).fetchone()
+            if linked or (origin or platform) != platform:
+                return linked
+            return self._conn.execute("SELECT slack_channel, slack_ts FROM burst_parts WHERE platform = ? AND remote_id = ?", (platform, str(remote_id))).fetchone()
+
+    def forget(self, platform, slack_channel, slack_ts):
+        with self._lock:
+            self._conn.execute("DELETE FROM links WHERE platform = ? AND slack_channel = ? AND slack_ts = ?",
+                               (platform, slack_channel, str(slack_ts)))
+            self._conn.execute("DELETE FROM burst_parts WHERE platform = ? AND slack_channel = ? AND slack_ts = ?",
+                               (platform, slack_channel, str(slack_ts)))
+
+    def prune(self):
+        with self._lock:
+            expired = self._conn.execute("DELETE FROM links WHERE created_at < ?", (time.time() - self.ttl,)).rowcount
+            excess = self._conn.execute("SELECT COUNT(*) FROM links").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._conn.execute("DELETE FROM links WHERE rowid IN (SELECT rowid FROM links ORDER BY created_at LIMIT ?)", (excess,))
+            if expired > 0 or excess > 0:
+                self._conn.execute("DELETE FROM burst_parts WHERE NOT EXISTS (SELECT 1 FROM links l WHERE l.platform = burst_parts.platform "
+                                   "AND l.slack_channel = burst_parts.slack_channel AND l.slack_ts = burst_parts.slack_ts)")
+        if expired > 0 or excess > 0:
+            logging.info(f"Message index {self.path}: pruned {expired} expired and {max(excess, 0)} excess link(s).")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM links").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
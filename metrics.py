@@ -0,0 +1,209 @@
+# metrics.py - minimal Prometheus text-format metrics for the bridges' /metrics endpoints
+import bisect
+import threading
+import time
+
+# Seconds; covers a fast chat.postMessage up to a slow media relay
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """Returns the child for these label values. Call sites on hot paths can keep the child around."""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+class _Value:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value, self.lock = 0.0, threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+    def render(self, name, labelnames, values):
+        return [f"{name}{_format_labels(labelnames, values)} {self.value}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+    def render(self, name, labelnames, values):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        lines, cumulative = [], 0
+        for bound, count in zip(self.bounds + (float("inf"),), counts):
+            cumulative += count
+            le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+            lines.append(f"{name}_bucket{_format_labels(labelnames, values, le)} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, values)} {total}")
+        lines.append(f"{name}_count{_format_labels(labelnames, values)} {cumulative}")
+        return lines
+
+class _Timer:
+    __slots__ = ("child", "started")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+class Callback:
+    """A gauge or counter read from existing state at scrape time, so the hot path pays nothing.
+    `fn` returns a number, or a dict of {label values tuple: number}."""
+
+    def __init__(self, name, help_text, fn, labelnames=(), kind="gauge"):
+        self.name, self.help, self.fn, self.labelnames, self.kind = name, help_text, fn, tuple(labelnames), kind
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            result = self.fn()
+        except Exception as e:  # a broken source shouldn't take the whole endpoint down
+            return lines + [f"# error reading {self.name}: {e}"]
+        items = result.items() if isinstance(result, dict) else [((), result)]
+        lines.extend(f"{self.name}{_format_labels(self.labelnames, values)} {float(value)}" for values, value in items)
+        return lines
+
+def _sum_results(first, second):
+    if not isinstance(first, dict) and not isinstance(second, dict):
+        return first + second
+    total = dict(first) if isinstance(first, dict) else {(): first}
+    for values, value in (second.items() if isinstance(second, dict) else [((), second)]):
+        total[values] = total.get(values, 0) + value
+    return total
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self.register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def callback(self, name, help_text, fn, labelnames=(), kind="gauge"):
+        existing = self._metrics.get(name)
+        if isinstance(existing, Callback):
+            # Both bridges register the same callbacks when they share a process (bridge_runtime.py): report the sum
+            first, second = existing.fn, fn
+            fn = lambda: _sum_results(first(), second())
+        return self.register(Callback(name, help_text, fn, labelnames, kind))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+# --- Metrics shared by both bridges ---
+FORWARD_LATENCY = registry.histogram(
+    "bridge_forward_latency_seconds", "Time from a message being sent on its origin platform to its delivery on the other side.",
+    ("direction",), buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0))
+MESSAGES_FORWARDED = registry.counter("bridge_messages_forwarded_total", "Messages delivered.", ("direction",))
+BYTES_FORWARDED = registry.counter("bridge_bytes_forwarded_total", "Text and attachment bytes delivered.", ("direction",))
+FORWARD_FAILURES = registry.counter("bridge_forward_failures_total", "Delivery attempts that failed (and were left to the outbox to retry).", ("direction",))
+DELIVERIES_IN_FLIGHT = registry.gauge("bridge_deliveries_in_flight", "Deliveries started and not yet finished.", ("direction",))
+REQUEST_RETRIES = registry.counter("bridge_request_retries_total", "Requests retried in-process, by reason (rate_limited, error).", ("reason",))
+API_CALL_DURATION = registry.histogram("bridge_api_call_duration_seconds", "External API call latency, excluding rate-limit waits.", ("api", "endpoint"))
+API_CALL_ERRORS = registry.counter("bridge_api_call_errors_total", "External API calls that raised or returned an error status.", ("api", "endpoint"))
+COALESCED_MESSAGES = registry.counter("bridge_coalesced_messages_total", "Messages merged into an earlier message's Slack post instead of posted on their own.", ("direction",))
+SHARD_HANDOFFS = registry.counter("bridge_shard_handoffs_total", "Events handed to the worker that owns their client, by kind and outcome.", ("kind", "outcome"))
+CONFIG_RELOAD_DURATION = registry.histogram("bridge_config_reload_seconds", "Duration of reload_config().", ("bridge",),
+                                            buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0))
+
+def register_outbox(get_outbox):
+    """Exposes an Outbox's counters; `get_outbox` returns the bridge's outbox, or None before it is opened."""
+    def counters():
+        outbox = get_outbox()
+        return {(event,): value for event, value in outbox.counters.items()} if outbox else {}
+    registry.callback("bridge_outbox_events_total", "Outbox operations (enqueued, completed, retried, dead_lettered).",
+                      counters, ("event",), kind="counter")
+
+def record_delivery(direction, sent_at, size):
+    """Counts one delivered message. `sent_at` is the origin platform's epoch timestamp (None if unknown)."""
+    MESSAGES_FORWARDED.labels(direction).inc()
+    BYTES_FORWARDED.labels(direction).inc(size)
+    if sent_at:
+        FORWARD_LATENCY.labels(direction).observe(max(time.time() - float(sent_at), 0.0))
@@ -0,0 +1,307 @@
+# outbox.py - durable SQLite (WAL) outbox for in-flight bridge messages
+import json
+import logging
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    lane TEXT,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_next_attempt ON outbox(next_attempt_at);
+CREATE INDEX IF NOT EXISTS outbox_lane ON outbox(kind, lane, id);
+CREATE TABLE IF NOT EXISTS dead_letter (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    lane TEXT,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    failed_at REAL NOT NULL,
+    last_error TEXT
+);
+"""
+
+class _Op:
+    __slots__ = ("name", "args", "done", "result", "error")
+
+    def __init__(self, name, args, wait):
+        self.name, self.args, self.result, self.error = name, args, None, None
+        self.done = threading.Event() if wait else None
+
+class Outbox:
+    """Write-ahead log for messages between "received from one platform" and "delivered to the other".
+
+    enqueue() returns once the message is committed, so it survives a crash or deploy; complete() removes it
+    after delivery and fail() schedules a retry with exponential backoff (or moves it to `dead_letter` after
+    `max_attempts`). Everything still in the table when the bridge starts is handed back by claim_due(), which
+    is how messages are replayed after a restart.
+
+    Messages with a `lane` (a chat) keep their order within kind + lane: once one fails, is_blocked() is True
+    for every later message of that lane, which the caller defer()s instead of delivering, and claim_due()
+    only hands out a lane's messages up to the first one that isn't due yet.
+
+    A single writer thread owns the SQLite connection and applies queued operations in batches of up to
+    `batch_size` per transaction, so concurrent producers share commits instead of paying one each.
+    """
+
+    def __init__(self, path, batch_size=512, max_attempts=8, base_backoff=2.0, max_backoff=600.0, lease=300.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        # A claimed message isn't handed out again for `lease` seconds, unless complete()/fail() comes first.
+        self.lease = lease
+        self.counters = {"enqueued": 0, "completed": 0, "retried": 0, "dead_lettered": 0}
+        self._ops = queue.SimpleQueue()
+        self._id_lock = threading.Lock()
+        self._next_id = None
+        self._ready = threading.Event()
+        self._lane_lock = threading.Lock()
+        self._lanes = {}  # msg_id -> (kind, lane) of undelivered messages
+        self._held = {}   # (kind, lane) -> IDs waiting for a retry, which later messages of the lane queue behind
+        self._writer = threading.Thread(target=self._run_writer, name="outbox-writer", daemon=True)
+        self._writer.start()
+        self._ready.wait()
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL: commits survive a process crash; only an OS crash/power loss can drop the last few.
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        return conn
+
+    def _run_writer(self):
+        conn = self._connect()
+        self._next_id = (conn.execute("SELECT MAX(id) FROM (SELECT id FROM outbox UNION ALL SELECT id FROM dead_letter)").fetchone()[0] or 0) + 1
+        pending = conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        if pending:
+            logging.info(f"Outbox {self.path} has {pending} undelivered message(s) to replay.")
+        self._ready.set()
+        while True:
+            ops = [self._ops.get()]
+            while len(ops) < self.batch_size:
+                try:
+                    ops.append(self._ops.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(op.name == "close" for op in ops)
+            ops = [op for op in ops if op.name != "close"]
+            try:
+                self._apply(conn, ops)
+            except sqlite3.Error as e:
+                # Don't let one bad operation fail the whole group: redo them one transaction each.
+                logging.error(f"Outbox batch of {len(ops)} operation(s) failed ({e}); retrying individually.")
+                for op in ops:
+                    try:
+                        self._apply(conn, [op])
+                    except sqlite3.Error as op_error:
+                        op.error = op_error
+            for op in ops:
+                if op.done:
+                    op.done.set()
+            if stop:
+                conn.close()
+                return
+
+    def _apply(self, conn, ops):
+        conn.execute("BEGIN")
+        try:
+            for op in ops:
+                op.result = getattr(self, f"_do_{op.name}")(conn, *op.args)
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _submit(self, name, *args, wait=True):
+        op = _Op(name, args, wait)
+        self._ops.put(op)
+        if wait:
+            op.done.wait()
+            if op.error:
+                raise op.error
+            return op.result
+
+    # --- public API ---
+    def enqueue(self, kind, payload, lane=None, claimed=True):
+        """Durably stores a message and returns its ID. With `claimed` the caller delivers it right away,
+        so the retry relay leaves it alone until the lease expires."""
+        with self._id_lock:
+            msg_id = self._next_id
+            self._next_id += 1
+        self._track([(msg_id, kind, lane)])
+        try:
+            self._submit("enqueue", msg_id, kind, lane, json.dumps(payload), claimed)
+        except sqlite3.Error:
+            self._release(msg_id)
+            raise
+        return msg_id
+
+    def enqueue_many(self, kind, entries, claimed=True):
+        """enqueue() for a list of (payload, lane) pairs in a single commit. Returns their IDs in order."""
+        with self._id_lock:
+            first_id = self._next_id
+            self._next_id += len(entries)
+        ids = list(range(first_id, first_id + len(entries)))
+        self._track([(msg_id, kind, lane) for msg_id, (payload, lane) in zip(ids, entries)])
+        if entries:
+            try:
+                self._submit("enqueue_many", [(msg_id, kind, lane, json.dumps(payload)) for msg_id, (payload, lane) in zip(ids, entries)], claimed)
+            except sqlite3.Error:
+                for msg_id in ids:
+                    self._release(msg_id)
+                raise
+        return ids
+
+    def complete(self, msg_id):
+        self._release(msg_id)
+        self._submit("complete", msg_id, wait=False)
+
+    def fail(self, msg_id, error=""):
+        self._hold(msg_id)
+        self._submit("fail", msg_id, str(error)[:500], wait=False)
+
+    def update(self, msg_id, payload):
+        """Replaces a message's payload once it's committed, e.g. to record the parts of it already delivered so
+        a retry only sends the rest."""
+        self._submit("update", msg_id, json.dumps(payload))
+
+    def defer(self, msg_id):
+        """Hands a message to the retry relay instead of delivering it now, because is_blocked() said so."""
+        self._hold(msg_id)
+        self._submit("defer", msg_id, wait=False)
+
+    def is_blocked(self, msg_id):
+        """True if an earlier message of the same kind and lane is waiting for a retry."""
+        with self._lane_lock:
+            held = self._held.get(self._lanes.get(msg_id), ())
+            return any(held_id < msg_id for held_id in held)
+
+    def claim_due(self, limit=100):
+        """Returns up to `limit` messages whose retry time has come as (id, kind, lane, payload) and leases them.
+        Deliver each lane's messages in ID order, defer()ing the rest of a lane after a failure."""
+        rows = self._submit("claim", limit, None)
+        self._track([(msg_id, kind, lane) for msg_id, kind, lane, _ in rows])
+        return rows
+
+    def replay(self, page_size=500):
+        """Yields every stored message regardless of schedule or lease, oldest first. Used once at startup,
+        when anything left in the table was in flight when the previous process died."""
+        with self._id_lock:
+            end_id = self._next_id  # messages enqueued from here on are being delivered by their producer
+        last_id = 0
+        while True:
+            rows = [row for row in self._submit("claim", page_size, last_id) if row[0] < end_id]
+            if not rows:
+                return
+            # Live messages of these lanes wait until the replayed ones are through
+            self._track([(msg_id, kind, lane) for msg_id, kind, lane, _ in rows], held=True)
+            yield from rows
+            last_id = rows[-1][0]
+
+    def stats(self):
+        return {**self._submit("stats"), **self.counters}
+
+    def close(self):
+        op = _Op("close", (), wait=False)
+        self._ops.put(op)
+        self._writer.join()
+
+    # --- lane bookkeeping ---
+    def _track(self, rows, held=False):
+        with self._lane_lock:
+            for msg_id, kind, lane in rows:
+                if lane is not None:
+                    self._lanes[msg_id] = (kind, lane)
+                    if held:
+                        self._held.setdefault((kind, lane), set()).add(msg_id)
+
+    def _hold(self, msg_id):
+        with self._lane_lock:
+            key = self._lanes.get(msg_id)
+            if key is not None:
+                self._held.setdefault(key, set()).add(msg_id)
+
+    def _release(self, msg_id):
+        with self._lane_lock:
+            key = self._lanes.pop(msg_id, None)
+            held = self._held.get(key)
+            if held is not None:
+                held.discard(msg_id)
+                if not held:
+                    del self._held[key]
+
+    # --- writer-thread operations ---
+    def _do_enqueue(self, conn, msg_id, kind, lane, payload, claimed):
+        now = time.time()
+        conn.execute("INSERT INTO outbox (id, kind, lane, payload, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                     (msg_id, kind, lane, payload, now + self.lease if claimed else now, now))
+        self.counters["enqueued"] += 1
+
+    def _do_enqueue_many(self, conn, rows, claimed):
+        now = time.time()
+        next_attempt_at = now + self.lease if claimed else now
+        conn.executemany("INSERT INTO outbox (id, kind, lane, payload, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                         [(msg_id, kind, lane, payload, next_attempt_at, now) for msg_id, kind, lane, payload in rows])
+        self.counters["enqueued"] += len(rows)
+
+    def _do_complete(self, conn, msg_id):
+        conn.execute("DELETE FROM outbox WHERE id = ?", (msg_id,))
+        self.counters["completed"] += 1
+
+    def _do_fail(self, conn, msg_id, error):
+        row = conn.execute("SELECT attempts FROM outbox WHERE id = ?", (msg_id,)).fetchone()
+        if row is None:
+            return
+        attempts = row[0] + 1
+        if attempts >= self.max_attempts:
+            conn.execute("INSERT INTO dead_letter (id, kind, lane, payload, attempts, created_at, failed_at, last_error) "
+                         "SELECT id, kind, lane, payload, ?, created_at, ?, ? FROM outbox WHERE id = ?",
+                         (attempts, time.time(), error, msg_id))
+            conn.execute("DELETE FROM outbox WHERE id = ?", (msg_id,))
+            self._release(msg_id)
+            self.counters["dead_lettered"] += 1
+            logging.error(f"Outbox message {msg_id} moved to dead_letter after {attempts} attempts: {error}")
+            return
+        # Exponential backoff with jitter so a recovering API isn't hit by every retry at once
+        delay = min(self.base_backoff * 2 ** (attempts - 1), self.max_backoff) * random.uniform(0.8, 1.2)
+        conn.execute("UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                     (attempts, time.time() + delay, error, msg_id))
+        self.counters["retried"] += 1
+
+    def _do_update(self, conn, msg_id, payload):
+        conn.execute("UPDATE outbox SET payload = ? WHERE id = ?", (payload, msg_id))
+
+    def _do_defer(self, conn, msg_id):
+        conn.execute("UPDATE outbox SET next_attempt_at = ? WHERE id = ?", (time.time(), msg_id))
+
+    def _do_claim(self, conn, limit, after_id):
+        now = time.time()
+        if after_id is not None:
+            rows = conn.execute("SELECT id, kind, lane, payload FROM outbox WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit)).fetchall()
+        else:
+            # A message is only due once nothing earlier in its lane is still waiting (backing off or in flight)
+            rows = conn.execute("SELECT id, kind, lane, payload FROM outbox o WHERE next_attempt_at <= ? AND (lane IS NULL OR NOT EXISTS "
+                                "(SELECT 1 FROM outbox e WHERE e.kind = o.kind AND e.lane = o.lane AND e.id < o.id AND e.next_attempt_at > ?)) "
+                                "ORDER BY id LIMIT ?", (now, now, limit)).fetchall()
+        conn.executemany("UPDATE outbox SET next_attempt_at = ? WHERE id = ?", [(now + self.lease, row[0]) for row in rows])
+        return [(msg_id, kind, lane, json.loads(payload)) for msg_id, kind, lane, payload in rows]
+
+    def _do_stats(self, conn):
+        return {"pending": conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0],
+                "dead_letter": conn.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]}
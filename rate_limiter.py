@@ -0,0 +1,284 @@
+# rate_limiter.py - token-bucket scheduler for outbound Slack and Discord API calls
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web.async_client import AsyncWebClient
+
+from metrics import API_CALL_DURATION, API_CALL_ERRORS, registry
+
+# Lower runs first. Sends a person is waiting on are INTERACTIVE; sweeps, warm-up and cache refreshes are BACKGROUND.
+INTERACTIVE, BACKGROUND = 0, 10
+call_priority = contextvars.ContextVar("call_priority", default=INTERACTIVE)
+
+Limit = namedtuple("Limit", "calls per burst")
+
+# https://api.slack.com/apis/rate-limits - per method, per workspace. SLACK_RATE_LIMIT_SCALE > 1 for workspaces with higher limits.
+SLACK_RATE_LIMIT_SCALE = float(os.getenv("SLACK_RATE_LIMIT_SCALE", 1))
+SLACK_TIERS = {1: Limit(1, 60, 1), 2: Limit(20, 60, 20), 3: Limit(50, 60, 50), 4: Limit(100, 60, 100)}
+SLACK_METHOD_TIERS = {
+    "apps.connections.open": 1, "conversations.list": 2, "users.list": 2, "conversations.history": 3,
+    "conversations.info": 3, "chat.update": 3, "chat.delete": 3, "auth.test": 4, "users.info": 4,
+    "files.getUploadURLExternal": 4, "files.completeUploadExternal": 4, "files.info": 4,
+}
+# chat.postMessage is limited per channel: about one message per second, with short bursts allowed
+SLACK_POST_MESSAGE_LIMIT = Limit(1, 1, 3)
+SLACK_MAX_RATE_LIMIT_RETRIES = 5
+
+# https://discord.com/developers/docs/topics/rate-limits - per route, plus a global limit
+DISCORD_GLOBAL_LIMIT = Limit(50, 1, 50)
+DISCORD_ROUTE_LIMIT = Limit(5, 5, 5)
+_SNOWFLAKE = re.compile(r"/\d{15,21}")
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"rate limited, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class _Bucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until", "waiters")
+
+    def __init__(self, limit, now):
+        self.rate = limit.calls / limit.per
+        self.capacity = max(limit.burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = now
+        self.blocked_until = 0.0
+        self.waiters = []  # heap of (priority, seq, grant)
+
+    def take(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until or self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def next_token_at(self, now):
+        return max(self.blocked_until, now + (1 - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """Token buckets keyed by API route, shared by every thread and event loop in the process.
+
+    acquire() (threads) and acquire_async() (asyncio) return right away while the bucket has tokens.
+    Otherwise the caller is queued by priority (INTERACTIVE before BACKGROUND, FIFO within a priority)
+    and a scheduler thread hands out tokens as the bucket refills. block() empties a bucket for the
+    Retry-After a 429 asked for, so every queued caller waits it out instead of retrying blindly.
+    """
+
+    def __init__(self, max_idle_buckets=10000):
+        self.max_idle_buckets = max_idle_buckets
+        self.counters = {"immediate": 0, "queued": 0, "throttled": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+        self._buckets = {}
+        self._pending = set()  # keys of buckets with queued callers
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._scheduler = None
+
+    def _bucket(self, key, limit, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_idle_buckets:
+                self._drop_idle_buckets(now)
+            bucket = self._buckets[key] = _Bucket(limit, now)
+        return bucket
+
+    def _drop_idle_buckets(self, now):
+        for key, bucket in list(self._buckets.items()):
+            if not bucket.waiters and now >= bucket.blocked_until and bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.capacity:
+                del self._buckets[key]
+
+    def _enqueue(self, key, limit, priority, grant):
+        """Takes a token now (returns True) or queues `grant` to be called when one is available."""
+        now = time.monotonic()
+        bucket = self._bucket(key, limit, now)
+        if not bucket.waiters and bucket.take(now):
+            self.counters["immediate"] += 1
+            return True
+        heapq.heappush(bucket.waiters, (call_priority.get() if priority is None else priority, next(self._seq), grant))
+        self.counters["queued"] += 1
+        self._pending.add(key)
+        if self._scheduler is None:
+            self._scheduler = threading.Thread(target=self._run, name="rate-limiter", daemon=True)
+            self._scheduler.start()
+        self._cond.notify()
+        return False
+
+    def _record_wait(self, started):
+        waited = time.monotonic() - started
+        with self._cond:
+            self.counters["wait_seconds"] += waited
+            self.counters["max_wait_seconds"] = max(self.counters["max_wait_seconds"], waited)
+
+    def acquire(self, key, limit, priority=None):
+        started = time.monotonic()
+        granted = threading.Event()
+        with self._cond:
+            if self._enqueue(key, limit, priority, granted.set):
+                return
+        granted.wait()
+        self._record_wait(started)
+
+    async def acquire_async(self, key, limit, priority=None):
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def grant():
+            try:
+                loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+            except RuntimeError:  # loop already closed
+                pass
+        with self._cond:
+            if self._enqueue(key, limit, priority, grant):
+                return
+        await granted
+        self._record_wait(started)
+
+    def block(self, key, limit, retry_after, throttled=True):
+        """Holds back every call on `key` for `retry_after` seconds (a 429, or a bucket reported as exhausted)."""
+        with self._cond:
+            now = time.monotonic()
+            bucket = self._bucket(key, limit, now)
+            bucket.blocked_until = max(bucket.blocked_until, now + retry_after)
+            # Empty the bucket so that exactly one call may go the moment the block ends
+            bucket.tokens = 0.0
+            bucket.updated = bucket.blocked_until - 1 / bucket.rate
+            if throttled:
+                self.counters["throttled"] += 1
+            self._cond.notify()
+
+    def _run(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                next_wake = None
+                for key in list(self._pending):
+                    bucket = self._buckets[key]
+                    while bucket.waiters and bucket.take(now):
+                        heapq.heappop(bucket.waiters)[2]()
+                    if bucket.waiters:
+                        wake = bucket.next_token_at(now)
+                        next_wake = wake if next_wake is None else min(next_wake, wake)
+                    else:
+                        self._pending.discard(key)
+                self._cond.wait(None if next_wake is None else max(next_wake - now, 0.001))
+
+    def stats(self):
+        with self._cond:
+            waiting = sum(len(self._buckets[key].waiters) for key in self._pending)
+            return {**self.counters, "waiting": waiting, "buckets": len(self._buckets)}
+
+
+rate_limiter = RateLimiter()
+registry.callback("bridge_rate_limit_waiting_calls", "API calls currently queued for a rate-limit token.", lambda: rate_limiter.stats()["waiting"])
+registry.callback("bridge_rate_limit_queued_calls_total", "API calls that had to wait for a rate-limit token.", lambda: rate_limiter.counters["queued"], kind="counter")
+registry.callback("bridge_rate_limit_throttled_total", "429 responses received.", lambda: rate_limiter.counters["throttled"], kind="counter")
+registry.callback("bridge_rate_limit_wait_seconds_total", "Total time spent waiting for rate-limit tokens.", lambda: rate_limiter.counters["wait_seconds"], kind="counter")
+
+
+# --- Slack ---
+def slack_bucket(api_method, kwargs):
+    if api_method == "chat.postMessage":
+        channel = next((args.get("channel") for args in (kwargs.get("json"), kwargs.get("data"), kwargs.get("params")) if args), None)
+        return f"slack:chat.postMessage:{channel}", _scaled(SLACK_POST_MESSAGE_LIMIT)
+    return f"slack:{api_method}", _scaled(SLACK_TIERS[SLACK_METHOD_TIERS.get(api_method, 3)])
+
+def _scaled(limit):
+    if SLACK_RATE_LIMIT_SCALE == 1:
+        return limit
+    return Limit(limit.calls * SLACK_RATE_LIMIT_SCALE, limit.per, max(int(limit.burst * SLACK_RATE_LIMIT_SCALE), 1))
+
+def _slack_retry_after(error):
+    headers = error.response.headers or {}
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    if isinstance(value, list):
+        value = value[0]
+    return float(value or 1)
+
+class RateLimitedWebClient(WebClient):
+    """WebClient whose every API call (including the ones files_upload_v2 makes) goes through rate_limiter.
+    A 429 blocks the method's bucket for Retry-After and the call is retried."""
+
+    def api_call(self, api_method, **kwargs):
+        key, limit = slack_bucket(api_method, kwargs)
+        for attempt in range(SLACK_MAX_RATE_LIMIT_RETRIES + 1):
+            rate_limiter.acquire(key, limit)
+            try:
+                with API_CALL_DURATION.labels("slack", api_method).time():
+                    return super().api_call(api_method, **kwargs)
+            except SlackApiError as e:
+                API_CALL_ERRORS.labels("slack", api_method).inc()
+                if e.response.status_code != 429 or attempt == SLACK_MAX_RATE_LIMIT_RETRIES:
+                    raise
+                retry_after = _slack_retry_after(e)
+                logging.warning(f"Slack rate limited {api_method}; holding that method for {retry_after:.0f}s.")
+                rate_limiter.block(key, limit, retry_after)
+
+class RateLimitedAsyncWebClient(AsyncWebClient):
+    """AsyncWebClient counterpart of RateLimitedWebClient."""
+
+    async def api_call(self, api_method, **kwargs):
+        key, limit = slack_bucket(api_method, kwargs)
+        for attempt in range(SLACK_MAX_RATE_LIMIT_RETRIES + 1):
+            await rate_limiter.acquire_async(key, limit)
+            try:
+                with API_CALL_DURATION.labels("slack", api_method).time():
+                    return await super().api_call(api_method, **kwargs)
+            except SlackApiError as e:
+                API_CALL_ERRORS.labels("slack", api_method).inc()
+                if e.response.status_code != 429 or attempt == SLACK_MAX_RATE_LIMIT_RETRIES:
+                    raise
+                retry_after = _slack_retry_after(e)
+                logging.warning(f"Slack rate limited {api_method}; holding that method for {retry_after:.0f}s.")
+                rate_limiter.block(key, limit, retry_after)
+
+
+# --- Discord ---
+def discord_route(method, path):
+    """"POST /channels/{id}/messages" style route name with the IDs templated out."""
+    return f"{method} {_SNOWFLAKE.sub('/{id}', path)}"
+
+def discord_bucket(method, path):
+    """Route bucket key: IDs are templated out except the channel ID, which Discord limits separately."""
+    channel = re.match(r"/channels/(\d+)", path)
+    return f"discord:{discord_route(method, path)}" + (f":{channel.group(1)}" if channel else "")
+
+async def acquire_discord(method, path):
+    await rate_limiter.acquire_async("discord:global", DISCORD_GLOBAL_LIMIT)
+    key = discord_bucket(method, path)
+    await rate_limiter.acquire_async(key, DISCORD_ROUTE_LIMIT)
+    return key
+
+def record_discord_response(key, status, headers, body=None):
+    """Applies Discord's rate-limit headers. Raises RateLimited on a 429 after blocking the bucket."""
+    if status == 429:
+        retry_after = float(headers.get("Retry-After") or (body or {}).get("retry_after") or 1)
+        is_global = headers.get("X-RateLimit-Global") == "true" or (body or {}).get("global")
+        rate_limiter.block("discord:global" if is_global else key, DISCORD_GLOBAL_LIMIT if is_global else DISCORD_ROUTE_LIMIT, retry_after)
+        raise RateLimited(retry_after)
+    if headers.get("X-RateLimit-Remaining") == "0":
+        # Bucket exhausted: wait for its reset instead of finding out with a 429
+        rate_limiter.block(key, DISCORD_ROUTE_LIMIT, float(headers.get("X-RateLimit-Reset-After") or 1), throttled=False)
+
+@contextlib.contextmanager
+def background_calls():
+    """Runs the API calls made inside the block at BACKGROUND priority."""
+    token = call_priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        call_priority.reset(token)
@@ -0,0 +1,92 @@
+# sharding.py - consistent-hash split of clients across bridge worker processes
+import bisect
+import hashlib
+import os
+import threading
+
+# Set by bridge_supervisor.py for each worker; a bridge started on its own is the only shard and owns every client.
+BRIDGE_SHARD_INDEX = int(os.getenv("BRIDGE_SHARD_INDEX", 0))
+BRIDGE_SHARD_COUNT = int(os.getenv("BRIDGE_SHARD_COUNT", 1))
+# Comma-separated base URLs of every worker, by shard index, for handing over events another shard owns
+BRIDGE_SHARD_PEERS = os.getenv("BRIDGE_SHARD_PEERS", "")
+# Points per shard on the ring; more points spread clients more evenly
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", 160))
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+class HashRing:
+    """Consistent hashing: each shard owns the arcs before its points, so adding a shard takes about 1/N of
+    the keys from the others and leaves the rest where they were."""
+
+    def __init__(self, n_shards, vnodes=SHARD_VNODES):
+        points = sorted((_hash(f"shard-{shard}#{i}"), shard) for shard in range(n_shards) for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, key):
+        i = bisect.bisect(self._hashes, _hash(key))
+        return self._shards[i % len(self._shards)]
+
+def client_key(platform, external_id):
+    """What a client is hashed by: stable across sheet edits other than the client's own ID."""
+    return f"{platform.lower()}:{external_id}"
+
+class ShardMap:
+    """This worker's share of the clients. assign() hashes every mapping row and remembers the owner of each
+    client's chat/user ID and Slack channel, so events that reach the wrong worker can be handed to the right one."""
+
+    def __init__(self, index=BRIDGE_SHARD_INDEX, count=BRIDGE_SHARD_COUNT, peers=BRIDGE_SHARD_PEERS, vnodes=SHARD_VNODES):
+        self.index = index
+        self.vnodes = vnodes
+        self._lock = threading.Lock()
+        self._routes = {}  # platform -> {ID: shard}
+        self._owned = {}  # platform -> owned client count
+        self.update(count, peers)
+
+    @property
+    def sharded(self):
+        # A worker being retired by a shrink (index past the new count) owns nothing and hands everything over
+        return self.count > 1 or self.index >= self.count
+
+    def update(self, count, peers):
+        """Applies a new topology from the supervisor; the next assign() rebalances."""
+        with self._lock:
+            self.count = count
+            self.peers = [p.rstrip("/") for p in (peers.split(",") if isinstance(peers, str) else peers) if p]
+            self._ring = HashRing(count, self.vnodes) if count > 1 else None
+
+    def assign(self, rows, platform):
+        """Returns the rows this worker owns and records the owner of every row's IDs. Each platform keeps its own
+        routes, so both bridges can share the map in one process (bridge_runtime.py)."""
+        routes, owned = {}, []
+        with self._lock:
+            for row in rows:
+                shard = self._ring.shard_for(client_key(platform, row.get("external_id"))) if self._ring else 0
+                for key in (row.get("external_id"), row.get("slack_channel_id")):
+                    if key:
+                        routes[str(key)] = shard
+                if shard == self.index:
+                    owned.append(row)
+            self._routes[platform], self._owned[platform] = routes, len(owned)
+        return owned
+
+    def shard_of(self, key):
+        """Index of the shard that owns `key` (a chat/user ID or Slack channel) as of the last assign(), or None."""
+        key = str(key)
+        for routes in list(self._routes.values()):
+            if key in routes:
+                return routes[key]
+        return None
+
+    def owner_of(self, key):
+        """URL of the worker that owns `key`, or None if it's ours or unknown."""
+        shard = self.shard_of(key) if self.sharded else None
+        if shard is None or shard == self.index or shard >= len(self.peers):
+            return None
+        return self.peers[shard]
+
+    def stats(self):
+        return {"index": self.index, "count": self.count, "owned_clients": sum(self._owned.values())}
+
+shard_map = ShardMap()
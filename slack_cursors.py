@@ -0,0 +1,148 @@
+# slack_cursors.py - per-channel Slack history checkpoints, kept on disk so a restart can catch up
+import json
+import logging
+import os
+import threading
+import time
+
+# A restart catches up on at most this much history, however long the bridge was down
+SLACK_BACKFILL_MAX_AGE = float(os.getenv("SLACK_BACKFILL_MAX_AGE", 7 * 24 * 3600))
+
+class SlackCursors:
+    """Channel ID -> ts of the newest message a sweep has handed on, persisted to a JSON file.
+
+    Only sweeps of conversations.history advance a cursor (Socket Mode events can arrive with gaps before
+    them), so everything up to it has been seen. advance() and forget() only mark the store dirty; a
+    background thread writes it every `save_interval` seconds, and close() once more.
+
+    With `seen`, the bridge's DedupeStore of Slack messages is saved before each write of the cursors, so a
+    cursor on disk is never ahead of the dedupe keys of the messages it has passed.
+    """
+
+    def __init__(self, path=None, save_interval=10.0, seen=None):
+        self.path = path
+        self.seen = seen
+        self._cursors = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._load()
+        self._saver = None
+        if path:
+            self._stop = threading.Event()
+            self._saver = threading.Thread(target=self._save_periodically, args=(save_interval,), name="slack-cursor-saver", daemon=True)
+            self._saver.start()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                self._cursors = {str(channel): str(ts) for channel, ts in json.load(f).items()}
+            logging.info(f"Loaded {len(self._cursors)} Slack channel cursor(s) from {self.path}")
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not load Slack channel cursors from {self.path}: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            cursors, self._dirty = dict(self._cursors), False
+        if self.seen is not None and not self.seen.save():
+            self._dirty = True  # not before the dedupe keys are on disk
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(cursors, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self._dirty = True  # try again next round
+            logging.warning(f"Could not save Slack channel cursors to {self.path}: {e}")
+
+    def _save_periodically(self, interval):
+        while not self._stop.wait(interval):
+            self.save()
+
+    def close(self):
+        if self._saver:
+            self._stop.set()
+            self._saver.join()
+        self.save()
+
+    def __contains__(self, channel_id):
+        return channel_id in self._cursors
+
+    def __len__(self):
+        return len(self._cursors)
+
+    def get(self, channel_id):
+        return self._cursors.get(channel_id)
+
+    def oldest(self, channel_id):
+        """Where a sweep of the channel starts: its cursor, or SLACK_BACKFILL_MAX_AGE ago if that's later."""
+        ts = self._cursors.get(channel_id)
+        if ts is None or not SLACK_BACKFILL_MAX_AGE or float(ts) >= time.time() - SLACK_BACKFILL_MAX_AGE:
+            return ts
+        return f"{time.time() - SLACK_BACKFILL_MAX_AGE:.6f}"
+
+    def advance(self, channel_id, ts):
+        """Moves the channel's cursor to `ts` unless it's already past it."""
+        with self._lock:
+            current = self._cursors.get(channel_id)
+            if current is None or float(ts) > float(current):
+                self._cursors[channel_id] = ts
+                self._dirty = True
+
+    def retain(self, channel_ids):
+        """Drops the cursors of channels that are no longer mapped, so a channel mapped again later starts afresh."""
+        with self._lock:
+            for channel_id in [c for c in self._cursors if c not in channel_ids]:
+                del self._cursors[channel_id]
+                self._dirty = True
+
+class BackfillProgress:
+    """Progress of a catch-up pass over the channels with a saved cursor, logged every `log_interval` seconds."""
+
+    def __init__(self, log_interval=5.0):
+        self.log_interval = log_interval
+        self._lock = threading.Lock()
+        self.channels = self.done = self.failed = self.messages = 0
+        self.started = self.finished = None
+        self._logged = 0.0
+
+    def start(self, channels):
+        with self._lock:
+            self.channels, self.done, self.failed, self.messages = channels, 0, 0, 0
+            self.started = time.monotonic()
+            self.finished = None if channels else self.started
+            self._logged = self.started
+        logging.info(f"Catching up on Slack messages missed while down: {channels} channel(s)...")
+
+    def channel_done(self, messages, failed=False):
+        with self._lock:
+            self.done += 1
+            self.failed += failed
+            self.messages += messages
+            now = time.monotonic()
+            if self.done == self.channels:
+                self.finished = now
+            elif now - self._logged < self.log_interval:
+                return
+            self._logged = now
+            done, failed_count, total, found, elapsed = self.done, self.failed, self.channels, self.messages, now - self.started
+        if done == total:
+            note = f"; {failed_count} failed and are left to the next sweep" if failed_count else ""
+            logging.info(f"Slack catch-up finished: {found} missed message(s) in {total} channel(s) in {elapsed:.1f}s{note}.")
+        else:
+            logging.info(f"Slack catch-up: {done}/{total} channel(s), {found} missed message(s) so far ({elapsed:.0f}s).")
+
+    def stats(self):
+        with self._lock:
+            if self.started is None:
+                return None
+            end = self.finished or time.monotonic()
+            return {"channels": self.channels, "done": self.done, "failed": self.failed, "messages": self.messages,
+                    "seconds": round(end - self.started, 1), "finished": self.finished is not None}
@@ -0,0 +1,163 @@
+# slack_markup.py - renders Slack's mention and link markup as plain text for the client platforms
+import logging
+import os
+import re
+import threading
+import time
+
+from slack_sdk.errors import SlackApiError
+
+# Cached display names are looked up again once this old...
+SLACK_NAME_TTL = float(os.getenv("SLACK_NAME_TTL", 24 * 3600))
+# ...and the whole user list is reloaded this often, so the TTL rarely runs out on the forwarding path
+SLACK_NAME_REFRESH_INTERVAL = float(os.getenv("SLACK_NAME_REFRESH_INTERVAL", 3600))
+SLACK_USERS_PAGE_SIZE = 200
+
+MARKUP = re.compile(r"<([^<>]*)>")
+ENTITIES = (("&lt;", "<"), ("&gt;", ">"), ("&amp;", "&"))
+
+def user_display_name(user):
+    profile = user.get("profile") or {}
+    return profile.get("display_name") or profile.get("real_name") or user.get("real_name") or user.get("name")
+
+class SlackNames:
+    """Display names of Slack users and channels for render(). warm() loads every user from users.list; a
+    name that's still missing (a new teammate, a channel mention without its name) is looked up once with
+    users.info or conversations.info and cached for SLACK_NAME_TTL.
+
+    The bridges call resolve()/resolve_async(), which only reach the API for names missing() reports.
+    """
+
+    def __init__(self, ttl=SLACK_NAME_TTL):
+        self.ttl = ttl
+        self._names = {}  # ("user" | "channel", ID) -> (name or None, expires at)
+        self._lock = threading.Lock()
+        self.warmed_at = None
+        self._warming = False
+        self.hits = 0
+        self.misses = 0
+        self.lookups = 0
+
+    def _get(self, key):
+        entry = self._names.get(key)
+        return entry if entry and entry[1] > time.monotonic() else None
+
+    def _put(self, entries):
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            self._names.update((key, (name, expires)) for key, name in entries)
+
+    def missing(self, text):
+        """(kind, ID) of the mentions in `text` whose name isn't cached."""
+        wanted = []
+        for match in MARKUP.finditer(text or ""):
+            target, _, label = match.group(1).partition("|")
+            if target.startswith("@"):
+                key = ("user", target[1:])
+            elif target.startswith("#") and not label:
+                key = ("channel", target[1:])
+            else:
+                continue
+            if self._get(key):
+                self.hits += 1
+            else:
+                self.misses += 1
+                wanted.append(key)
+        return wanted
+
+    def render(self, text):
+        """`text` with mentions, channel links, broadcasts and links in plain text, and &-entities unescaped."""
+        def replace(match):
+            target, _, label = match.group(1).partition("|")
+            if target.startswith("@"):
+                name = (self._get(("user", target[1:])) or (None,))[0]
+                return f"@{name or label or target[1:]}"
+            if target.startswith("#"):
+                name = label or (self._get(("channel", target[1:])) or (None,))[0]
+                return f"#{name or target[1:]}"
+            if target.startswith("!"):
+                # <!here>, <!channel>, <!everyone>; user groups and dates carry their text as the label
+                return label or f"@{target[1:].split('^')[0]}"
+            if target.startswith("mailto:"):
+                return label or target[len("mailto:"):]
+            return f"{label} ({target})" if label and label not in target else target
+        text = MARKUP.sub(replace, text or "")
+        for entity, char in ENTITIES:
+            text = text.replace(entity, char)
+        return text
+
+    def _learn_users(self, members):
+        self._put((("user", member["id"]), user_display_name(member)) for member in members if member.get("id"))
+
+    def _learn(self, key, response):
+        if key[0] == "user":
+            self._put([(key, user_display_name(response["user"]))])
+        else:
+            self._put([(key, response["channel"].get("name"))])
+
+    def refresh_due(self):
+        """True when the user list should be reloaded; both bridges ask, so in one process only one of them does it."""
+        return not self._warming and (self.warmed_at is None or time.monotonic() - self.warmed_at >= SLACK_NAME_REFRESH_INTERVAL)
+
+    def warm(self, web_client):
+        """Loads every user's display name with users.list, page by page."""
+        self._warming, cursor, count = True, None, 0
+        try:
+            while True:
+                response = web_client.users_list(limit=SLACK_USERS_PAGE_SIZE, cursor=cursor)
+                self._learn_users(response.get("members", []))
+                count += len(response.get("members", []))
+                cursor = (response.get("response_metadata") or {}).get("next_cursor")
+                if not cursor:
+                    break
+            self.warmed_at = time.monotonic()
+        finally:
+            self._warming = False
+        logging.info(f"Loaded {count} Slack user names.")
+
+    async def warm_async(self, web_client):
+        self._warming, cursor, count = True, None, 0
+        try:
+            while True:
+                response = await web_client.users_list(limit=SLACK_USERS_PAGE_SIZE, cursor=cursor)
+                self._learn_users(response.get("members", []))
+                count += len(response.get("members", []))
+                cursor = (response.get("response_metadata") or {}).get("next_cursor")
+                if not cursor:
+                    break
+            self.warmed_at = time.monotonic()
+        finally:
+            self._warming = False
+        logging.info(f"Loaded {count} Slack user names.")
+
+    def resolve(self, web_client, text):
+        """render() with a WebClient, looking up what the cache misses first."""
+        for key in self.missing(text):
+            self.lookups += 1
+            try:
+                self._learn(key, web_client.users_info(user=key[1]) if key[0] == "user" else web_client.conversations_info(channel=key[1]))
+            except SlackApiError as e:
+                logging.warning(f"Could not look up Slack {key[0]} {key[1]}: {e.response['error']}")
+                self._put([(key, None)])  # rendered as its ID until the TTL runs out
+        return self.render(text)
+
+    async def resolve_async(self, web_client, text):
+        for key in self.missing(text):
+            self.lookups += 1
+            try:
+                self._learn(key, await (web_client.users_info(user=key[1]) if key[0] == "user" else web_client.conversations_info(channel=key[1])))
+            except SlackApiError as e:
+                logging.warning(f"Could not look up Slack {key[0]} {key[1]}: {e.response['error']}")
+                self._put([(key, None)])
+        return self.render(text)
+
+    def stats(self):
+        checked = self.hits + self.misses
+        with self._lock:
+            users = sum(1 for kind, _ in self._names if kind == "user")
+            channels = len(self._names) - users
+        return {"users": users, "channels": channels, "hits": self.hits, "misses": self.misses, "api_lookups": self.lookups,
+                "hit_rate": round(self.hits / checked, 3) if checked else None,
+                "warmed_seconds_ago": round(time.monotonic() - self.warmed_at) if self.warmed_at is not None else None}
+
+slack_names = SlackNames()
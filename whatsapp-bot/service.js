@@ -5,6 +5,10 @@ const express = require('express');
 const qrcode = require('qrcode-terminal');
 const bodyParser = require('body-parser');
 const mime = require('mime-types'); 
+const crypto = require('crypto');
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
 const puppeteer = require('puppeteer-extra');
 const StealthPlugin = require('puppeteer-extra-plugin-stealth');
 
@@ -60,6 +64,98 @@ client.on('disconnected', (reason) => {
 // --- Message Queue for API ---
 const messageQueue = [];
 
+// --- Long-poll delivery with acknowledged batches ---
+// A parked /poll-messages request is answered as soon as a message arrives. Delivered batches stay
+// in-flight until Python acks them; an unacked batch goes back to the front of the queue.
+const ACK_TIMEOUT_MS = parseInt(process.env.ACK_TIMEOUT_MS || '30000', 10);
+const MAX_LONG_POLL_MS = 60000;
+const pollWaiters = [];
+const inflightBatches = new Map();
+let nextBatchId = 1;
+
+// Counters for GET /metrics
+const counters = { received: 0, delivered: 0, requeued: 0, mediaReceivedBytes: 0, mediaServedBytes: 0, mediaUploadedBytes: 0 };
+
+function wakePollWaiter() {
+    const waiter = pollWaiters.shift();
+    if (waiter) waiter();
+}
+
+function enqueueMessage(messageData) {
+    counters.received++;
+    messageQueue.push(messageData);
+    wakePollWaiter();
+}
+
+function requeueBatch(batchId) {
+    const batch = inflightBatches.get(batchId);
+    if (!batch) return;
+    inflightBatches.delete(batchId);
+    counters.requeued += batch.messages.length;
+    messageQueue.unshift(...batch.messages);
+    console.log(`⚠️  Batch ${batchId} was not acknowledged, re-queued ${batch.messages.length} message(s)`);
+    wakePollWaiter();
+}
+
+// --- Media store: files travel to and from the bridge as raw bytes, by reference ---
+// Received media is written here and queued as { mediaId, mimetype, filename, size }; the bridge streams it from
+// GET /media/:id and deletes it once forwarded. Files for /send-message are streamed in with POST /media first.
+// Kept on disk so a restart doesn't lose what the bridge's outbox still refers to.
+const MEDIA_DIR = process.env.MEDIA_DIR || path.join(os.tmpdir(), 'whatsapp-service-media');
+const MEDIA_TTL_MS = parseInt(process.env.MEDIA_TTL_MS || String(24 * 3600 * 1000), 10);
+const UPLOAD_TTL_MS = parseInt(process.env.UPLOAD_TTL_MS || String(15 * 60 * 1000), 10);
+const MAX_UPLOAD_BYTES = parseInt(process.env.MAX_UPLOAD_BYTES || String(100 * 1024 * 1024), 10);
+const MEDIA_ID = /^(in|up)-[0-9a-f]{32}$/;
+fs.mkdirSync(MEDIA_DIR, { recursive: true });
+
+const newMediaId = (prefix) => `${prefix}-${crypto.randomBytes(16).toString('hex')}`;
+const mediaPath = (mediaId) => path.join(MEDIA_DIR, mediaId);
+
+// The metadata file is written last: a media ID is only readable once its bytes are complete
+async function writeMediaInfo(mediaId, info) {
+    await fs.promises.writeFile(`${mediaPath(mediaId)}.json`, JSON.stringify(info));
+    return { mediaId, ...info };
+}
+
+async function readMediaInfo(mediaId) {
+    if (!MEDIA_ID.test(mediaId)) return null;
+    try {
+        return JSON.parse(await fs.promises.readFile(`${mediaPath(mediaId)}.json`, 'utf8'));
+    } catch (error) {
+        return null;
+    }
+}
+
+async function deleteMedia(mediaId) {
+    if (!MEDIA_ID.test(mediaId)) return;
+    await fs.promises.rm(`${mediaPath(mediaId)}.json`, { force: true });
+    await fs.promises.rm(mediaPath(mediaId), { force: true });
+}
+
+// whatsapp-web.js hands media over as base64; it's decoded once here instead of in every poll response
+async function storeReceivedMedia(media, filename) {
+    const mediaId = newMediaId('in');
+    const data = Buffer.from(media.data, 'base64');
+    await fs.promises.writeFile(mediaPath(mediaId), data);
+    counters.mediaReceivedBytes += data.length;
+    return writeMediaInfo(mediaId, { mimetype: media.mimetype, filename, size: data.length });
+}
+
+// Removes media the bridge never fetched or sent, and uploads cut off midway
+async function sweepMedia() {
+    const now = Date.now();
+    for (const name of await fs.promises.readdir(MEDIA_DIR)) {
+        const ttl = name.startsWith('in-') && !name.endsWith('.part') ? MEDIA_TTL_MS : UPLOAD_TTL_MS;
+        try {
+            const { mtimeMs } = await fs.promises.stat(path.join(MEDIA_DIR, name));
+            if (now - mtimeMs > ttl) await fs.promises.rm(path.join(MEDIA_DIR, name), { force: true });
+        } catch (error) {
+            // removed meanwhile
+        }
+    }
+}
+setInterval(() => sweepMedia().catch(error => console.error('Media sweep failed:', error)), 60000).unref();
+
 // --- Enhanced Message Handler with messageId for deletion tracking ---
 client.on('message', async (msg) => {
     let quotedBody = null;
@@ -92,27 +188,37 @@ client.on('message', async (msg) => {
             if (media) {
                 const extension = mime.extension(media.mimetype);
                 const filename = media.filename || `file.${extension}` || 'file.bin';
-                messageData.media = {
-                    mimetype: media.mimetype,
-                    filename: filename,
-                    data: media.data
-                };
-                messageQueue.push(messageData);
+                messageData.media = await storeReceivedMedia(media, filename);
+                enqueueMessage(messageData);
                 console.log(`📎 Media message received from ${msg.from}: ${filename}`);
             }
         } catch (error) {
             console.error("Error downloading media:", error);
             // Still add the message without media if download fails
             messageData.media = null;
-            messageQueue.push(messageData);
+            enqueueMessage(messageData);
         }
     } else {
         messageData.media = null;
-        messageQueue.push(messageData);
+        enqueueMessage(messageData);
         console.log(`💬 Text message received from ${msg.from}: ${msg.body.substring(0, 50)}...`);
     }
 });
 
+// --- Edits and deletions of a client's messages, queued with the messages so they stay in order ---
+// `kind` tells the bridge to update or delete the Slack copy of `messageId` instead of posting a new message.
+client.on('message_edit', (msg, newBody) => {
+    if (msg.fromMe) return;
+    enqueueMessage({ kind: 'edit', chatId: msg.from, messageId: msg.id._serialized, body: newBody, timestamp: Date.now() / 1000 });
+    console.log(`✏️  Message ${msg.id._serialized} edited by ${msg.from}`);
+});
+
+client.on('message_revoke_everyone', (after) => {
+    if (after.fromMe) return;
+    enqueueMessage({ kind: 'delete', chatId: after.from, messageId: after.id._serialized, timestamp: Date.now() / 1000 });
+    console.log(`🗑️  Message ${after.id._serialized} deleted by ${after.from}`);
+});
+
 // --- API Endpoints ---
 
 // Health check endpoint
@@ -126,9 +232,145 @@ app.get('/health', (req, res) => {
 // Get queued messages
 app.get('/get-messages', (req, res) => {
     const messages = messageQueue.splice(0, messageQueue.length);
+    counters.delivered += messages.length;
     res.json(messages);
 });
 
+// Long-poll for queued messages: answers immediately if messages are waiting, otherwise holds the
+// request until one arrives or `timeout` ms pass. Acknowledge the returned batch with POST /ack-messages.
+app.get('/poll-messages', (req, res) => {
+    const timeoutMs = Math.min(parseInt(req.query.timeout, 10) || 25000, MAX_LONG_POLL_MS);
+    let timer = null;
+
+    const deliver = () => {
+        clearTimeout(timer);
+        const waiterIndex = pollWaiters.indexOf(deliver);
+        if (waiterIndex !== -1) pollWaiters.splice(waiterIndex, 1);
+        if (res.writableEnded || res.destroyed) return wakePollWaiter();
+
+        const messages = messageQueue.splice(0, messageQueue.length);
+        if (messages.length === 0) {
+            return res.json({ batchId: null, messages: [] });
+        }
+        const batchId = String(nextBatchId++);
+        inflightBatches.set(batchId, {
+            messages,
+            timer: setTimeout(() => requeueBatch(batchId), ACK_TIMEOUT_MS)
+        });
+        res.json({ batchId, messages });
+    };
+
+    if (messageQueue.length > 0) return deliver();
+    timer = setTimeout(deliver, timeoutMs);
+    pollWaiters.push(deliver);
+    res.on('close', () => {
+        clearTimeout(timer);
+        const waiterIndex = pollWaiters.indexOf(deliver);
+        if (waiterIndex !== -1) pollWaiters.splice(waiterIndex, 1);
+    });
+});
+
+// Acknowledge a batch returned by /poll-messages so it is not re-delivered
+app.post('/ack-messages', (req, res) => {
+    const { batchId } = req.body;
+    const batch = inflightBatches.get(String(batchId));
+
+    if (!batch) {
+        return res.status(404).json({ 
+            success: false, 
+            error: 'Unknown or already re-queued batchId' 
+        });
+    }
+
+    clearTimeout(batch.timer);
+    inflightBatches.delete(String(batchId));
+    counters.delivered += batch.messages.length;
+    res.json({ success: true });
+});
+
+// Queue depth and delivery counters in the Prometheus text format
+app.get('/metrics', (req, res) => {
+    let inflightMessages = 0;
+    for (const batch of inflightBatches.values()) inflightMessages += batch.messages.length;
+    const metrics = [
+        ['whatsapp_service_queue_depth', 'gauge', 'Messages waiting to be polled.', messageQueue.length],
+        ['whatsapp_service_inflight_batches', 'gauge', 'Polled batches waiting for an ack.', inflightBatches.size],
+        ['whatsapp_service_inflight_messages', 'gauge', 'Messages in unacknowledged batches.', inflightMessages],
+        ['whatsapp_service_poll_waiters', 'gauge', 'Parked /poll-messages requests.', pollWaiters.length],
+        ['whatsapp_service_ready', 'gauge', '1 once the WhatsApp client is ready.', isReady ? 1 : 0],
+        ['whatsapp_service_messages_received_total', 'counter', 'Messages received from WhatsApp.', counters.received],
+        ['whatsapp_service_messages_delivered_total', 'counter', 'Messages acknowledged by the bridge.', counters.delivered],
+        ['whatsapp_service_messages_requeued_total', 'counter', 'Messages re-queued after an ack timeout.', counters.requeued],
+        ['whatsapp_service_media_received_bytes_total', 'counter', 'Bytes of media received from WhatsApp.', counters.mediaReceivedBytes],
+        ['whatsapp_service_media_served_bytes_total', 'counter', 'Bytes of media fetched by the bridge.', counters.mediaServedBytes],
+        ['whatsapp_service_media_uploaded_bytes_total', 'counter', 'Bytes of media uploaded by the bridge to send.', counters.mediaUploadedBytes],
+    ];
+    const lines = metrics.flatMap(([name, type, help, value]) => [`# HELP ${name} ${help}`, `# TYPE ${name} ${type}`, `${name} ${value}`]);
+    res.type('text/plain; version=0.0.4').send(lines.join('\n') + '\n');
+});
+
+// Stream a received file to the bridge
+app.get('/media/:mediaId', async (req, res) => {
+    const info = await readMediaInfo(req.params.mediaId);
+    if (!info) {
+        return res.status(404).json({ success: false, error: 'Unknown or expired mediaId' });
+    }
+    res.set({ 'Content-Type': info.mimetype || 'application/octet-stream', 'Content-Length': String(info.size) });
+    fs.createReadStream(mediaPath(req.params.mediaId))
+        .on('error', (error) => {
+            console.error(`❌ Failed to read media ${req.params.mediaId}:`, error);
+            res.destroy(error);
+        })
+        .on('end', () => { counters.mediaServedBytes += info.size; })
+        .pipe(res);
+});
+
+// Forget a received file the bridge has forwarded
+app.delete('/media/:mediaId', async (req, res) => {
+    await deleteMedia(req.params.mediaId);
+    res.json({ success: true });
+});
+
+// Upload a file to send: the raw bytes as an application/octet-stream body, `mimetype` and `filename` in the
+// query. Returns a mediaId to pass to /send-message as { media: { mediaId } }.
+app.post('/media', (req, res) => {
+    const mediaId = newMediaId('up');
+    const partPath = `${mediaPath(mediaId)}.part`;
+    const out = fs.createWriteStream(partPath);
+    let size = 0;
+    const fail = (status, error) => {
+        out.destroy();
+        fs.promises.rm(partPath, { force: true }).catch(() => {});
+        if (!res.headersSent) res.status(status).json({ success: false, error });
+    };
+
+    req.on('data', (chunk) => {
+        size += chunk.length;
+        if (size > MAX_UPLOAD_BYTES) {
+            fail(413, `Media is larger than ${MAX_UPLOAD_BYTES} bytes`);
+            req.destroy();
+        }
+    });
+    req.on('error', () => fail(400, 'Upload was interrupted'));
+    out.on('error', (error) => fail(500, error.toString()));
+    out.on('finish', async () => {
+        if (res.headersSent) return;
+        try {
+            await fs.promises.rename(partPath, mediaPath(mediaId));
+            const info = await writeMediaInfo(mediaId, {
+                mimetype: req.query.mimetype || 'application/octet-stream',
+                filename: req.query.filename || 'file.bin',
+                size
+            });
+            counters.mediaUploadedBytes += size;
+            res.json({ success: true, ...info });
+        } catch (error) {
+            fail(500, error.toString());
+        }
+    });
+    req.pipe(out);
+});
+
 // Send message endpoint with enhanced response
 app.post('/send-message', async (req, res) => {
     const { chatId, message, media } = req.body;
@@ -150,7 +392,25 @@ app.post('/send-message', async (req, res) => {
     try {
         let sentMessage;
         
-        if (media && media.data) {
+        if (media && media.mediaId) {
+            // Send a file uploaded with POST /media; whatsapp-web.js takes it as base64
+            const info = await readMediaInfo(media.mediaId);
+            if (!info) {
+                return res.status(404).json({
+                    success: false,
+                    error: 'Unknown or expired mediaId'
+                });
+            }
+            const data = await fs.promises.readFile(mediaPath(media.mediaId));
+            const mediaFile = new MessageMedia(info.mimetype, data.toString('base64'), info.filename);
+            try {
+                sentMessage = await client.sendMessage(chatId, mediaFile, { caption: message });
+            } finally {
+                // A failed send is retried with a fresh upload
+                await deleteMedia(media.mediaId);
+            }
+            console.log(`📎 Successfully sent media message to ${chatId}`);
+        } else if (media && media.data) {
             // Send message with media
             const mediaFile = new MessageMedia(media.mimetype, media.data, media.filename);
             sentMessage = await client.sendMessage(chatId, mediaFile, { caption: message });
@@ -236,6 +496,53 @@ app.post('/delete-message', async (req, res) => {
     }
 });
 
+// Edit message endpoint (mirrors Slack edits onto messages the bridge sent)
+app.post('/edit-message', async (req, res) => {
+    const { messageId, message: text } = req.body;
+
+    if (!isReady) {
+        return res.status(503).json({
+            success: false,
+            error: 'WhatsApp client is not ready'
+        });
+    }
+
+    if (!messageId || typeof text !== 'string') {
+        return res.status(400).json({
+            success: false,
+            error: 'messageId and message are required'
+        });
+    }
+
+    try {
+        const message = await client.getMessageById(messageId);
+        if (!message) {
+            return res.status(404).json({
+                success: false,
+                error: 'Message not found'
+            });
+        }
+
+        const edited = await message.edit(text);
+        if (!edited) {
+            // WhatsApp only allows editing your own text messages for a limited time
+            return res.status(409).json({
+                success: false,
+                error: 'Message can no longer be edited'
+            });
+        }
+
+        console.log(`✏️  Edited message ${messageId}`);
+        res.status(200).json({ success: true });
+    } catch (error) {
+        console.error(`❌ Failed to edit message ${messageId}:`, error);
+        res.status(500).json({
+            success: false,
+            error: 'Message could not be edited'
+        });
+    }
+});
+
 // Get chat info endpoint (useful for debugging)
 app.get('/chat-info/:chatId', async (req, res) => {
     const { chatId } = req.params;
@@ -273,8 +580,15 @@ app.listen(PORT, () => {
     console.log('📋 Available endpoints:');
     console.log('   GET  /health - Check service status');
     console.log('   GET  /get-messages - Retrieve queued messages');
+    console.log('   GET  /poll-messages - Long-poll for queued messages (acknowledged batches)');
+    console.log('   POST /ack-messages - Acknowledge a polled batch');
+    console.log('   GET  /metrics - Queue depth and delivery counters (Prometheus)');
+    console.log('   GET  /media/:mediaId - Download a received file');
+    console.log('   DELETE /media/:mediaId - Discard a received file once forwarded');
+    console.log('   POST /media - Upload a file to send (raw bytes)');
     console.log('   POST /send-message - Send a message');
     console.log('   POST /delete-message - Delete a message');
+    console.log('   POST /edit-message - Edit a sent message');
     console.log('   GET  /chat-info/:chatId - Get chat information');
 });
 